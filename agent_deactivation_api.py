@@ -1,21 +1,16 @@
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
-from jsonschema import validate, ValidationError
-from agent_registration_db import deactivate_agent
+from agent_registration_db import deactivate_agent, deactivate_agents, get_agent_certificate_pem
+from registry_federation import FEDERATION, refer_delegated_write
+from rate_limiter import WRITE_LIMITER, admission_controlled, rate_limit_keys, send_too_many_requests
+from registration_journal import drain_journals
+from api_common import KeepAliveMixin, authenticated_peer_pem, enable_tls, PRELOAD, preload, read_json_body, same_certificate, tls_configured, validate_json_schema
 
-SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(SCHEMA_DIR, 'agent_deactivation_request_schema.json'), 'r') as f:
-    DEACTIVATION_REQUEST_SCHEMA = json.load(f)
-with open(os.path.join(SCHEMA_DIR, 'agent_deactivation_response_schema.json'), 'r') as f:
-    DEACTIVATION_RESPONSE_SCHEMA = json.load(f)
-
-def validate_json_schema(data, schema):
-    try:
-        validate(instance=data, schema=schema)
-        return True, ''
-    except ValidationError as e:
-        return False, str(e)
+# JSON Schemas and validators are loaded on first use (see api_common.py)
+DEACTIVATION_REQUEST_SCHEMA = 'agent_deactivation_request_schema.json'
+DEACTIVATION_RESPONSE_SCHEMA = 'agent_deactivation_response_schema.json'
+BULK_DEACTIVATION_REQUEST_SCHEMA = 'agent_bulk_deactivation_request_schema.json'
 
 def make_deactivation_response(agentName, success=True, error_message=None):
     if success:
@@ -29,21 +24,35 @@ def make_deactivation_response(agentName, success=True, error_message=None):
             "errorMessage": error_message or "Invalid deactivation request."
         }
 
-class DeactivationHandler(BaseHTTPRequestHandler):
+def make_bulk_deactivation_response(agent_names):
+    return {
+        "status": "success",
+        "deactivatedAgents": agent_names,
+        "count": len(agent_names)
+    }
+
+class DeactivationHandler(KeepAliveMixin, BaseHTTPRequestHandler):
+    federation = FEDERATION
+
+    @admission_controlled
     def do_POST(self):
-        if self.path != '/deactivate':
+        if self.path not in ('/deactivate', '/deactivate/bulk'):
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b'Not Found')
             return
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        try:
-            request_json = json.loads(body)
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b'Invalid JSON')
+        ok, request_json = read_json_body(self)
+        if not ok:
+            return
+        # Per-agent rate limit, checked before any schema or certificate work
+        retry_after = WRITE_LIMITER.check(rate_limit_keys(request_json))
+        if retry_after:
+            send_too_many_requests(self, retry_after)
+            return
+        if refer_delegated_write(self, request_json, 'deactivation', self.path):
+            return
+        if self.path == '/deactivate/bulk':
+            self.handle_bulk_deactivation(request_json)
             return
         valid, error = validate_json_schema(request_json, DEACTIVATION_REQUEST_SCHEMA)
         if not valid:
@@ -58,7 +67,9 @@ class DeactivationHandler(BaseHTTPRequestHandler):
             version = request_json.get("version")
             extension = request_json.get("extension")  # Optional
             try:
-                found = deactivate_agent(agent_name)
+                # Registrations still in a journal would otherwise land after this and re-activate the agent
+                drain_journals()
+                found = deactivate_agent(agent_name, provider_name, agent_category)
                 if not found:
                     response = make_deactivation_response(agent_name, success=False, error_message="Agent not found.")
                     self.send_response(404)
@@ -72,9 +83,69 @@ class DeactivationHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(response).encode('utf-8'))
 
-def run(server_class=HTTPServer, handler_class=DeactivationHandler, port=8082):
+    def handle_bulk_deactivation(self, request_json):
+        """
+        Deactivate every agent under an identity prefix: providerName, optionally
+        narrowed by agentCategory and then version. One indexed UPDATE per shard.
+        The requestingAgent must be an active agent of that provider, and the caller
+        must prove it is that agent: the connection has to be mutual TLS with the
+        certificate the agent registered with, issued by the registry's CA.
+        """
+        valid, error = validate_json_schema(request_json, BULK_DEACTIVATION_REQUEST_SCHEMA)
+        if not valid:
+            response = make_deactivation_response(None, success=False, error_message=error)
+            self.send_response(400)
+        elif not self.authorize_bulk_deactivation(request_json):
+            return
+        else:
+            try:
+                drain_journals()
+                names = deactivate_agents(request_json["providerName"], request_json.get("agentCategory"), request_json.get("version"))
+                if not names:
+                    response = make_deactivation_response(None, success=False, error_message="No active agents match.")
+                    self.send_response(404)
+                else:
+                    response = make_bulk_deactivation_response(names)
+                    self.send_response(200)
+            except Exception as e:
+                response = make_deactivation_response(None, success=False, error_message=str(e))
+                self.send_response(500)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+    def authorize_bulk_deactivation(self, request_json):
+        """True if the requester may deactivate the providerName; else sends 401/403 and returns False."""
+        requester = request_json["requestingAgent"]
+        peer_pem = authenticated_peer_pem(self)
+        if peer_pem is None:
+            return self.send_bulk_failure(401, "Bulk deactivation requires a TLS client certificate issued by the registry CA.")
+        if not same_certificate(requester["certificate"]["certificatePEM"], peer_pem):
+            return self.send_bulk_failure(401, "requestingAgent.certificate does not match the TLS client certificate.")
+        if requester["providerName"] != request_json["providerName"]:
+            return self.send_bulk_failure(403, "requestingAgent must belong to the provider being deactivated.")
+        try:
+            registered_pem = get_agent_certificate_pem(requester["agentName"], requester["providerName"], requester["agentCategory"])
+        except Exception as e:
+            return self.send_bulk_failure(500, str(e))
+        if not same_certificate(registered_pem, peer_pem):
+            return self.send_bulk_failure(403, "requestingAgent is not an active agent registered with this certificate.")
+        return True
+
+    def send_bulk_failure(self, code, message):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(make_deactivation_response(None, success=False, error_message=message)).encode('utf-8'))
+        return False
+
+def run(server_class=ThreadingHTTPServer, handler_class=DeactivationHandler, port=8082):
+    if PRELOAD:
+        preload([DEACTIVATION_REQUEST_SCHEMA, BULK_DEACTIVATION_REQUEST_SCHEMA])
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
+    if tls_configured():
+        enable_tls(httpd)
     print(f'Starting deactivation server on port {port}...')
     httpd.serve_forever()
 
@@ -0,0 +1,258 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, selects_at_random
+from capability_registry import CapabilityRegistry
+from registry_versions import etag_matches, http_date
+import agent_registration_db
+from registry_replication import Replica
+from agent_health import parse_feedback
+from registry_federation import FEDERATION, ZONE_HEADER, FederationError, check_hops, refer_delegated_write, send_json
+from request_profiler import stage
+from api_common import KeepAliveMixin, authenticated_peer_pem, enable_tls, PRELOAD, read_json_body, same_certificate, tls_configured
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The registry and its indexes are not safe for concurrent mutation, so requests
+# on the threaded server hold this lock while they use them. Buffered responses are
+# written after it is released; an NDJSON stream holds it until the stream ends.
+REGISTRY_LOCK = threading.Lock()
+
+TOOL = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=os.path.join(SCHEMA_DIR, "ca.pem"))
+AGENT_REGISTRY = CapabilityRegistry()
+
+def apply_advertisement(profile):
+    AGENT_REGISTRY[profile["agentDID"]] = profile
+
+def apply_deactivation(data):
+    # A single deactivation names the agent; a bulk one only the identity prefix
+    if data.get("providerName") is None:
+        for did in [did for did, profile in AGENT_REGISTRY.items() if profile.get("agentName") == data["agentName"]]:
+            del AGENT_REGISTRY[did]
+        return
+    AGENT_REGISTRY.remove_matching(data["providerName"], data.get("agentCategory"), data.get("version"), data.get("agentName"))
+
+# A discovery replica rebuilds its registry from the advertisements the primary
+# appended to the change log (see registry_replication.py), and drops the
+# profiles of agents deactivated there.
+REPLICA_APPLIERS = {
+    "advertise": apply_advertisement,
+    "deactivate": apply_deactivation,
+    "deactivate_bulk": apply_deactivation,
+}
+REPLICA = None
+if agent_registration_db.REGISTRY_ROLE == 'replica':
+    REPLICA = Replica(agent_registration_db.CHANGE_LOG_PATH, REPLICA_APPLIERS)
+
+# Failure messages caused by the request itself (400) rather than an empty result (404)
+CLIENT_ERRORS = ("Request validation error", "Invalid query filters", "Invalid pagination")
+# NDJSON records written per socket write
+STREAM_BATCH = 64
+
+class DiscoveryHandler(KeepAliveMixin, BaseHTTPRequestHandler):
+    tool = TOOL
+    registry = AGENT_REGISTRY
+    replica = REPLICA
+    lock = REGISTRY_LOCK
+    federation = FEDERATION
+
+    def do_POST(self):
+        if self.path not in ('/discover', '/advertise', '/feedback'):
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b'Not Found')
+            return
+        ok, request_json = read_json_body(self)
+        if not ok:
+            return
+        if self.path == '/feedback':
+            self.handle_feedback(request_json)
+            return
+        if self.path == '/advertise' and refer_delegated_write(self, request_json, 'discovery'):
+            return
+        if self.path == '/discover' and self.federation is not None:
+            # Discovery scoped to a delegated zone (queryParameters.providerName and
+            # optionally agentCategory) is answered by that zone's registry.
+            query = request_json.get("queryParameters") if isinstance(request_json, dict) else None
+            if isinstance(query, dict):
+                zone, upstream = self.federation.upstream('discovery', query.get("providerName"), query.get("agentCategory"))
+                if upstream is not None:
+                    self.send_delegated_discovery(zone, upstream, request_json)
+                    return
+        with stage("registry_lock"):
+            self.lock.acquire()
+        try:
+            self.handle_request(request_json)
+        finally:
+            self.lock.release()
+
+    def handle_request(self, request_json):
+        if self.path == '/advertise':
+            if self.replica is not None:
+                self.send_response(403)
+                self.end_headers()
+                self.wfile.write(b'Read-only replica')
+                return
+            response = self.tool.handle_advertisement(request_json, self.registry)
+            if response["status"] == "success":
+                agent_registration_db.record_change('advertise', response["respondingAgent"])
+            self.send_response(200 if response["status"] == "success" else 400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+            return
+        if self.replica is not None:
+            # Runs under the registry lock (see do_POST): applying the log adds and
+            # removes profiles, so it must not overlap a scan
+            self.replica.ensure_fresh(agent_registration_db.REPLICA_MAX_STALENESS)
+        # The request is validated first, so a malformed one gets its 400 and never a 304
+        with stage("discovery.plan"):
+            failure, plan = self.tool.plan_discovery(request_json)
+        if failure is not None:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(failure).encode('utf-8'))
+            return
+        # Discovery is a read: the result set of a capability carries a version, so a
+        # client repeating the same query with If-None-Match gets 304 without the
+        # registry scan and certificate checks.
+        # The JSON and NDJSON representations are different bodies, so they get different ETags
+        stream = 'application/x-ndjson' in self.headers.get('Accept', '')
+        etag = last_modified = None
+        # A load-aware pick is made per request; a cached answer would pin every
+        # client to one agent, so these are sent without an ETag and not to be stored
+        if not selects_at_random(plan):
+            etag, last_modified = self.registry.result_etag(request_json["requestingAgent"]["agentCapability"], plan.query,
+                                                            'application/x-ndjson' if stream else 'application/json')
+        if etag is not None and etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', http_date(last_modified))
+            self.send_header('Vary', 'Accept')
+            self.end_headers()
+            return
+        if stream:
+            self.stream_discovery(request_json, etag, last_modified, plan)
+            return
+        response = self.tool.handle_discovery(request_json, self.registry, plan)
+        if response["status"] == "success":
+            self.send_response(200)
+            self.send_version_headers(etag, last_modified)
+        elif response["errorMessage"].startswith(CLIENT_ERRORS):
+            self.send_response(400)
+        else:
+            self.send_response(404)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+    def send_version_headers(self, etag, last_modified):
+        if etag is None:
+            self.send_header('Cache-Control', 'no-store')
+            return
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', http_date(last_modified))
+        self.send_header('Vary', 'Accept')
+
+    def send_delegated_discovery(self, zone, upstream, request_json):
+        hops = check_hops(self)
+        if hops is None:
+            return
+        try:
+            status_code, response, headers = self.federation.discover(upstream, request_json, hops)
+        except FederationError as e:
+            send_json(self, e.status, {"status": "failure", "errorMessage": f"Delegated registry failed: {e}", "respondingAgent": None})
+            return
+        send_json(self, status_code, response, dict(headers, **{ZONE_HEADER: zone}))
+
+    def handle_feedback(self, request_json):
+        """
+        Fold observed latency/error reports into the registry's health table, which
+        load-aware discovery selection reads. Reports for unknown agents are ignored.
+        The reporter must prove it is an advertised agent: the connection has to be
+        mutual TLS, verified against the registry's CA, with the certificate that
+        requestingAgent.agentDID advertised. A certificate in the body alone is not
+        enough, since discovery hands out every agent's certificate. The registry
+        lock is held only to look up the reporter, the table and the reported
+        agents; the table has its own lock for the updates.
+        """
+        try:
+            reports = parse_feedback(request_json)
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"status": "failure", "errorMessage": f"Invalid feedback: {e}"}).encode('utf-8'))
+            return
+        peer_pem = authenticated_peer_pem(self)
+        if peer_pem is None:
+            self.send_feedback_failure(401, "Feedback requires a TLS client certificate issued by the registry CA.")
+            return
+        requester = request_json.get("requestingAgent")
+        reporter_did = requester.get("agentDID") if isinstance(requester, dict) else None
+        with self.lock:
+            reporter = self.registry.get(reporter_did) if isinstance(reporter_did, str) else None
+            registered_pem = ((reporter or {}).get("certificate") or {}).get("certificatePEM")
+            if not same_certificate(registered_pem, peer_pem):
+                reporter = None
+            else:
+                health = self.registry.health_table()
+                known = [report for report in reports if report[0] in self.registry]
+        if reporter is None:
+            self.send_feedback_failure(403, "requestingAgent.agentDID is not an agent advertised with the TLS client certificate.")
+            return
+        for did, latency_ms, error in known:
+            health.record(did, latency_ms, error)
+        recorded = len(known)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": "success", "errorMessage": None, "recorded": recorded, "ignored": len(reports) - recorded}).encode('utf-8'))
+
+    def send_feedback_failure(self, code, message):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": "failure", "errorMessage": message}).encode('utf-8'))
+
+    def stream_discovery(self, request_json, etag, last_modified, plan=None):
+        """
+        Write the discovery result as newline-delimited JSON: one record per match as
+        it is produced, then a trailer record with the count and nextCursor. The
+        body is delimited by closing the connection.
+        """
+        failure, records = self.tool.stream_discovery(request_json, self.registry, plan)
+        if failure is not None:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(failure).encode('utf-8'))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_version_headers(etag, last_modified)
+        self.send_header('Connection', 'close')
+        self.stream_response()
+        batch = []
+        for record in records:
+            batch.append(json.dumps(record))
+            if len(batch) == STREAM_BATCH:
+                self.wfile.write(("\n".join(batch) + "\n").encode('utf-8'))
+                batch = []
+        if batch:
+            self.wfile.write(("\n".join(batch) + "\n").encode('utf-8'))
+
+def run(server_class=ThreadingHTTPServer, handler_class=DiscoveryHandler, port=8084):
+    if PRELOAD:
+        handler_class.tool.preload()
+    server_address = ('', port)
+    httpd = server_class(server_address, handler_class)
+    if tls_configured():
+        enable_tls(httpd)
+    print(f'Starting discovery server on port {port}...')
+    httpd.serve_forever()
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,441 @@
+"""
+agent_dns_client.py
+Python client for the Agent DNS APIs: register, renew, deactivate, status and discover.
+
+- Each client holds one requests.Session with a pooled HTTPAdapter. The servers speak
+  HTTP/1.1 keep-alive, so connections are reused across calls and threads instead
+  of being opened per request.
+- status() and discover() answers are cached locally. A status stays fresh for the
+  server's Cache-Control max-age. A discovery result stays fresh for discovery_ttl.
+  After that, for stale_ttl more seconds, the cached answer is returned at once
+  while one background request revalidates it with If-None-Match.
+- status_many() looks up many agents with a single POST /status/batch.
+  AsyncAgentDNSClient gathers concurrent status() calls into such batches
+  automatically.
+
+Usage:
+    client = AgentDNSClient()
+    client.register(registration_request)
+    client.status("TranslatorB")            # -> "active" / "inactive" / None
+    client.discover(discovery_request)      # -> (200, {...})
+"""
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URLS = {
+    "register": "http://localhost:8080/register",
+    "renew": "http://localhost:8081/renew",
+    "deactivate": "http://localhost:8082/deactivate",
+    "deactivate_bulk": "http://localhost:8082/deactivate/bulk",
+    "status": "http://localhost:8083/status",
+    "status_batch": "http://localhost:8083/status/batch",
+    "advertise": "http://localhost:8084/advertise",
+    "discover": "http://localhost:8084/discover",
+    "feedback": "http://localhost:8084/feedback",
+}
+# Must not exceed the server's AGENT_MAX_STATUS_BATCH.
+MAX_STATUS_BATCH = 100
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class AgentDNSError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"HTTP {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class ResolutionCache:
+    """Bounded LRU of resolved answers with a fresh period and a stale-while-revalidate period."""
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> [value, etag, fresh_until, stale_until, refreshing]
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Return ("fresh" | "stale" | "miss", value, etag). Only one caller per key sees "stale"."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return "miss", None, None
+            now = self.clock()
+            if now < entry[2]:
+                self._entries.move_to_end(key)
+                return "fresh", entry[0], entry[1]
+            if now < entry[3] and not entry[4]:
+                entry[4] = True
+                return "stale", entry[0], entry[1]
+            if now < entry[3]:
+                # Someone is already revalidating; keep serving the stale value
+                return "fresh", entry[0], entry[1]
+            return "miss", entry[0], entry[1]
+
+    def store(self, key, value, etag, ttl, stale_ttl):
+        now = self.clock()
+        with self._lock:
+            self._entries[key] = [value, etag, now + ttl, now + ttl + stale_ttl, False]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def release(self, key):
+        """A background revalidation failed: let the next stale read retry it."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[4] = False
+
+    def invalidate(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+
+def _max_age(response, default):
+    match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+    return int(match.group(1)) if match else default
+
+
+def _status_key(lookup):
+    if isinstance(lookup, str):
+        return ("status", lookup, None, None)
+    agent_name, provider_name, agent_category = (tuple(lookup) + (None, None))[:3]
+    return ("status", agent_name, provider_name, agent_category)
+
+
+def _body(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+class AgentDNSClient:
+    def __init__(self, urls=None, timeout=10, pool_size=10, status_ttl=5, discovery_ttl=5, stale_ttl=30, cache=None,
+                 cert=None, verify=True):
+        """
+        urls: overrides for DEFAULT_URLS. status_ttl is used when the server sends no
+        max-age; stale_ttl=0 disables stale-while-revalidate. For servers behind the
+        mutual-TLS front door use https URLs, cert=(cert_path, key_path) for the
+        agent's client certificate and verify=<CA bundle path>.
+        """
+        self.urls = dict(DEFAULT_URLS, **(urls or {}))
+        self.timeout = timeout
+        self.status_ttl = status_ttl
+        self.discovery_ttl = discovery_ttl
+        self.stale_ttl = stale_ttl
+        self.cache = cache if cache is not None else ResolutionCache()
+        self.session = requests.Session()
+        self.session.cert = cert
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=len(self.urls), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+        if self._refresher is not None:
+            self._refresher.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _post(self, name, payload, headers=None):
+        return self.session.post(self.urls[name], json=payload, headers=headers, timeout=self.timeout)
+
+    # Writes
+
+    def register(self, request_json):
+        """POST /register. Returns (status_code, body)."""
+        response = self._post("register", request_json)
+        self._forget_agent(request_json.get("requestingAgent", {}).get("agentName"))
+        return response.status_code, _body(response)
+
+    def renew(self, request_json):
+        """POST /renew. Returns (status_code, body)."""
+        response = self._post("renew", request_json)
+        self._forget_agent(request_json.get("requestingAgent", {}).get("agentName"))
+        return response.status_code, _body(response)
+
+    def deactivate(self, request_json):
+        """POST /deactivate. Returns (status_code, body)."""
+        response = self._post("deactivate", request_json)
+        self._forget_agent(request_json.get("agentName"))
+        return response.status_code, _body(response)
+
+    def deactivate_bulk(self, requesting_agent, provider_name, agent_category=None, version=None):
+        """
+        POST /deactivate/bulk for an identity prefix. requesting_agent is an active
+        agent of the same provider, with the certificate it registered with; the
+        client must present that certificate over TLS (cert=(cert_path, key_path)).
+        Returns (status_code, body).
+        """
+        request_json = {"providerName": provider_name, "requestingAgent": requesting_agent}
+        if agent_category is not None:
+            request_json["agentCategory"] = agent_category
+        if version is not None:
+            request_json["version"] = version
+        response = self._post("deactivate_bulk", request_json)
+        body = _body(response)
+        if response.status_code == 200:
+            names = set(body.get("deactivatedAgents", []))
+            self.cache.invalidate(lambda key: key[0] == "status" and key[1] in names)
+        return response.status_code, body
+
+    def advertise(self, request_json):
+        """POST /advertise. Returns (status_code, body)."""
+        response = self._post("advertise", request_json)
+        self.cache.invalidate(lambda key: key[0] == "discover")
+        return response.status_code, _body(response)
+
+    def feedback(self, requesting_agent, agent_did, latency_ms=None, success=True):
+        """
+        Report an observed call to an agent (POST /feedback) for load-aware discovery.
+        requesting_agent is the reporting agent's advertised profile; the client must
+        present that profile's certificate over TLS (cert=(cert_path, key_path)).
+        """
+        report = {"agentDID": agent_did, "success": success}
+        if latency_ms is not None:
+            report["latencyMs"] = latency_ms
+        return self.feedback_many(requesting_agent, [report])
+
+    def feedback_many(self, requesting_agent, reports):
+        """POST /feedback with several {"agentDID", "latencyMs", "success"} reports. Returns (status_code, body)."""
+        response = self._post("feedback", {"requestingAgent": requesting_agent, "reports": reports})
+        return response.status_code, _body(response)
+
+    def _forget_agent(self, agent_name):
+        if agent_name:
+            self.cache.invalidate(lambda key: key[0] == "status" and key[1] == agent_name)
+
+    # Reads
+
+    def _revalidate_in_background(self, key, fetch):
+        if self._refresher is None:
+            with self._refresher_lock:
+                if self._refresher is None:
+                    self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent-dns-refresh")
+
+        def refresh():
+            try:
+                fetch()
+            except Exception:
+                for stale_key in (key if isinstance(key, list) else [key]):
+                    self.cache.release(stale_key)
+        self._refresher.submit(refresh)
+
+    def _cached(self, key, fetch):
+        state, value, etag = self.cache.lookup(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            self._revalidate_in_background(key, lambda: fetch(value, etag))
+            return value
+        return fetch(value, etag)
+
+    def status(self, agent_name, provider_name=None, agent_category=None):
+        """Return the agent's status ("active", "inactive", ...) or None if unknown."""
+        key = _status_key((agent_name, provider_name, agent_category))
+        return self._cached(key, lambda value, etag: self._fetch_status(key, value, etag))
+
+    def _fetch_status(self, key, cached_value, etag):
+        _, agent_name, provider_name, agent_category = key
+        params = {"agentName": agent_name}
+        if provider_name:
+            params["providerName"] = provider_name
+        if agent_category:
+            params["agentCategory"] = agent_category
+        headers = {"If-None-Match": etag} if etag else None
+        response = self.session.get(self.urls["status"], params=params, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            value, etag = cached_value, response.headers.get("ETag", etag)
+        elif response.status_code == 200:
+            value, etag = response.json()["status"], response.headers.get("ETag")
+        elif response.status_code == 404:
+            value, etag = None, None
+        else:
+            self.cache.release(key)
+            raise AgentDNSError(response.status_code, _body(response))
+        self.cache.store(key, value, etag, _max_age(response, self.status_ttl), self.stale_ttl)
+        return value
+
+    def status_many(self, lookups):
+        """
+        lookups: agent names or (agent_name, provider_name, agent_category) tuples.
+        Returns the statuses in the same order. Cached answers are reused (stale ones
+        are revalidated in the background); the rest are fetched with POST
+        /status/batch, MAX_STATUS_BATCH agents per request.
+        """
+        keys = [_status_key(item) for item in lookups]
+        results = {}
+        missing = []
+        stale = []
+        for key in keys:
+            state, value, _ = self.cache.lookup(key)
+            if state == "miss":
+                missing.append(key)
+            else:
+                results[key] = value
+                if state == "stale":
+                    stale.append(key)
+        if stale:
+            self._revalidate_in_background(stale, lambda: self._fetch_status_batch(stale))
+        results.update(self._fetch_status_batch(list(dict.fromkeys(missing))))
+        return [results[key] for key in keys]
+
+    def _fetch_status_batch(self, keys):
+        results = {}
+        for start in range(0, len(keys), MAX_STATUS_BATCH):
+            chunk = keys[start:start + MAX_STATUS_BATCH]
+            agents = [{"agentName": name, "providerName": provider, "agentCategory": category}
+                      for _, name, provider, category in chunk]
+            response = self._post("status_batch", {"agents": agents})
+            if response.status_code != 200:
+                for key in keys[start:]:
+                    self.cache.release(key)
+                raise AgentDNSError(response.status_code, _body(response))
+            ttl = _max_age(response, self.status_ttl)
+            for key, result in zip(chunk, response.json()["results"]):
+                value = result["status"] if result["status"] != "not found" else None
+                self.cache.store(key, value, result.get("etag"), ttl, self.stale_ttl)
+                results[key] = value
+        return results
+
+    def discover(self, request_json, use_cache=True):
+        """
+        POST /discover. Returns (status_code, body). Successful answers are cached
+        and revalidated with the ETag the server returned.
+        """
+        if not use_cache:
+            response = self._post("discover", request_json)
+            return response.status_code, _body(response)
+        digest = hashlib.sha1(json.dumps(request_json, sort_keys=True).encode("utf-8")).hexdigest()
+        key = ("discover", digest)
+        state, value, etag = self.cache.lookup(key)
+        if state == "fresh":
+            return 200, value
+        if state == "stale":
+            self._revalidate_in_background(key, lambda: self._fetch_discovery(key, request_json, value, etag))
+            return 200, value
+        return self._fetch_discovery(key, request_json, value, etag)
+
+    def _fetch_discovery(self, key, request_json, cached_value, etag):
+        headers = {"If-None-Match": etag} if etag else None
+        response = self._post("discover", request_json, headers=headers)
+        if response.status_code == 304:
+            self.cache.store(key, cached_value, response.headers.get("ETag", etag), self.discovery_ttl, self.stale_ttl)
+            return 200, cached_value
+        body = _body(response)
+        # no-store marks a load-aware pick that must not be reused for later calls
+        if response.status_code == 200 and "no-store" not in response.headers.get("Cache-Control", ""):
+            self.cache.store(key, body, response.headers.get("ETag"), self.discovery_ttl, self.stale_ttl)
+        else:
+            self.cache.release(key)
+        return response.status_code, body
+
+
+class AsyncAgentDNSClient:
+    """
+    asyncio front end over AgentDNSClient. Requests run on the shared connection pool
+    in worker threads. status() calls made in the same batch_window are sent together
+    as one POST /status/batch.
+    """
+    def __init__(self, client=None, batch_window=0.002, **kwargs):
+        self.client = client or AgentDNSClient(**kwargs)
+        self.batch_window = batch_window
+        self._pending = {}   # key -> future
+        self._flush_handle = None
+
+    async def close(self):
+        await asyncio.to_thread(self.client.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def register(self, request_json):
+        return await asyncio.to_thread(self.client.register, request_json)
+
+    async def renew(self, request_json):
+        return await asyncio.to_thread(self.client.renew, request_json)
+
+    async def deactivate(self, request_json):
+        return await asyncio.to_thread(self.client.deactivate, request_json)
+
+    async def deactivate_bulk(self, requesting_agent, provider_name, agent_category=None, version=None):
+        return await asyncio.to_thread(self.client.deactivate_bulk, requesting_agent, provider_name, agent_category, version)
+
+    async def advertise(self, request_json):
+        return await asyncio.to_thread(self.client.advertise, request_json)
+
+    async def discover(self, request_json, use_cache=True):
+        return await asyncio.to_thread(self.client.discover, request_json, use_cache)
+
+    async def feedback(self, requesting_agent, agent_did, latency_ms=None, success=True):
+        return await asyncio.to_thread(self.client.feedback, requesting_agent, agent_did, latency_ms, success)
+
+    async def status_many(self, lookups):
+        return await asyncio.to_thread(self.client.status_many, lookups)
+
+    async def status(self, agent_name, provider_name=None, agent_category=None):
+        key = _status_key((agent_name, provider_name, agent_category))
+        state, value, _ = self.client.cache.lookup(key)
+        if state == "fresh":
+            return value
+        future = self._enqueue(key)
+        if state == "stale":
+            # Answer from the cache; the batch revalidates the entry in the background
+            return value
+        return await asyncio.shield(future)
+
+    def _enqueue(self, key):
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            # Nobody may await a background revalidation; don't warn about its errors
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            if len(self._pending) >= MAX_STATUS_BATCH:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._resolve_batch(batch))
+
+    async def _resolve_batch(self, batch):
+        keys = list(batch)
+        try:
+            statuses = await asyncio.to_thread(self.client._fetch_status_batch, keys)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            if not batch[key].done():
+                batch[key].set_result(statuses[key])
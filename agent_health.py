@@ -0,0 +1,185 @@
+"""
+agent_health.py
+Live latency and error statistics per agent, fed by client/agent reports to
+POST /feedback and used by discovery to steer traffic away from slow or failing
+agents.
+
+HealthTable keeps, per agentDID, an exponentially time-decayed mean latency and
+error rate, each with the decayed number of samples behind it. All of it lives in
+parallel arrays of doubles (40 bytes per tracked agent). Observations lose half of
+their weight every HEALTH_HALF_LIFE seconds, so an agent's estimate drifts back to
+its advertised latency once reports stop.
+
+Selection among equally matching agents:
+- "p2c" (power of two choices): pick two candidates at random and take the one with
+  the lower expected cost. This spreads load while still avoiding bad agents.
+- "weighted": pick one candidate at random with probability proportional to 1/cost.
+The expected cost is latency / (1 - error rate): the time a caller should expect to
+spend before getting a successful answer when failed calls are retried.
+"""
+import math
+import os
+import random
+import threading
+import time
+from array import array
+
+HEALTH_HALF_LIFE = float(os.environ.get("AGENT_HEALTH_HALF_LIFE", "30"))
+MAX_TRACKED_AGENTS = int(os.environ.get("AGENT_HEALTH_MAX_TRACKED", str(2 ** 20)))
+# Latency assumed for agents that advertise none and have no reports yet.
+DEFAULT_LATENCY_MS = 200.0
+# Weight (in samples) given to the advertised latency when blending it with reports.
+PRIOR_WEIGHT = 1.0
+# Error rates are capped so that an always-failing agent has a large but finite cost.
+MAX_ERROR_RATE = 0.99
+# Slots sampled when the table is full; the least recently updated one is evicted.
+EVICTION_SAMPLE = 8
+
+
+class HealthTable:
+    def __init__(self, half_life=HEALTH_HALF_LIFE, max_agents=MAX_TRACKED_AGENTS, clock=time.monotonic, rng=None):
+        self.half_life = half_life
+        self.max_agents = max_agents
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._slots = {}     # agentDID -> slot
+        self._dids = []      # slot -> agentDID
+        self._free = []
+        self._latency = array("d")
+        self._latency_weight = array("d")
+        self._errors = array("d")
+        self._weight = array("d")
+        self._stamp = array("d")
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _decay(self, slot, now):
+        return 0.5 ** (max(0.0, now - self._stamp[slot]) / self.half_life)
+
+    def _allocate(self, did, now):
+        if self._free:
+            slot = self._free.pop()
+            self._dids[slot] = did
+        elif len(self._dids) < self.max_agents:
+            slot = len(self._dids)
+            self._dids.append(did)
+            for column in (self._latency, self._latency_weight, self._errors, self._weight, self._stamp):
+                column.append(0.0)
+        else:
+            sample = self.rng.sample(range(len(self._dids)), min(EVICTION_SAMPLE, len(self._dids)))
+            slot = min(sample, key=lambda s: self._stamp[s])
+            del self._slots[self._dids[slot]]
+            self._dids[slot] = did
+        self._slots[did] = slot
+        self._latency[slot] = self._latency_weight[slot] = self._errors[slot] = self._weight[slot] = 0.0
+        self._stamp[slot] = now
+        return slot
+
+    def record(self, did, latency_ms=None, error=False):
+        """Fold one observation into the agent's statistics. latency_ms may be None for a bare error report."""
+        now = self.clock()
+        with self._lock:
+            slot = self._slots.get(did)
+            if slot is None:
+                slot = self._allocate(did, now)
+            decay = self._decay(slot, now)
+            if latency_ms is not None:
+                old = self._latency_weight[slot] * decay
+                self._latency[slot] = (self._latency[slot] * old + latency_ms) / (old + 1.0)
+                self._latency_weight[slot] = old + 1.0
+            else:
+                # A bare error report leaves the latency estimate alone, only older
+                self._latency_weight[slot] *= decay
+            old = self._weight[slot] * decay
+            self._errors[slot] = (self._errors[slot] * old + (1.0 if error else 0.0)) / (old + 1.0)
+            self._weight[slot] = old + 1.0
+            self._stamp[slot] = now
+
+    def forget(self, did):
+        with self._lock:
+            slot = self._slots.pop(did, None)
+            if slot is not None:
+                self._dids[slot] = None
+                self._free.append(slot)
+
+    def stats(self, did):
+        """
+        Return (latency_ms, latency_samples, error_rate, error_samples) with the
+        current decay applied to the sample counts, or None for an unknown agent.
+        """
+        with self._lock:
+            slot = self._slots.get(did)
+            if slot is None:
+                return None
+            decay = self._decay(slot, self.clock())
+            return self._latency[slot], self._latency_weight[slot] * decay, self._errors[slot], self._weight[slot] * decay
+
+    def expected_cost(self, did, prior_latency_ms=None):
+        """Expected milliseconds until a successful call, blending reports with the advertised latency."""
+        prior = prior_latency_ms if prior_latency_ms is not None else DEFAULT_LATENCY_MS
+        stats = self.stats(did)
+        if stats is None:
+            return prior
+        latency, latency_samples, error_rate, error_samples = stats
+        latency = (latency * latency_samples + prior * PRIOR_WEIGHT) / (latency_samples + PRIOR_WEIGHT)
+        error_rate = min(MAX_ERROR_RATE, error_rate * error_samples / (error_samples + PRIOR_WEIGHT))
+        return latency / (1.0 - error_rate)
+
+    def profile_cost(self, profile):
+        advertised = (profile.get("additionalCapabilities") or {}).get("latency")
+        if isinstance(advertised, bool) or not isinstance(advertised, (int, float)) or not math.isfinite(advertised):
+            advertised = None
+        return self.expected_cost(profile.get("agentDID"), advertised)
+
+    def selection_order(self, candidates, mode="p2c"):
+        """
+        Yield candidate profiles in the order they should be tried. The first one is
+        the selection; the rest are fallbacks (e.g. when its certificate turns out to
+        be invalid), each chosen from the remaining candidates the same way.
+        """
+        if mode == "first":
+            yield from candidates
+            return
+        remaining = list(candidates)
+        while remaining:
+            if mode == "weighted":
+                weights = [1.0 / max(self.profile_cost(profile), 1e-6) for profile in remaining]
+                index = self.rng.choices(range(len(remaining)), weights=weights)[0]
+            elif len(remaining) > 1:
+                a, b = self.rng.sample(range(len(remaining)), 2)
+                index = a if self.profile_cost(remaining[a]) <= self.profile_cost(remaining[b]) else b
+            else:
+                index = 0
+            # Swap-remove keeps each step O(1) apart from the cost lookups
+            remaining[index], remaining[-1] = remaining[-1], remaining[index]
+            yield remaining.pop()
+
+
+def parse_feedback(payload):
+    """
+    Normalise a feedback body into [(agentDID, latency_ms or None, error)]. Accepts a
+    single report or {"reports": [...]}, where a report is
+    {"agentDID": ..., "latencyMs": number, "success": bool}. Raises ValueError.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("feedback must be an object")
+    reports = payload["reports"] if "reports" in payload else [payload]
+    if not isinstance(reports, list) or not reports:
+        raise ValueError("'reports' must be a non-empty list")
+    parsed = []
+    for report in reports:
+        if not isinstance(report, dict) or not isinstance(report.get("agentDID"), str):
+            raise ValueError("each report needs an agentDID")
+        latency = report.get("latencyMs")
+        if latency is not None and (isinstance(latency, bool) or not isinstance(latency, (int, float))
+                                    or not math.isfinite(latency) or latency < 0):
+            raise ValueError("latencyMs must be a non-negative number")
+        success = report.get("success", True)
+        if not isinstance(success, bool):
+            raise ValueError("success must be a boolean")
+        if latency is None and success:
+            raise ValueError("a successful report needs latencyMs")
+        parsed.append((report["agentDID"], latency, not success))
+    return parsed
@@ -1,28 +1,15 @@
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
-from jsonschema import validate, ValidationError
-from agent_registration_db import insert_registration
+from registration_journal import journal_for, store_registration
 import datetime
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-import base64
+from registry_federation import FEDERATION, refer_delegated_write
+from rate_limiter import WRITE_LIMITER, admission_controlled, rate_limit_keys, send_too_many_requests
+from api_common import KeepAliveMixin, enable_tls, PRELOAD, preload, read_json_body, tls_configured, validate_json_schema, verify_request_certificate
 
-# Load JSON Schemas
-SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(SCHEMA_DIR, 'agent_registration_request_schema.json'), 'r') as f:
-    REGISTRATION_REQUEST_SCHEMA = json.load(f)
-with open(os.path.join(SCHEMA_DIR, 'agent_registration_response_schema.json'), 'r') as f:
-    REGISTRATION_RESPONSE_SCHEMA = json.load(f)
-
-def validate_json_schema(data, schema):
-    try:
-        validate(instance=data, schema=schema)
-        return True, ''
-    except ValidationError as e:
-        return False, str(e)
+# JSON Schemas, validators and the CA certificate are loaded on first use (see api_common.py)
+REGISTRATION_REQUEST_SCHEMA = 'agent_registration_request_schema.json'
+REGISTRATION_RESPONSE_SCHEMA = 'agent_registration_response_schema.json'
 
 def make_registration_response(request_data, success=True, error_message=None):
     if success:
@@ -58,21 +45,25 @@ def make_registration_response(request_data, success=True, error_message=None):
             "respondingAgent": {}
         }
 
-class RegistrationHandler(BaseHTTPRequestHandler):
+class RegistrationHandler(KeepAliveMixin, BaseHTTPRequestHandler):
+    federation = FEDERATION
+
+    @admission_controlled
     def do_POST(self):
         if self.path != '/register':
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b'Not Found')
             return
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        try:
-            request_json = json.loads(body)
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b'Invalid JSON')
+        ok, request_json = read_json_body(self)
+        if not ok:
+            return
+        # Per-agent rate limit, checked before any schema or certificate work
+        retry_after = WRITE_LIMITER.check(rate_limit_keys(request_json))
+        if retry_after:
+            send_too_many_requests(self, retry_after)
+            return
+        if refer_delegated_write(self, request_json, 'registration'):
             return
         valid, error = validate_json_schema(request_json, REGISTRATION_REQUEST_SCHEMA)
         if not valid:
@@ -81,21 +72,8 @@ class RegistrationHandler(BaseHTTPRequestHandler):
         else:
             # Validate certificate against local CA
             try:
-                cert_pem = request_json["requestingAgent"]["certificate"]["certificatePEM"].encode()
-                cert = x509.load_pem_x509_certificate(cert_pem, default_backend())
-                with open(os.path.join(SCHEMA_DIR, "ca.pem"), "rb") as f:
-                    ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-                # Check that issuer matches CA
-                if cert.issuer != ca_cert.subject:
-                    raise ValueError("Certificate not issued by local CA")
-                # Verify signature
-                ca_public_key = ca_cert.public_key()
-                ca_public_key.verify(
-                    cert.signature,
-                    cert.tbs_certificate_bytes,
-                    padding.PKCS1v15(),
-                    cert.signature_hash_algorithm,
-                )
+                cert_pem = request_json["requestingAgent"]["certificate"]["certificatePEM"]
+                verify_request_certificate(self, cert_pem)
             except Exception as e:
                 response = make_registration_response(request_json, success=False, error_message=f"Certificate validation failed: {e}")
                 self.send_response(400)
@@ -106,17 +84,28 @@ class RegistrationHandler(BaseHTTPRequestHandler):
             # Add registration timestamp
             now = datetime.datetime.utcnow().isoformat() + 'Z'
             request_json["requestingAgent"]["registrationTimestamp"] = now
-            # Insert into database
-            insert_registration(request_json["requestingAgent"])
-            response = make_registration_response(request_json, success=True)
-            self.send_response(200)
+            # Insert into database, or into the group-committed journal when one is configured
+            try:
+                store_registration(request_json["requestingAgent"], 'registration')
+            except Exception as e:
+                response = make_registration_response(request_json, success=False, error_message=f"Registration could not be stored: {e}")
+                self.send_response(500)
+            else:
+                response = make_registration_response(request_json, success=True)
+                self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.end_headers()
         self.wfile.write(json.dumps(response).encode('utf-8'))
 
-def run(server_class=HTTPServer, handler_class=RegistrationHandler, port=8080):
+def run(server_class=ThreadingHTTPServer, handler_class=RegistrationHandler, port=8080):
+    if PRELOAD:
+        preload([REGISTRATION_REQUEST_SCHEMA])
+    # Replays entries a crash left in this server's journal before serving
+    journal_for('registration')
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
+    if tls_configured():
+        enable_tls(httpd)
     print(f'Starting registration server on port {port}...')
     httpd.serve_forever()
 
@@ -1,11 +1,86 @@
 import sqlite3
 import os
 import json
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from membership_filter import BloomFilter
+from registry_versions import AGENT_VERSIONS
+from request_profiler import stage
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agent_registration.db')
+DB_PATH = os.environ.get('AGENT_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agent_registration.db'))
+# Number of SQLite files agent_registrations is hash-partitioned across, keyed by the
+# providerName/agentCategory prefix of the agent identity. Each shard has its own
+# write lock, so registrations for different providers commit concurrently. With a
+# single shard everything lives in DB_PATH as before.
+DB_SHARDS = int(os.environ.get('AGENT_DB_SHARDS', '1'))
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+# Replication role of this process (see registry_replication.py):
+#   standalone - reads and writes go to the local shards (default)
+#   primary    - as standalone, and every committed mutation is appended to the change log
+#   replica    - read-only; reads are served from a local copy kept fresh from the change log
+REGISTRY_ROLE = os.environ.get('AGENT_REGISTRY_ROLE', 'standalone')
+CHANGE_LOG_PATH = os.environ.get('AGENT_CHANGE_LOG', os.path.splitext(DB_PATH)[0] + '.changelog')
+# A replica re-reads the change log before serving a read whenever its last sync is
+# older than this many seconds, which bounds how stale its answers can be.
+REPLICA_MAX_STALENESS = float(os.environ.get('AGENT_REPLICA_MAX_STALENESS', '1.0'))
+
+# Bloom filter over every agentName in the local shards, so status lookups for
+# agents that were never registered (typos, retired names, scanning clients) are
+# answered without a table scan. Names written by this process are added as they
+# commit; names written by other processes are read from the rows past the last
+# id seen in each shard, at most once every AGENT_NAME_FILTER_MAX_STALENESS seconds.
+# The filter grows past AGENT_NAME_FILTER_CAPACITY names by rebuilding at twice the size.
+NAME_FILTER_CAPACITY = int(os.environ.get('AGENT_NAME_FILTER_CAPACITY', '100000'))
+NAME_FILTER_MAX_STALENESS = float(os.environ.get('AGENT_NAME_FILTER_MAX_STALENESS', '1.0'))
+
+# Columns added after the first release; older database files are migrated on open.
+MIGRATED_COLUMNS = {
+    'agentPolicyId': 'TEXT',
+    'agentStatus': 'TEXT',
+}
+
+_initialized_paths = set()
+_init_lock = threading.Lock()
+_scan_pool = None
+_change_log = None
+_replica = None
+_name_filter = None
+_name_filter_marks = {}  # shard path -> highest row id added to _name_filter
+_name_filter_synced = 0.0
+_name_filter_lock = threading.Lock()
+
+def shard_paths():
+    if DB_SHARDS <= 1:
+        return [DB_PATH]
+    root, ext = os.path.splitext(DB_PATH)
+    return [f"{root}.shard{i}{ext}" for i in range(DB_SHARDS)]
+
+def shard_for(provider_name, agent_category):
+    paths = shard_paths()
+    if len(paths) == 1:
+        return paths[0]
+    key = f"{provider_name or ''}/{agent_category or ''}".encode('utf-8')
+    return paths[zlib.crc32(key) % len(paths)]
+
+def _target_paths(provider_name=None, agent_category=None):
+    # Route to a single shard when the identity prefix is known, otherwise fan out.
+    if provider_name is not None and agent_category is not None:
+        return [shard_for(provider_name, agent_category)]
+    return shard_paths()
+
+def _fan_out(fn, paths):
+    global _scan_pool
+    if len(paths) == 1:
+        return [fn(paths[0])]
+    if _scan_pool is None:
+        with _init_lock:
+            if _scan_pool is None:
+                _scan_pool = ThreadPoolExecutor(max_workers=max(2, DB_SHARDS), thread_name_prefix='shard-scan')
+    return list(_scan_pool.map(fn, paths))
+
+def _create_schema(conn):
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS agent_registrations (
@@ -16,6 +91,7 @@ def init_db():
             providerName TEXT,
             version TEXT,
             extension TEXT,
+            agentPolicyId TEXT,
             agentUseJustification TEXT,
             agentCapability TEXT,
             agentEndpoint TEXT,
@@ -25,65 +101,523 @@ def init_db():
             a2aAgentCard TEXT,
             mcpClientInformation TEXT,
             agentDNSName TEXT,
-            registrationTimestamp TEXT
+            registrationTimestamp TEXT,
+            agentStatus TEXT
         )
     ''')
+    existing = {row[1] for row in c.execute('PRAGMA table_info(agent_registrations)')}
+    for column, column_type in MIGRATED_COLUMNS.items():
+        if column not in existing:
+            c.execute(f'ALTER TABLE agent_registrations ADD COLUMN {column} {column_type}')
+    # Deactivation by agentName and by identity prefix (providerName, agentCategory, version)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_agent_registrations_name ON agent_registrations (agentName)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_agent_registrations_identity ON agent_registrations (providerName, agentCategory, version)')
+    # How far each registration journal (see registration_journal.py) has been
+    # applied to this shard, updated in the same transaction as the rows
+    c.execute('CREATE TABLE IF NOT EXISTS journal_checkpoints (journal TEXT PRIMARY KEY, generation TEXT, journalOffset INTEGER)')
     conn.commit()
-    conn.close()
 
+def _connect(path):
+    conn = sqlite3.connect(path)
+    if path not in _initialized_paths:
+        with _init_lock:
+            if path not in _initialized_paths:
+                _create_schema(conn)
+                _initialized_paths.add(path)
+    return conn
+
+def init_db():
+    for path in shard_paths():
+        conn = _connect(path)
+        conn.close()
+
+def record_change(op, data):
+    global _change_log
+    if REGISTRY_ROLE != 'primary':
+        return
+    if _change_log is None:
+        from registry_replication import ChangeLog
+        _change_log = ChangeLog(CHANGE_LOG_PATH)
+    _change_log.append(op, data)
+
+def _check_writable():
+    if REGISTRY_ROLE == 'replica':
+        raise PermissionError("This registry process is a read-only replica")
+
+def version_key(agent_name, provider_name=None, agent_category=None):
+    """AGENT_VERSIONS key of a status lookup: the agentName and as much of the identity as was given."""
+    return (agent_name, provider_name, agent_category)
+
+def _invalidate_versions(identities):
+    # A row of (agentName, providerName, agentCategory) is seen by lookups with and
+    # without each part of the identity prefix
+    AGENT_VERSIONS.invalidate_many(
+        version_key(name, provider, category)
+        for name, provider_name, agent_category in identities
+        for provider in (None, provider_name)
+        for category in (None, agent_category))
+
+def sync_replica():
+    """On a replica, apply new change log entries if the last sync is older than REPLICA_MAX_STALENESS."""
+    global _replica
+    if REGISTRY_ROLE != 'replica':
+        return
+    if _replica is None:
+        from registry_replication import Replica, DatabaseCheckpoint, DB_APPLIERS
+        _replica = Replica(CHANGE_LOG_PATH, DB_APPLIERS, checkpoint=DatabaseCheckpoint())
+    _replica.ensure_fresh(REPLICA_MAX_STALENESS)
+
+# journal_checkpoints row holding how far a replica shard has applied the change log
+CHANGE_LOG_CHECKPOINT = 'changelog'
+
+def _claim_change(conn, change_offset):
+    """
+    Advance this shard's change log checkpoint to change_offset (the end of the entry
+    being applied) inside the caller's transaction, so the checkpoint commits with
+    the entry's rows. False if the shard already applied the entry; skip it then.
+    """
+    cursor = conn.execute(
+        "INSERT INTO journal_checkpoints (journal, generation, journalOffset) VALUES (?, NULL, ?) "
+        "ON CONFLICT(journal) DO UPDATE SET journalOffset=excluded.journalOffset WHERE journalOffset < excluded.journalOffset",
+        (CHANGE_LOG_CHECKPOINT, change_offset))
+    return cursor.rowcount > 0
+
+def change_log_offset():
+    """The change log offset every local shard has applied; 0 if any shard has none."""
+    def offset_in(path):
+        conn = _connect(path)
+        try:
+            row = conn.execute("SELECT journalOffset FROM journal_checkpoints WHERE journal=?", (CHANGE_LOG_CHECKPOINT,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row is not None else 0
+    return min(_fan_out(offset_in, shard_paths()))
+
+def advance_change_log_offset(change_offset):
+    """Move every shard's change log checkpoint forward to change_offset, e.g. past entries for other shards."""
+    def advance_in(path):
+        conn = _connect(path)
+        try:
+            with conn:
+                _claim_change(conn, change_offset)
+        finally:
+            conn.close()
+    _fan_out(advance_in, shard_paths())
+
+@stage("db.insert")
 def insert_registration(agent):
     print(f"[insert_registration] Called with agentName={agent.get('agentName')}")
-    print(f"[insert_registration] Using DB_PATH={DB_PATH}")
+    _check_writable()
+    if _write_registration(agent):
+        record_change('insert', agent)
+
+INSERT_REGISTRATION_SQL = '''
+    INSERT INTO agent_registrations (
+        protocol, agentName, agentCategory, providerName, version, extension, agentPolicyId, agentUseJustification, agentCapability, agentEndpoint, agentDID, certificate, csrPEM, a2aAgentCard, mcpClientInformation, agentDNSName, registrationTimestamp, agentStatus
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _registration_row(agent):
+    return (
+        agent.get('protocol'),
+        agent.get('agentName'),
+        agent.get('agentCategory'),
+        agent.get('providerName'),
+        agent.get('version'),
+        agent.get('extension'),
+        agent.get('agentPolicyId'),
+        agent.get('agentUseJustification'),
+        agent.get('agentCapability'),
+        agent.get('agentEndpoint'),
+        agent.get('agentDID'),
+        json.dumps(agent.get('certificate', {})),
+        agent.get('csrPEM'),
+        json.dumps(agent.get('a2aAgentCard', {})),
+        json.dumps(agent.get('mcpClientInformation', {})),
+        agent.get('agentDNSName'),
+        agent.get('registrationTimestamp'),
+        agent.get('agentStatus', 'active')
+    )
+
+def _write_registration(agent, change_offset=None):
+    # change_offset: the change log position of the entry being replayed (see _claim_change)
+    path = shard_for(agent.get('providerName'), agent.get('agentCategory'))
+    print(f"[insert_registration] Using shard {path}")
+    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = _connect(path)
         c = conn.cursor()
-        c.execute('''
-            INSERT INTO agent_registrations (
-                agentName, agentPolicyId, agentUseJustification, agentCapability, agentEndpoint, agentDID, certificate, csrPEM, a2aAgentCard, mcpClientInformation, agentDNSName, registrationTimestamp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            agent.get('agentName'),
-            agent.get('agentPolicyId'),
-            agent.get('agentUseJustification'),
-            agent.get('agentCapability'),
-            agent.get('agentEndpoint'),
-            agent.get('agentDID'),
-            json.dumps(agent.get('certificate', {})),
-            agent.get('csrPEM'),
-            json.dumps(agent.get('a2aAgentCard', {})),
-            json.dumps(agent.get('mcpClientInformation', {})),
-            agent.get('agentDNSName'),
-            agent.get('registrationTimestamp')
-        ))
+        if change_offset is not None and not _claim_change(conn, change_offset):
+            return False
+        c.execute(INSERT_REGISTRATION_SQL, _registration_row(agent))
         conn.commit()
+        _invalidate_versions([(agent.get('agentName'), agent.get('providerName'), agent.get('agentCategory'))])
+        _add_to_name_filter([agent.get('agentName')])
         print("[insert_registration] Insert committed.")
+        return True
     except Exception as e:
         print(f"[insert_registration] Exception: {e}")
+        # A replayed entry must not be skipped: the replica would advance past it
+        if change_offset is not None:
+            raise
+        return False
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
+@stage("db.apply_journal")
+def apply_journal_entries(journal, generation, entries, is_current=None):
+    """
+    Insert journaled registrations, entries being (end_offset, agent) in journal
+    order. Each shard gets one transaction that inserts its rows and advances its
+    checkpoint for (journal, generation), so entries replayed after a crash, or
+    applied by another process first (see registration_journal.drain_journals),
+    that a shard already holds are skipped. A process that read the journal file
+    without owning it passes is_current, which is checked inside each transaction:
+    if the file has since started a new generation, nothing more is applied.
+    Once a shard commits, its rows are recorded in the change log and the caches
+    learn about them, whatever happens to the other shards. Returns the agents
+    inserted by this call. Raises on failure; nothing is then committed for the
+    failing shard.
+    """
+    _check_writable()
+    by_shard = {}
+    for end_offset, agent in entries:
+        by_shard.setdefault(shard_for(agent.get('providerName'), agent.get('agentCategory')), []).append((end_offset, agent))
 
-def deactivate_agent(agent_name):
+    def apply_in(item):
+        path, shard_entries = item
+        conn = _connect(path)
+
+        def applied_offset():
+            row = conn.execute("SELECT generation, journalOffset FROM journal_checkpoints WHERE journal=?", (journal,)).fetchone()
+            return row[1] if row is not None and row[0] == generation else 0
+
+        try:
+            # A checkpoint only moves forward within a generation, so a shard that
+            # already holds every entry is skipped without taking the write lock
+            if applied_offset() >= shard_entries[-1][0]:
+                return []
+            with conn:
+                # Taken before the checkpoint is read again, so two processes applying
+                # the same journal cannot both insert an entry
+                conn.execute("BEGIN IMMEDIATE")
+                if is_current is not None and not is_current():
+                    return []
+                applied = applied_offset()
+                fresh = [(end_offset, agent) for end_offset, agent in shard_entries if end_offset > applied]
+                if fresh:
+                    conn.executemany(INSERT_REGISTRATION_SQL, [_registration_row(agent) for _, agent in fresh])
+                    conn.execute("INSERT OR REPLACE INTO journal_checkpoints (journal, generation, journalOffset) VALUES (?, ?, ?)",
+                                 (journal, generation, fresh[-1][0]))
+        finally:
+            conn.close()
+        agents = [agent for _, agent in fresh]
+        _invalidate_versions((agent.get('agentName'), agent.get('providerName'), agent.get('agentCategory')) for agent in agents)
+        _add_to_name_filter(agent.get('agentName') for agent in agents)
+        for agent in agents:
+            record_change('insert', agent)
+        return fresh
+
+    inserted = sorted((entry for fresh in _fan_out(apply_in, list(by_shard.items())) for entry in fresh), key=lambda entry: entry[0])
+    agents = [agent for _, agent in inserted]
+    print(f"[apply_journal_entries] {journal}: inserted {len(agents)} of {len(entries)} entries")
+    return agents
+
+
+@stage("db.deactivate")
+def deactivate_agent(agent_name, provider_name=None, agent_category=None):
     print(f"[deactivate_agent] Called for agentName={agent_name}")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE agent_registrations SET agentStatus='inactive' WHERE agentName=? AND (agentStatus IS NULL OR agentStatus!='inactive')", (agent_name,))
-    updated = c.rowcount
-    conn.commit()
-    conn.close()
+    _check_writable()
+    updated = _deactivate(agent_name, provider_name, agent_category)
+    if updated:
+        record_change('deactivate', {'agentName': agent_name, 'providerName': provider_name, 'agentCategory': agent_category})
     print(f"[deactivate_agent] Updated rows: {updated}")
     return updated > 0
 
-def get_agent_status(agent_name):
+def _identity_conditions(agent_name, provider_name=None, agent_category=None):
+    # The identity prefix routes to a shard, and it must also select the rows: one
+    # shard holds the same agentName for other providers and categories
+    conditions, params = ['agentName=?'], [agent_name]
+    if provider_name is not None:
+        conditions.append('providerName=?')
+        params.append(provider_name)
+    if agent_category is not None:
+        conditions.append('agentCategory=?')
+        params.append(agent_category)
+    return ' AND '.join(conditions), params
+
+def _deactivate(agent_name, provider_name=None, agent_category=None, change_offset=None):
+    where, params = _identity_conditions(agent_name, provider_name, agent_category)
+
+    def deactivate_in(path):
+        conn = _connect(path)
+        try:
+            with conn:
+                if change_offset is not None and not _claim_change(conn, change_offset):
+                    return []
+                return conn.execute(
+                    f"UPDATE agent_registrations SET agentStatus='inactive' WHERE {where} "
+                    "AND (agentStatus IS NULL OR agentStatus!='inactive') RETURNING agentName, providerName, agentCategory",
+                    params).fetchall()
+        finally:
+            conn.close()
+
+    rows = [row for shard_rows in _fan_out(deactivate_in, _target_paths(provider_name, agent_category)) for row in shard_rows]
+    _invalidate_versions(rows)
+    return len(rows)
+
+@stage("db.deactivate_bulk")
+def deactivate_agents(provider_name, agent_category=None, version=None):
+    """
+    Deactivate every active registration under an identity prefix: providerName,
+    optionally narrowed to agentCategory and then to version. Returns the sorted
+    agentNames that were deactivated.
+    """
+    print(f"[deactivate_agents] Called for providerName={provider_name} agentCategory={agent_category} version={version}")
+    _check_writable()
+    names = _deactivate_matching(provider_name, agent_category, version)
+    if names:
+        record_change('deactivate_bulk', {'providerName': provider_name, 'agentCategory': agent_category, 'version': version})
+    print(f"[deactivate_agents] Deactivated agents: {len(names)}")
+    return names
+
+def _deactivate_matching(provider_name, agent_category=None, version=None, change_offset=None):
+    if provider_name is None or (version is not None and agent_category is None):
+        raise ValueError("The pattern must be a prefix of (providerName, agentCategory, version)")
+    conditions, params = ['providerName=?'], [provider_name]
+    if agent_category is not None:
+        conditions.append('agentCategory=?')
+        params.append(agent_category)
+    if version is not None:
+        conditions.append('version=?')
+        params.append(version)
+    where = ' AND '.join(conditions)
+
+    def deactivate_in(path):
+        # One statement per shard: the identity index selects the rows, and RETURNING
+        # reports exactly the rows this transaction changed.
+        conn = _connect(path)
+        try:
+            with conn:
+                if change_offset is not None and not _claim_change(conn, change_offset):
+                    return []
+                return conn.execute(
+                    f"UPDATE agent_registrations SET agentStatus='inactive' WHERE {where} "
+                    "AND (agentStatus IS NULL OR agentStatus!='inactive') RETURNING agentName, providerName, agentCategory",
+                    params).fetchall()
+        finally:
+            conn.close()
+
+    rows = [row for shard_rows in _fan_out(deactivate_in, _target_paths(provider_name, agent_category)) for row in shard_rows]
+    _invalidate_versions(rows)
+    return sorted({row[0] for row in rows if row[0] is not None})
+
+def _add_to_name_filter(names):
+    # Under the lock, so a rebuild in _refresh_name_filter cannot swap in a filter
+    # scanned before these names were committed and drop them
+    with _name_filter_lock:
+        name_filter = _name_filter
+        if name_filter is not None:
+            for name in names:
+                if name is not None:
+                    name_filter.add(name)
+
+def _refresh_name_filter():
+    global _name_filter, _name_filter_marks, _name_filter_synced
+    with _name_filter_lock:
+        name_filter, marks = _name_filter, _name_filter_marks
+        if name_filter is None:
+            name_filter, marks = BloomFilter(NAME_FILTER_CAPACITY), {}
+        while True:
+            for path in shard_paths():
+                conn = _connect(path)
+                rows = conn.execute("SELECT id, agentName FROM agent_registrations WHERE id > ? ORDER BY id",
+                                    (marks.get(path, 0),)).fetchall()
+                conn.close()
+                for _, agent_name in rows:
+                    if agent_name is not None:
+                        name_filter.add(agent_name)
+                if rows:
+                    marks[path] = rows[-1][0]
+            if len(name_filter) <= name_filter.capacity:
+                break
+            # Past capacity the false positive rate climbs; rebuild at twice the size
+            name_filter, marks = BloomFilter(2 * len(name_filter)), {}
+        # Swapped in whole, so concurrent lookups never see a half-built filter
+        _name_filter, _name_filter_marks = name_filter, marks
+        _name_filter_synced = time.time()
+
+def agent_may_exist(agent_name):
+    """
+    False if agent_name has never been registered in the local shards, answered
+    from the name filter without a table scan. True means "maybe": the caller
+    still queries SQLite. Registrations by other processes are seen after at most
+    NAME_FILTER_MAX_STALENESS seconds.
+    """
+    sync_replica()
+    name_filter = _name_filter
+    if name_filter is None or (agent_name not in name_filter and time.time() - _name_filter_synced > NAME_FILTER_MAX_STALENESS):
+        _refresh_name_filter()
+        name_filter = _name_filter
+    return agent_name in name_filter
+
+@stage("db.status")
+def get_agent_status(agent_name, provider_name=None, agent_category=None):
     print(f"[get_agent_status] Called for agentName={agent_name}")
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT agentStatus FROM agent_registrations WHERE agentName=? ORDER BY id DESC LIMIT 1", (agent_name,))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        return row[0]
+    sync_replica()
+    if not agent_may_exist(agent_name):
+        return None
+
+    where, params = _identity_conditions(agent_name, provider_name, agent_category)
+
+    def latest_in(path):
+        conn = _connect(path)
+        c = conn.cursor()
+        c.execute(f"SELECT registrationTimestamp, agentStatus FROM agent_registrations WHERE {where} ORDER BY id DESC LIMIT 1", params)
+        row = c.fetchone()
+        conn.close()
+        return row
+
+    rows = [row for row in _fan_out(latest_in, _target_paths(provider_name, agent_category)) if row]
+    if rows:
+        # The same agentName under several providers lives in several shards; the
+        # most recently registered record wins.
+        return max(rows, key=lambda row: row[0] or '')[1]
     return None
 
+def get_agent_certificate_pem(agent_name, provider_name=None, agent_category=None):
+    """certificatePEM of the most recently registered active record of the identity, or None."""
+    sync_replica()
+    if not agent_may_exist(agent_name):
+        return None
+    where, params = _identity_conditions(agent_name, provider_name, agent_category)
+
+    def latest_in(path):
+        conn = _connect(path)
+        c = conn.cursor()
+        c.execute(f"SELECT registrationTimestamp, certificate FROM agent_registrations WHERE {where} AND agentStatus='active' "
+                  "ORDER BY id DESC LIMIT 1", params)
+        row = c.fetchone()
+        conn.close()
+        return row
+
+    rows = [row for row in _fan_out(latest_in, _target_paths(provider_name, agent_category)) if row]
+    if not rows:
+        return None
+    certificate = json.loads(max(rows, key=lambda row: row[0] or '')[1] or 'null')
+    return certificate.get('certificatePEM') if isinstance(certificate, dict) else None
+
+@stage("db.status_batch")
+def get_agent_statuses(lookups):
+    """
+    Batched get_agent_status: lookups is a list of (agent_name, provider_name,
+    agent_category) tuples. Returns {lookup: status or None}, keyed by the whole
+    tuple, since the same agentName under another provider or category is a
+    different agent. Each shard is queried once for all the lookups routed to it.
+    """
+    if not lookups:
+        return {}
+    sync_replica()
+    lookups_by_path = {}
+    for lookup in lookups:
+        if not agent_may_exist(lookup[0]):
+            continue
+        for path in _target_paths(lookup[1], lookup[2]):
+            lookups_by_path.setdefault(path, set()).add(lookup)
+
+    def latest_in(item):
+        path, path_lookups = item
+        conditions, params = [], []
+        for lookup in sorted(path_lookups, key=repr):
+            where, where_params = _identity_conditions(*lookup)
+            conditions.append(f"({where})")
+            params.extend(where_params)
+        conn = _connect(path)
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, agentName, providerName, agentCategory, registrationTimestamp, agentStatus FROM agent_registrations "
+            "WHERE id IN (SELECT MAX(id) FROM agent_registrations "
+            f"WHERE {' OR '.join(conditions)} GROUP BY agentName, providerName, agentCategory)",
+            params)
+        rows = c.fetchall()
+        conn.close()
+        # The newest row of each identity; a lookup without a provider or category matches several
+        latest = {}
+        for lookup in path_lookups:
+            matching = [row for row in rows if row[1] == lookup[0] and lookup[1] in (None, row[2]) and lookup[2] in (None, row[3])]
+            if matching:
+                latest[lookup] = max(matching)[4:]
+        return latest
+
+    latest = {}
+    for found in _fan_out(latest_in, list(lookups_by_path.items())):
+        for lookup, (timestamp, status) in found.items():
+            # As in get_agent_status, the most recently registered record wins across shards
+            if lookup not in latest or (timestamp or '') > (latest[lookup][0] or ''):
+                latest[lookup] = (timestamp, status)
+    return {lookup: latest[lookup][1] if lookup in latest else None for lookup in lookups}
+
+def replace_registrations(columns, rows, change_offset=None):
+    """
+    Replace every registration with rows (tuples in `columns` order, JSON columns
+    as text), routed to their shards. Each shard is rewritten in one transaction
+    with one executemany. Used to seed a node, including a replica's local copy,
+    from a snapshot (registry_snapshot.py). A replica passes the change log offset
+    the rows reflect, and each shard's checkpoint is reset to it in the same
+    transaction. Returns the number of rows written.
+    """
+    global _name_filter
+    provider_column = columns.index('providerName')
+    category_column = columns.index('agentCategory')
+    rows_by_path = {path: [] for path in shard_paths()}
+    for row in rows:
+        rows_by_path[shard_for(row[provider_column], row[category_column])].append(row)
+    insert = f"INSERT INTO agent_registrations ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def replace_in(item):
+        path, shard_rows = item
+        conn = _connect(path)
+        try:
+            with conn:
+                conn.execute("DELETE FROM agent_registrations")
+                conn.executemany(insert, shard_rows)
+                if change_offset is not None:
+                    conn.execute("INSERT OR REPLACE INTO journal_checkpoints (journal, generation, journalOffset) VALUES (?, NULL, ?)",
+                                 (CHANGE_LOG_CHECKPOINT, change_offset))
+        finally:
+            conn.close()
+        return len(shard_rows)
+
+    count = sum(_fan_out(replace_in, list(rows_by_path.items())))
+    AGENT_VERSIONS.clear()
+    # Names of the replaced rows may be gone; the filter is rebuilt on the next lookup
+    with _name_filter_lock:
+        _name_filter = None
+    return count
+
+def scan_registrations(columns='*', where='', params=()):
+    """
+    Run the same SELECT against every shard in parallel and concatenate the rows.
+    `where` is an optional SQL condition (without the WHERE keyword).
+    """
+    sync_replica()
+    query = f"SELECT {columns} FROM agent_registrations"
+    if where:
+        query += f" WHERE {where}"
+
+    def scan(path):
+        conn = _connect(path)
+        c = conn.cursor()
+        c.execute(query, params)
+        rows = c.fetchall()
+        conn.close()
+        return rows
+
+    results = []
+    for rows in _fan_out(scan, shard_paths()):
+        results.extend(rows)
+    return results
+
 if __name__ == "__main__":
     init_db()
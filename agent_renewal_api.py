@@ -1,26 +1,15 @@
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
-from jsonschema import validate, ValidationError
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import padding
-from agent_registration_db import insert_registration
+from registration_journal import journal_for, store_registration
 import datetime
+from registry_federation import FEDERATION, refer_delegated_write
+from rate_limiter import WRITE_LIMITER, admission_controlled, rate_limit_keys, send_too_many_requests
+from api_common import KeepAliveMixin, enable_tls, PRELOAD, preload, read_json_body, tls_configured, validate_json_schema, verify_request_certificate
 
-# Load JSON Schemas
-SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
-with open(os.path.join(SCHEMA_DIR, 'agent_renewal_request_schema.json'), 'r') as f:
-    RENEWAL_REQUEST_SCHEMA = json.load(f)
-with open(os.path.join(SCHEMA_DIR, 'agent_renewal_response_schema.json'), 'r') as f:
-    RENEWAL_RESPONSE_SCHEMA = json.load(f)
-
-def validate_json_schema(data, schema):
-    try:
-        validate(instance=data, schema=schema)
-        return True, ''
-    except ValidationError as e:
-        return False, str(e)
+# JSON Schemas, validators and the CA certificate are loaded on first use (see api_common.py)
+RENEWAL_REQUEST_SCHEMA = 'agent_renewal_request_schema.json'
+RENEWAL_RESPONSE_SCHEMA = 'agent_renewal_response_schema.json'
 
 def make_renewal_response(request_data, success=True, error_message=None):
     if success:
@@ -46,21 +35,25 @@ def make_renewal_response(request_data, success=True, error_message=None):
             "errorMessage": error_message or "Invalid renewal request."
         }
 
-class RenewalHandler(BaseHTTPRequestHandler):
+class RenewalHandler(KeepAliveMixin, BaseHTTPRequestHandler):
+    federation = FEDERATION
+
+    @admission_controlled
     def do_POST(self):
         if self.path != '/renew':
             self.send_response(404)
             self.end_headers()
             self.wfile.write(b'Not Found')
             return
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        try:
-            request_json = json.loads(body)
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.end_headers()
-            self.wfile.write(b'Invalid JSON')
+        ok, request_json = read_json_body(self)
+        if not ok:
+            return
+        # Per-agent rate limit, checked before any schema or certificate work
+        retry_after = WRITE_LIMITER.check(rate_limit_keys(request_json))
+        if retry_after:
+            send_too_many_requests(self, retry_after)
+            return
+        if refer_delegated_write(self, request_json, 'renewal'):
             return
         valid, error = validate_json_schema(request_json, RENEWAL_REQUEST_SCHEMA)
         if not valid:
@@ -69,19 +62,8 @@ class RenewalHandler(BaseHTTPRequestHandler):
         else:
             # Validate certificate against local CA
             try:
-                cert_pem = request_json["requestingAgent"]["certificate"]["certificatePEM"].encode()
-                cert = x509.load_pem_x509_certificate(cert_pem, default_backend())
-                with open(os.path.join(SCHEMA_DIR, "ca.pem"), "rb") as f:
-                    ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
-                if cert.issuer != ca_cert.subject:
-                    raise ValueError("Certificate not issued by local CA")
-                ca_public_key = ca_cert.public_key()
-                ca_public_key.verify(
-                    cert.signature,
-                    cert.tbs_certificate_bytes,
-                    padding.PKCS1v15(),
-                    cert.signature_hash_algorithm,
-                )
+                cert_pem = request_json["requestingAgent"]["certificate"]["certificatePEM"]
+                verify_request_certificate(self, cert_pem)
             except Exception as e:
                 response = make_renewal_response(request_json, success=False, error_message=f"Certificate validation failed: {e}")
                 self.send_response(400)
@@ -90,16 +72,27 @@ class RenewalHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(response).encode('utf-8'))
                 return
             # Insert renewal as a new registration record (for demo)
-            insert_registration(request_json["requestingAgent"])
-            response = make_renewal_response(request_json, success=True)
-            self.send_response(200)
+            try:
+                store_registration(request_json["requestingAgent"], 'renewal')
+            except Exception as e:
+                response = make_renewal_response(request_json, success=False, error_message=f"Renewal could not be stored: {e}")
+                self.send_response(500)
+            else:
+                response = make_renewal_response(request_json, success=True)
+                self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.end_headers()
         self.wfile.write(json.dumps(response).encode('utf-8'))
 
-def run(server_class=HTTPServer, handler_class=RenewalHandler, port=8081):
+def run(server_class=ThreadingHTTPServer, handler_class=RenewalHandler, port=8081):
+    if PRELOAD:
+        preload([RENEWAL_REQUEST_SCHEMA])
+    # Replays entries a crash left in this server's journal before serving
+    journal_for('renewal')
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
+    if tls_configured():
+        enable_tls(httpd)
     print(f'Starting renewal server on port {port}...')
     httpd.serve_forever()
 
@@ -1,10 +1,18 @@
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import os
 from urllib.parse import urlparse, parse_qs
-from agent_registration_db import get_agent_status
+from agent_registration_db import get_agent_status, get_agent_statuses, sync_replica, version_key
+from registry_versions import AGENT_VERSIONS, VERSION_TTL, etag_matches, http_date
+from api_common import KeepAliveMixin, enable_tls, read_json_body, tls_configured
+from registry_federation import FEDERATION, ZONE_HEADER, FederationError, check_hops, send_json
+
+# Upper bound on the number of agents in one POST /status/batch request.
+MAX_STATUS_BATCH = int(os.environ.get('AGENT_MAX_STATUS_BATCH', '100'))
+
+class StatusHandler(KeepAliveMixin, BaseHTTPRequestHandler):
+    federation = FEDERATION
 
-class StatusHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path != '/status':
@@ -25,15 +33,37 @@ class StatusHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b'Missing agentName parameter')
             return
+        if self.federation is not None:
+            zone, upstream = self.federation.upstream('status', provider_name, agent_category)
+            if upstream is not None:
+                self.send_delegated_status(zone, upstream, agent_name, provider_name, agent_category)
+                return
+        # Conditional GET: answer repeat polls from the in-memory version map
+        # without touching SQLite while the cached version is still fresh. A
+        # replica applies the change log first (which drops the versions it
+        # changes), so a 304 is never staler than AGENT_REPLICA_MAX_STALENESS.
+        if_none_match = self.headers.get('If-None-Match')
+        key = version_key(agent_name, provider_name, agent_category)
         try:
-            status = get_agent_status(agent_name)
+            sync_replica()
+            if if_none_match:
+                cached = AGENT_VERSIONS.current(key)
+                if cached and etag_matches(if_none_match, cached[0]):
+                    self.send_not_modified(*cached)
+                    return
+            status = get_agent_status(agent_name, provider_name, agent_category)
             if status is None:
                 self.send_response(404)
                 self.end_headers()
                 self.wfile.write(json.dumps({"status": "not found", "agentName": agent_name}).encode('utf-8'))
             else:
+                etag, last_modified = AGENT_VERSIONS.observe(key, status)
+                if etag_matches(if_none_match, etag):
+                    self.send_not_modified(etag, last_modified)
+                    return
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
+                self.send_version_headers(etag, last_modified)
                 self.end_headers()
                 self.wfile.write(json.dumps({"status": status, "agentName": agent_name}).encode('utf-8'))
         except Exception as e:
@@ -41,9 +71,103 @@ class StatusHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(str(e).encode('utf-8'))
 
-def run(server_class=HTTPServer, handler_class=StatusHandler, port=8083):
+    def do_POST(self):
+        # POST /status/batch {"agents": [{"agentName": ..., "providerName": ..., "agentCategory": ...}, ...]}
+        # answers many lookups with one round trip and one query per shard.
+        if urlparse(self.path).path != '/status/batch':
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b'Not Found')
+            return
+        ok, payload = read_json_body(self)
+        if not ok:
+            return
+        try:
+            agents = payload["agents"]
+            lookups = [(a["agentName"], a.get("providerName"), a.get("agentCategory")) for a in agents]
+            if not all(isinstance(lookup[0], str) and all(part is None or isinstance(part, str) for part in lookup[1:])
+                       for lookup in lookups):
+                raise TypeError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(b'Expected {"agents": [{"agentName": ...}, ...]}')
+            return
+        if len(lookups) > MAX_STATUS_BATCH:
+            self.send_response(413)
+            self.end_headers()
+            self.wfile.write(f'At most {MAX_STATUS_BATCH} agents per batch'.encode('utf-8'))
+            return
+        # Lookups in delegated zones are answered by their registry, one batch per upstream
+        local = []
+        delegated = {}
+        for lookup in lookups:
+            upstream = self.federation.upstream('status', lookup[1], lookup[2])[1] if self.federation is not None else None
+            if upstream is None:
+                local.append(lookup)
+            else:
+                delegated.setdefault(upstream, []).append(lookup)
+        try:
+            statuses = get_agent_statuses(local)
+        except Exception as e:
+            self.send_response(500)
+            self.end_headers()
+            self.wfile.write(str(e).encode('utf-8'))
+            return
+        answers = {}
+        if delegated:
+            hops = check_hops(self)
+            if hops is None:
+                return
+            try:
+                for upstream, group in delegated.items():
+                    answers.update(zip(group, self.federation.lookup_statuses(upstream, group, hops)))
+            except FederationError as e:
+                send_json(self, e.status, {"status": "failure", "errorMessage": f"Delegated registry failed: {e}"})
+                return
+        results = []
+        for lookup in lookups:
+            agent_name = lookup[0]
+            status = answers[lookup] if lookup in answers else statuses[lookup]
+            result = {"agentName": agent_name, "status": status if status is not None else "not found"}
+            if status is not None and lookup not in answers:
+                result["etag"], _ = AGENT_VERSIONS.observe(version_key(*lookup), status)
+            results.append(result)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', f'max-age={int(VERSION_TTL)}')
+        self.end_headers()
+        self.wfile.write(json.dumps({"results": results}).encode('utf-8'))
+
+    def send_delegated_status(self, zone, upstream, agent_name, provider_name, agent_category):
+        hops = check_hops(self)
+        if hops is None:
+            return
+        try:
+            status = self.federation.lookup_status(upstream, agent_name, provider_name, agent_category, hops)
+        except FederationError as e:
+            send_json(self, e.status, {"status": "failure", "errorMessage": f"Delegated registry failed: {e}"})
+            return
+        if status is None:
+            send_json(self, 404, {"status": "not found", "agentName": agent_name}, {ZONE_HEADER: zone})
+        else:
+            send_json(self, 200, {"status": status, "agentName": agent_name}, {ZONE_HEADER: zone})
+
+    def send_version_headers(self, etag, last_modified):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', http_date(last_modified))
+        self.send_header('Cache-Control', f'max-age={int(VERSION_TTL)}')
+
+    def send_not_modified(self, etag, last_modified):
+        self.send_response(304)
+        self.send_version_headers(etag, last_modified)
+        self.end_headers()
+
+def run(server_class=ThreadingHTTPServer, handler_class=StatusHandler, port=8083):
     server_address = ('', port)
     httpd = server_class(server_address, handler_class)
+    if tls_configured():
+        enable_tls(httpd)
     print(f'Starting status server on port {port}...')
     httpd.serve_forever()
 
@@ -0,0 +1,501 @@
+"""
+api_common.py
+Lazily initialised resources shared by the HTTP handlers.
+
+Nothing heavy happens at import time: jsonschema, the cryptography x509 stack, the
+JSON schema files and the local CA certificate are loaded on first use and cached
+for the life of the process. Set AGENT_PRELOAD=1 (or call preload()) to load them
+before serving instead, so the first request does not pay for it.
+"""
+import hmac
+import io
+import json
+import os
+import re
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import traffic_recorder
+from request_profiler import SLOW_REQUESTS, PROFILE_MAX_SECONDS, folded, sample_stacks, stage
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+CA_CERT_PATH = os.path.join(SCHEMA_DIR, "ca.pem")
+PRELOAD = os.environ.get("AGENT_PRELOAD") == "1"
+# Seconds an idle keep-alive connection is held open before the server closes it.
+KEEP_ALIVE_TIMEOUT = float(os.environ.get("AGENT_KEEP_ALIVE_TIMEOUT", "15"))
+# Largest request body accepted; larger ones get 413 before any of the body is read.
+# A handler class can lower it with a max_body_bytes attribute.
+MAX_BODY_BYTES = int(os.environ.get("AGENT_MAX_BODY_BYTES", str(1024 * 1024)))
+# Deepest array/object nesting accepted in a request body.
+MAX_JSON_DEPTH = int(os.environ.get("AGENT_MAX_JSON_DEPTH", "32"))
+# Mutual TLS (see enable_tls). The servers speak plain HTTP unless AGENT_TLS_CERT
+# and AGENT_TLS_KEY name the server's certificate chain and private key. Clients
+# must then present a certificate issued by AGENT_TLS_CLIENT_CA (default ca.pem).
+TLS_CERT = os.environ.get("AGENT_TLS_CERT")
+TLS_KEY = os.environ.get("AGENT_TLS_KEY")
+TLS_CLIENT_CA = os.environ.get("AGENT_TLS_CLIENT_CA", CA_CERT_PATH)
+# "required" rejects clients without a certificate; "optional" verifies one if sent.
+TLS_CLIENT_AUTH = os.environ.get("AGENT_TLS_CLIENT_AUTH", "required")
+# TLS 1.3 session tickets issued per handshake, for resumption by returning clients.
+TLS_SESSION_TICKETS = int(os.environ.get("AGENT_TLS_SESSION_TICKETS", "2"))
+# Bearer token for the /admin/ endpoints (see serve_admin); unset disables them.
+ADMIN_TOKEN = os.environ.get("AGENT_ADMIN_TOKEN")
+
+_lock = threading.Lock()
+_schemas = {}
+_validators = {}
+_ca_cert = None
+
+
+def load_schema(name):
+    """Load a JSON schema by file name (relative to the project root), once."""
+    schema = _schemas.get(name)
+    if schema is None:
+        path = name if os.path.isabs(name) else os.path.join(SCHEMA_DIR, name)
+        with open(path, "r") as f:
+            schema = json.load(f)
+        with _lock:
+            schema = _schemas.setdefault(name, schema)
+    return schema
+
+
+def schema_validator(name):
+    """Return a cached jsonschema validator for the named schema file."""
+    validator = _validators.get(name)
+    if validator is None:
+        from jsonschema.validators import validator_for
+        schema = load_schema(name)
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        with _lock:
+            validator = _validators.setdefault(name, cls(schema))
+    return validator
+
+
+@stage("validate")
+def validate_json_schema(data, schema_name):
+    from jsonschema.exceptions import best_match
+    error = best_match(schema_validator(schema_name).iter_errors(data))
+    if error is not None:
+        return False, str(error)
+    return True, ''
+
+
+def load_ca_cert():
+    global _ca_cert
+    if _ca_cert is None:
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        with open(CA_CERT_PATH, "rb") as f:
+            ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+        with _lock:
+            if _ca_cert is None:
+                _ca_cert = ca_cert
+    return _ca_cert
+
+
+def verify_certificate_pem(cert_pem):
+    """
+    Parse a PEM certificate and check that it was issued and signed by the local CA.
+    Returns the parsed certificate; raises on any failure.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import padding
+    cert = x509.load_pem_x509_certificate(cert_pem.encode(), default_backend())
+    ca_cert = load_ca_cert()
+    # Check that issuer matches CA
+    if cert.issuer != ca_cert.subject:
+        raise ValueError("Certificate not issued by local CA")
+    # Verify signature
+    ca_cert.public_key().verify(
+        cert.signature,
+        cert.tbs_certificate_bytes,
+        padding.PKCS1v15(),
+        cert.signature_hash_algorithm,
+    )
+    return cert
+
+
+def server_tls_context(cert_path=None, key_path=None, client_ca_path=None, client_auth=None):
+    """
+    SSLContext for the servers: TLS 1.2+, client certificates verified against the
+    client CA (AGENT_TLS_CLIENT_CA), and session tickets so returning clients resume
+    without a full handshake. Resumed sessions keep the client certificate verified
+    originally. The context records whether the client CA is the registry's ca.pem
+    (see verify_request_certificate).
+    """
+    import ssl
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_path or TLS_CERT, key_path or TLS_KEY)
+    client_ca_path = client_ca_path or TLS_CLIENT_CA
+    context.load_verify_locations(client_ca_path)
+    with open(client_ca_path, "rb") as f, open(CA_CERT_PATH, "rb") as g:
+        context.client_ca_is_registry_ca = b"".join(f.read().split()) == b"".join(g.read().split())
+    client_auth = client_auth or TLS_CLIENT_AUTH
+    if client_auth not in ("required", "optional"):
+        raise ValueError(f"client_auth must be 'required' or 'optional', not {client_auth!r}")
+    context.verify_mode = ssl.CERT_REQUIRED if client_auth == "required" else ssl.CERT_OPTIONAL
+    context.num_tickets = TLS_SESSION_TICKETS
+    return context
+
+
+def enable_tls(httpd, context=None):
+    """
+    Serve httpd over TLS (with server_tls_context() unless a context is given).
+    Accepted connections are wrapped without a handshake; KeepAliveMixin runs it
+    in the connection's own worker thread, so a slow client cannot stall accept().
+    """
+    context = context or server_tls_context()
+    httpd.socket = context.wrap_socket(httpd.socket, server_side=True, do_handshake_on_connect=False)
+    return httpd
+
+
+def tls_configured():
+    return bool(TLS_CERT and TLS_KEY)
+
+
+def _compact_pem(pem):
+    return "".join(pem.split())
+
+
+def peer_certificate_pem(handler):
+    """
+    PEM of the client certificate the TLS handshake verified, or None on plain HTTP
+    or without a client certificate. Converted once per connection.
+    """
+    if not hasattr(handler, '_peer_certificate_pem'):
+        pem = None
+        getpeercert = getattr(handler.connection, 'getpeercert', None)
+        der = getpeercert(binary_form=True) if getpeercert is not None else None
+        if der:
+            import ssl
+            pem = ssl.DER_cert_to_PEM_cert(der)
+        handler._peer_certificate_pem = pem
+    return handler._peer_certificate_pem
+
+
+def authenticated_peer_pem(handler):
+    """
+    PEM of the client certificate when the TLS handshake proved the client holds
+    its key and verified it against the registry's own CA; None otherwise. A
+    certificatePEM in a request body proves nothing on its own: discovery returns
+    every agent's certificate, so anyone can paste one.
+    """
+    context = getattr(handler.connection, 'context', None)
+    if not getattr(context, 'client_ca_is_registry_ca', False):
+        return None
+    return peer_certificate_pem(handler)
+
+
+def same_certificate(pem, other_pem):
+    """True if two PEM strings hold the same certificate (whitespace aside)."""
+    return isinstance(pem, str) and isinstance(other_pem, str) and _compact_pem(pem) == _compact_pem(other_pem)
+
+
+@stage("certificate")
+def verify_request_certificate(handler, cert_pem):
+    """
+    verify_certificate_pem() for a certificate carried in a request body. When the
+    body carries the same certificate the client authenticated the TLS connection
+    with, and the handshake verified client certificates against the registry's own
+    CA, it is accepted without being parsed again. Raises on failure.
+    """
+    peer_pem = peer_certificate_pem(handler)
+    context = getattr(handler.connection, 'context', None)
+    if (peer_pem is not None and getattr(context, 'client_ca_is_registry_ca', False)
+            and isinstance(cert_pem, str) and _compact_pem(cert_pem) == _compact_pem(peer_pem)):
+        return
+    verify_certificate_pem(cert_pem)
+
+
+def preload(schema_names=()):
+    """Import the heavy dependencies and load schemas and the CA certificate now."""
+    for name in schema_names:
+        schema_validator(name)
+    load_ca_cert()
+
+
+class BufferPool:
+    """
+    Reusable receive buffers, so request bodies are read without allocating per
+    request. Buffers grow in powers of two to fit the largest body seen, and at
+    most max_buffers idle ones are kept.
+    """
+    def __init__(self, max_buffers=16, initial_size=16 * 1024):
+        self.max_buffers = max_buffers
+        self.initial_size = initial_size
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        with self._lock:
+            buffer = self._free.pop() if self._free else None
+        if buffer is None or len(buffer) < size:
+            capacity = self.initial_size
+            while capacity < size:
+                capacity *= 2
+            buffer = bytearray(capacity)
+        return buffer
+
+    def release(self, buffer):
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+
+BODY_BUFFERS = BufferPool()
+
+
+# A JSON string (unterminated ones run to the end of the text) or a bracket.
+# Possessive, so a string is consumed in one step and never rescanned.
+_JSON_STRUCTURE_RE = re.compile(r'"(?:[^"\\]++|\\.)*+"?|[\[\]{}]')
+
+
+def json_depth_exceeds(text, max_depth):
+    """
+    True if text nests arrays/objects deeper than max_depth. Only brackets outside
+    strings count. Text with too few opening brackets to nest that deep is
+    answered by str.count(); otherwise the regex engine skips over strings and
+    everything between brackets, so the Python loop only runs once per string or
+    bracket.
+    """
+    if text.count('[') + text.count('{') <= max_depth:
+        return False
+    depth = 0
+    for match in _JSON_STRUCTURE_RE.finditer(text):
+        char = text[match.start()]
+        if char == '[' or char == '{':
+            depth += 1
+            if depth > max_depth:
+                return True
+        elif char == ']' or char == '}':
+            depth -= 1
+    return False
+
+
+def _reject_body(handler, code, message):
+    # The unread rest of the body would be taken for the next request, so the
+    # connection is not reused after a rejected body
+    handler.close_connection = True
+    handler.send_response(code)
+    handler.end_headers()
+    handler.wfile.write(message.encode('utf-8'))
+    return False, None
+
+
+@stage("read_body")
+def read_json_body(handler):
+    """
+    Read and parse the JSON request body of handler with bounded memory.
+    Returns (True, parsed) or, after sending the error response, (False, None):
+    411 without a Content-Length (chunked bodies included), 413 past
+    handler.max_body_bytes (MAX_BODY_BYTES), 400 for a short, non-UTF-8,
+    too deeply nested or otherwise invalid JSON body. The limit is checked
+    before anything is read and the body goes into a pooled buffer with
+    readinto(), so the only per-request copy is the decoded text.
+    """
+    max_bytes = getattr(handler, 'max_body_bytes', MAX_BODY_BYTES)
+    if handler.headers.get('Transfer-Encoding') or handler.headers.get('Content-Length') is None:
+        return _reject_body(handler, 411, 'Content-Length required')
+    try:
+        length = int(handler.headers['Content-Length'])
+        if length < 0:
+            raise ValueError
+    except ValueError:
+        return _reject_body(handler, 400, 'Invalid Content-Length')
+    if length > max_bytes:
+        return _reject_body(handler, 413, f'Request body larger than {max_bytes} bytes')
+    buffer = BODY_BUFFERS.acquire(length)
+    view = memoryview(buffer)
+    try:
+        received = 0
+        while received < length:
+            count = handler.rfile.readinto(view[received:length])
+            if not count:
+                break
+            received += count
+        text = str(view[:length], 'utf-8') if received == length else None
+    except UnicodeDecodeError:
+        return _reject_body(handler, 400, 'Request body is not UTF-8')
+    finally:
+        view.release()
+        BODY_BUFFERS.release(buffer)
+    if text is None:
+        return _reject_body(handler, 400, 'Incomplete request body')
+    handler._body_pending = False
+    if json_depth_exceeds(text, MAX_JSON_DEPTH):
+        return _reject_body(handler, 400, f'JSON nested deeper than {MAX_JSON_DEPTH} levels')
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        handler.send_response(400)
+        handler.end_headers()
+        handler.wfile.write(b'Invalid JSON')
+        return False, None
+    # Kept for the traffic recorder (see KeepAliveMixin.handle_one_request)
+    handler._request_body = parsed
+    return True, parsed
+
+
+def _send_admin(handler, code, body, content_type='application/json', headers=None):
+    handler.send_response(code)
+    handler.send_header('Content-Type', content_type)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.send_header('Cache-Control', 'no-store')
+    if code == 401:
+        handler.send_header('WWW-Authenticate', 'Bearer')
+    handler.end_headers()
+    handler.wfile.write(body if isinstance(body, bytes) else json.dumps(body).encode('utf-8'))
+
+
+def serve_admin(handler):
+    """
+    Answer an /admin/ request for any server (see request_profiler.py). Requires
+    "Authorization: Bearer <AGENT_ADMIN_TOKEN>"; without a configured token the
+    endpoints do not exist.
+
+    GET /admin/profile?seconds=N&interval=S   sample all threads for N seconds
+                                              (default 5), folded stacks as text
+    GET /admin/slow-requests?limit=N          slow requests with stage timings,
+                                              newest first
+    """
+    parsed = urlparse(handler.path)
+    if not ADMIN_TOKEN or parsed.path not in ('/admin/profile', '/admin/slow-requests'):
+        _send_admin(handler, 404, b'Not Found', 'text/plain')
+        return
+    supplied = handler.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(supplied, f'Bearer {ADMIN_TOKEN}'.encode('utf-8')):
+        _send_admin(handler, 401, {"status": "failure", "errorMessage": "Admin token required."})
+        return
+    if handler.command != 'GET':
+        _send_admin(handler, 405, {"status": "failure", "errorMessage": "Use GET."})
+        return
+    params = parse_qs(parsed.query)
+    try:
+        if parsed.path == '/admin/slow-requests':
+            limit = int(params.get('limit', ['0'])[0])
+            _send_admin(handler, 200, {"thresholdMs": SLOW_REQUESTS.threshold_ms, "requests": SLOW_REQUESTS.entries(limit)})
+            return
+        seconds = float(params.get('seconds', ['5'])[0])
+        interval = float(params.get('interval', ['0'])[0]) or None
+        if not 0 < seconds <= PROFILE_MAX_SECONDS or (interval is not None and not 0 < interval <= 1):
+            raise ValueError
+    except ValueError:
+        _send_admin(handler, 400, {"status": "failure", "errorMessage": f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}], interval in (0, 1]"})
+        return
+    result = sample_stacks(seconds, interval) if interval else sample_stacks(seconds)
+    if result is None:
+        _send_admin(handler, 409, {"status": "failure", "errorMessage": "A profile is already running."})
+        return
+    counts, samples = result
+    _send_admin(handler, 200, folded(counts).encode('utf-8'), 'text/plain; charset=utf-8', {'X-Profile-Samples': str(samples)})
+
+
+class KeepAliveMixin:
+    """
+    HTTP/1.1 persistent connections for the BaseHTTPRequestHandler subclasses.
+
+    Handlers keep writing responses the usual way (send_response, send_header,
+    end_headers, wfile.write). The body is buffered and sent with a Content-Length
+    header, so the client can reuse the connection for its next request. Call
+    stream_response() instead of end_headers() to write an unbuffered body; the
+    connection is closed after that response. A response sent before
+    read_json_body() consumed a declared request body (a 404, a 429, an /admin/
+    answer) also closes the connection, so the unread body is never parsed as
+    the next request.
+
+    With a traffic recorder configured (AGENT_TRACE_LOG, see traffic_recorder.py)
+    a sample of the answered requests is written to the trace log. Every request
+    is timed for the slow-request buffer, and /admin/ paths are answered by
+    serve_admin() before the handler's do_GET/do_POST sees them.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def handle(self):
+        # Over TLS (see enable_tls) the handshake happens here, under the
+        # connection's timeout, before the first request is read
+        do_handshake = getattr(self.connection, 'do_handshake', None)
+        if do_handshake is not None:
+            try:
+                do_handshake()
+            except OSError as e:
+                self.log_message("TLS handshake failed: %s", e)
+                self.close_connection = True
+                return
+        super().handle()
+
+    def handle_one_request(self):
+        self._socket_wfile = self.wfile
+        self._response_status = None
+        self._headers_pending = False
+        self._request_body = None
+        self._body_pending = False
+        self.wfile = io.BytesIO()
+        self._timer = None
+        recorder = traffic_recorder.TRAFFIC_RECORDER
+        traced = recorder is not None and recorder.sampled()
+        try:
+            super().handle_one_request()
+        finally:
+            buffered, self.wfile = self.wfile, self._socket_wfile
+            if self._headers_pending:
+                with stage("respond"):
+                    self._send_buffered(buffered.getvalue())
+            # No timer means no request line arrived (an idle keep-alive connection
+            # closed, or a line too long to parse)
+            timer = self._timer
+            if timer is not None:
+                SLOW_REQUESTS.end(timer, getattr(self, "command", None), getattr(self, "path", None), self._response_status)
+                if traced and self._response_status is not None:
+                    recorder.record(self.command, self.path, self._request_body, self._response_status,
+                                    timer.elapsed_ms() / 1000)
+
+    def parse_request(self):
+        # The request line has just been read: time from here, so the wait for it
+        # on an idle keep-alive connection is not counted
+        self._timer = SLOW_REQUESTS.begin()
+        if not super().parse_request():
+            return False
+        length = self.headers.get('Content-Length')
+        self._body_pending = bool(self.headers.get('Transfer-Encoding')) or (length is not None and length.strip() != '0')
+        if self.path.startswith('/admin/'):
+            serve_admin(self)
+            # The response is sent; returning False skips the do_GET/do_POST dispatch
+            return False
+        return True
+
+    def send_response(self, code, message=None):
+        self._response_status = code
+        super().send_response(code, message)
+
+    def end_headers(self):
+        if self.wfile is self._socket_wfile:
+            super().end_headers()
+        else:
+            self._headers_pending = True
+
+    def stream_response(self):
+        """Send the headers now and let the body go straight to the socket."""
+        self.close_connection = True
+        self._headers_pending = False
+        self.wfile = self._socket_wfile
+        super().end_headers()
+
+    def _send_buffered(self, body):
+        headers = getattr(self, '_headers_buffer', [])
+        has_length = any(line.lower().startswith(b'content-length:') for line in headers)
+        if not has_length and self._response_status not in (204, 304):
+            self.send_header('Content-Length', str(len(body)))
+        if self._body_pending:
+            # Answered without reading the body: its bytes would be read as the next request
+            if not any(line.lower().startswith(b'connection:') for line in headers):
+                self.send_header('Connection', 'close')
+            self.close_connection = True
+        super().end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+        self.wfile.flush()
@@ -2,17 +2,133 @@
 Mitigation Example 3: Strong Authentication & Authorization
 Uses JWT and environment-based credentials to ensure agent identity and secure operations.
 """
-from samples.python.common.types import AuthenticationInfo
+import hashlib
+import json
 import os
-from jose import jwt, JWTError
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from jose import jwk, jwt, JWTError
+from jose.exceptions import JWKError
+
+try:
+    from samples.python.common.types import AuthenticationInfo
+except ImportError:
+    # Outside the A2A samples tree: the two fields get_authentication_info() fills in
+    AuthenticationInfo = namedtuple("AuthenticationInfo", "schemes credentials")
+
+# Decoded tokens kept per TokenVerifier.
+TOKEN_CACHE_SIZE = int(os.environ.get("AGENT_TOKEN_CACHE_SIZE", "10000"))
+# Public keys validate_jwt keeps a TokenVerifier for; the least recently used is dropped.
+MAX_VERIFIERS = int(os.environ.get("AGENT_MAX_VERIFIERS", "64"))
+
+class TokenVerifier:
+    """
+    RS256 bearer token verification with the RSA work done once per token.
+
+    Public keys are parsed once, either from one PEM or from a local JWKS file
+    ({"keys": [...]}, selected by the token's "kid" header). A verified token's
+    claims are cached under the SHA-256 of the token and the audience until the
+    token's "exp" time, so repeat requests with the same token skip the signature
+    check. Tokens without "exp" are verified every time. Audience and the other
+    claims are enforced by jwt.decode exactly as in validate_jwt.
+    """
+    def __init__(self, public_key=None, jwks_path=None, algorithms=('RS256',), max_entries=TOKEN_CACHE_SIZE, clock=time.time):
+        if (public_key is None) == (jwks_path is None):
+            raise ValueError("Give either public_key or jwks_path")
+        self.algorithms = list(algorithms)
+        self.jwks_path = jwks_path
+        self.max_entries = max_entries
+        self.clock = clock
+        self._keys = {}  # kid (None for a single PEM key) -> parsed jose key
+        self._jwks_mtime = None
+        self._cache = OrderedDict()  # (token digest, audience) -> (claims, exp)
+        self._lock = threading.Lock()
+        try:
+            if public_key is not None:
+                self._keys[None] = jwk.construct(public_key, self.algorithms[0])
+            else:
+                self._load_jwks()
+        except JWKError as e:
+            raise ValueError(f'Invalid public key: {e}')
+
+    def _load_jwks(self):
+        """Re-read the JWKS file if it changed. Raises ValueError if it is missing or invalid."""
+        try:
+            mtime = os.stat(self.jwks_path).st_mtime
+            if mtime == self._jwks_mtime:
+                return False
+            with open(self.jwks_path) as f:
+                jwks = json.load(f)
+            keys = {key.get("kid"): jwk.construct(key, key.get("alg", self.algorithms[0])) for key in jwks["keys"]}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, JWKError) as e:
+            # json.JSONDecodeError is a ValueError
+            raise ValueError(f'Invalid JWKS file {self.jwks_path}: {e}')
+        self._keys = keys
+        self._jwks_mtime = mtime
+        return True
+
+    def _key_for(self, token):
+        if self.jwks_path is None:
+            return self._keys[None]
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self._keys.get(kid)
+        # An unknown kid may be a key that was rotated in since the file was read
+        if key is None and self._load_jwks():
+            key = self._keys.get(kid)
+        if key is None:
+            raise JWTError(f"No key with kid {kid!r}")
+        return key
+
+    def verify(self, token, audience=None):
+        """Return the token's claims. Raises ValueError for an invalid or expired token."""
+        cache_key = (hashlib.sha256(token.encode("utf-8")).digest(), audience)
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                if self.clock() < cached[1]:
+                    self._cache.move_to_end(cache_key)
+                    return dict(cached[0])
+                del self._cache[cache_key]
+        try:
+            claims = jwt.decode(token, self._key_for(token), audience=audience, algorithms=self.algorithms)
+        except (JWTError, JWKError):
+            # JWKError: a rotated-in JWKS key that does not parse
+            raise ValueError('Invalid or expired token')
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)) and not isinstance(exp, bool):
+            with self._lock:
+                self._cache[cache_key] = (dict(claims), exp)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return claims
+
+_verifiers = OrderedDict()  # public key -> TokenVerifier, least recently used first
+_verifiers_lock = threading.Lock()
 
 # Note: Functions in this file expect agent identifier fields: protocol, agentName, agentCategory, providerName, version, extension (optional) where relevant.
 def validate_jwt(token, public_key, audience):
     try:
-        payload = jwt.decode(token, public_key, audience=audience, algorithms=['RS256'])
-        return payload
-    except JWTError:
-        raise ValueError('Invalid or expired token')
+        hash(public_key)
+    except TypeError:
+        # A JWK dict cannot key the verifier cache, so it is verified directly
+        try:
+            return jwt.decode(token, public_key, audience=audience, algorithms=['RS256'])
+        except (JWTError, JWKError):
+            raise ValueError('Invalid or expired token')
+    # One cached verifier per public key, so the key is parsed once and repeat tokens skip the RSA verify
+    with _verifiers_lock:
+        verifier = _verifiers.get(public_key)
+        if verifier is not None:
+            _verifiers.move_to_end(public_key)
+    if verifier is None:
+        verifier = TokenVerifier(public_key=public_key)
+        with _verifiers_lock:
+            verifier = _verifiers.setdefault(public_key, verifier)
+            _verifiers.move_to_end(public_key)
+            while len(_verifiers) > MAX_VERIFIERS:
+                _verifiers.popitem(last=False)
+    return verifier.verify(token, audience)
 
 def get_authentication_info() -> AuthenticationInfo:
     token = os.environ.get("A2A_TOKEN")
@@ -0,0 +1,111 @@
+"""
+bench_startup.py
+Measures cold-start cost of each service entry point: the time from interpreter
+start to the module being imported, and to the first response being served.
+
+Each service is started in a fresh subprocess (so nothing is cached between runs)
+on an ephemeral port, and a representative first request is sent to it: a schema
+validation plus certificate check for the write endpoints, a status lookup against
+an empty temporary database, and a discovery query.
+
+Usage:
+    python bench_startup.py [--runs 5] [--preload]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+INVALID_CERT = "-----BEGIN CERTIFICATE-----\nMIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAn...\n-----END CERTIFICATE-----"
+CERTIFICATE = {
+    "certificateSubject": "CN=TestAgent,O=TestOrg,C=US",
+    "certificateIssuer": "CN=LocalCA,O=TestOrg,C=US",
+    "certificateSerialNumber": "1234567890",
+    "certificateValidFrom": "2025-04-20T00:00:00Z",
+    "certificateValidTo": "2026-04-20T00:00:00Z",
+    "certificatePEM": INVALID_CERT,
+    "certificatePublicKeyAlgorithm": "RSA",
+    "certificateSignatureAlgorithm": "SHA256withRSA",
+}
+AGENT = {
+    "protocol": "a2a",
+    "agentName": "BenchAgent",
+    "agentCategory": "translator",
+    "providerName": "openai",
+    "version": "1.0",
+    "agentUseJustification": "Startup benchmark",
+    "agentCapability": "DocumentTranslation",
+    "agentEndpoint": "a2a://benchagent.translator.openai.agent",
+    "agentDID": "did:example:benchagent",
+    "certificate": CERTIFICATE,
+}
+
+# module, handler class, method, path, body
+SERVICES = [
+    ("agent_registration_api", "RegistrationHandler", "POST", "/register",
+     {"requestType": "registration", "requestingAgent": AGENT}),
+    ("agent_renewal_api", "RenewalHandler", "POST", "/renew",
+     {"requestType": "renewal", "requestingAgent": {"agentName": "BenchAgent", "agentDID": "did:example:benchagent", "certificate": CERTIFICATE}}),
+    ("agent_deactivation_api", "DeactivationHandler", "POST", "/deactivate",
+     {"protocol": "a2a", "agentName": "BenchAgent", "agentCategory": "translator", "providerName": "openai", "version": "1.0"}),
+    ("agent_status_api", "StatusHandler", "GET", "/status?agentName=BenchAgent", None),
+    ("agent_discovery_api", "DiscoveryHandler", "POST", "/discover",
+     {"requestType": "discovery", "requestingAgent": AGENT}),
+]
+
+CHILD = r"""
+import time
+t_start = time.perf_counter()
+import http.client, importlib, json, sys, threading
+from http.server import HTTPServer
+module_name, handler_name, method, path, body = json.loads(sys.argv[1])
+module = importlib.import_module(module_name)
+if sys.argv[2] == "1":
+    import api_common
+    if hasattr(module, "TOOL"):
+        module.TOOL.preload()
+    else:
+        api_common.preload([v for k, v in vars(module).items() if k.endswith("_REQUEST_SCHEMA")])
+t_import = time.perf_counter()
+server = HTTPServer(("127.0.0.1", 0), getattr(module, handler_name))
+server.RequestHandlerClass.log_message = lambda *args: None
+threading.Thread(target=server.serve_forever, daemon=True).start()
+conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+payload = json.dumps(body) if body is not None else None
+conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+status = conn.getresponse().status
+t_first = time.perf_counter()
+print(json.dumps({"import": t_import - t_start, "first_response": t_first - t_start, "status": status}))
+"""
+
+
+def run_once(service, preload, env):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, json.dumps(service), "1" if preload else "0"],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", action="store_true", help="load schemas/CA eagerly after import (AGENT_PRELOAD=1)")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, AGENT_DB_PATH=os.path.join(tmpdir, "bench.db"))
+        print(f"{'service':<26}{'import ms':>12}{'first resp ms':>16}{'status':>8}")
+        for service in SERVICES:
+            samples = [run_once(service, args.preload, env) for _ in range(args.runs)]
+            import_ms = statistics.median(s["import"] for s in samples) * 1000
+            first_ms = statistics.median(s["first_response"] for s in samples) * 1000
+            print(f"{service[0]:<26}{import_ms:>12.1f}{first_ms:>16.1f}{samples[-1]['status']:>8}")
+
+
+if __name__ == "__main__":
+    main()
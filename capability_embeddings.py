@@ -0,0 +1,154 @@
+"""
+capability_embeddings.py
+Offline semantic matching of agent capabilities.
+
+- HashingEmbedder turns capability text into fixed-size vectors with the hashing
+  trick (words split on camelCase/punctuation plus character trigrams, each hashed
+  to a signed dimension). No model files, vocabulary or network access needed, so
+  "LegalTranslation" lands close to "DocumentTranslation" and "Translation".
+- SemanticIndex keeps one L2-normalised row per agent and scores a query against
+  all rows with a single matrix-vector product (NumPy when installed, pure Python
+  otherwise). Scoring is always exact: one product over tens of thousands of
+  rows takes milliseconds, and a query returns the same agents at any registry
+  size.
+"""
+import hashlib
+import math
+import re
+
+DEFAULT_DIMENSIONS = 512
+
+_WORD_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def tokenize(text):
+    """Split 'LegalTranslation v2_en-fr' into ['legal', 'translation', 'v', '2', 'en', 'fr']."""
+    return [word.lower() for word in _WORD_RE.findall(text or "")]
+
+
+def agent_text(profile):
+    """The text of a profile that is embedded: its capability, card capabilities and description."""
+    card = profile.get("a2aAgentCard") or {}
+    parts = [profile.get("agentCapability") or ""] * 2
+    parts.extend(card.get("capabilities") or [])
+    parts.append(card.get("description") or "")
+    return " ".join(str(part) for part in parts)
+
+
+class HashingEmbedder:
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, trigram_weight=0.5):
+        self.dimensions = dimensions
+        self.trigram_weight = trigram_weight
+
+    def _features(self, text):
+        for word in tokenize(text):
+            yield word, 1.0
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                yield "#" + padded[i:i + 3], self.trigram_weight
+
+    def embed(self, text):
+        """Return an L2-normalised vector as a list of floats."""
+        vector = [0.0] * self.dimensions
+        for feature, weight in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[bucket] += sign * weight
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+
+class SemanticIndex:
+    """
+    Incrementally maintained embedding index over agent profiles keyed by agentDID.
+    Implements the add/remove index protocol used by CapabilityRegistry.
+    """
+    def __init__(self, embedder=None):
+        self.embedder = embedder or HashingEmbedder()
+        self.np = _numpy()
+        self._dids = []
+        self._rows = {}        # did -> row number
+        self._profiles = []
+        dim = self.embedder.dimensions
+        if self.np is not None:
+            self._matrix = self.np.zeros((16, dim), dtype=self.np.float32)
+        else:
+            self._matrix = []
+
+    def __len__(self):
+        return len(self._dids)
+
+    def add(self, did, profile):
+        if did in self._rows:
+            self.remove(did, self._profiles[self._rows[did]])
+        vector = self.embedder.embed(agent_text(profile))
+        row = len(self._dids)
+        self._dids.append(did)
+        self._profiles.append(profile)
+        self._rows[did] = row
+        if self.np is None:
+            self._matrix.append(vector)
+            return
+        if row >= self._matrix.shape[0]:
+            grown = self.np.zeros((self._matrix.shape[0] * 2, self._matrix.shape[1]), dtype=self.np.float32)
+            grown[:row] = self._matrix[:row]
+            self._matrix = grown
+        self._matrix[row] = vector
+
+    def remove(self, did, profile=None):
+        row = self._rows.pop(did, None)
+        if row is None:
+            return
+        last = len(self._dids) - 1
+        # Swap the last row into the hole so rows stay dense
+        if row != last:
+            moved = self._dids[last]
+            self._dids[row] = moved
+            self._profiles[row] = self._profiles[last]
+            self._matrix[row] = self._matrix[last]
+            self._rows[moved] = row
+        self._dids.pop()
+        self._profiles.pop()
+        if self.np is None:
+            self._matrix.pop()
+
+    def search(self, text, limit=10, min_score=0.0):
+        """
+        Return [(score, profile)] for the best matches of text, best first. Equal
+        scores are ordered by row, so a larger limit returns the same prefix.
+        """
+        if not self._dids or limit <= 0:
+            return []
+        query = self.embedder.embed(text)
+        if self.np is None:
+            scored = [(sum(a * b for a, b in zip(row, query)), i) for i, row in enumerate(self._matrix)]
+            scored = [item for item in scored if item[0] >= min_score]
+            scored.sort(key=lambda item: -item[0])
+            return [(score, self._profiles[i]) for score, i in scored[:limit]]
+        np = self.np
+        scores = self._matrix[:len(self._dids)] @ np.asarray(query, dtype=np.float32)
+        if limit < scores.size:
+            # Keep every row tied with the limit-th score, then cut after ordering
+            kth = scores[np.argpartition(-scores, limit - 1)[limit - 1]]
+            top = np.flatnonzero(scores >= kth)
+        else:
+            top = np.arange(scores.size)
+        top = top[np.lexsort((top, -scores[top]))][:limit]
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score < min_score:
+                break
+            results.append((score, self._profiles[int(i)]))
+        return results
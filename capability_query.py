@@ -0,0 +1,242 @@
+"""
+capability_query.py
+Multi-attribute filters over agent additionalCapabilities.
+
+A discovery request may carry queryParameters.filters, mapping attribute names to
+a value (equality) or to a dict of operators:
+
+    "filters": {
+        "latency": {"lt": 200},
+        "bleuScore": {"gt": 35},
+        "languagePair": "en-fr",
+        "domainExpertise": {"in": ["Legal", "Finance"]},
+        "region": {"prefix": "eu-"}
+    }
+
+Operators: eq, lt, lte, gt, gte, in, prefix. All conditions must hold.
+
+AttributeIndex keeps, per attribute, a sorted column of numeric values, a
+value -> agents map (with sorted distinct values for prefix search) for strings
+and a value -> agents map for booleans.
+A query estimates how many agents each condition selects from the index, takes
+the most selective one as the candidate set and checks the remaining conditions
+only on those candidates, so no query scans every agent profile.
+"""
+import bisect
+import numbers
+
+OPERATORS = ("eq", "lt", "lte", "gt", "gte", "in", "prefix")
+RANGE_OPERATORS = ("lt", "lte", "gt", "gte")
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _equal(value, operand):
+    # JSON true is not 1: a boolean only equals a boolean
+    if isinstance(value, bool) or isinstance(operand, bool):
+        return value is operand
+    return value == operand
+
+
+def parse_filters(filters):
+    """Normalise a filters dict into [(attribute, operator, value)]. Raises ValueError."""
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    predicates = []
+    for attribute, condition in filters.items():
+        if not isinstance(condition, dict):
+            condition = {"eq": condition}
+        if not condition:
+            raise ValueError(f"empty condition for '{attribute}'")
+        for op, value in condition.items():
+            if op not in OPERATORS:
+                raise ValueError(f"unknown operator '{op}' for '{attribute}'")
+            if op in RANGE_OPERATORS and not _is_number(value):
+                raise ValueError(f"'{op}' on '{attribute}' needs a number")
+            if op == "in" and not isinstance(value, list):
+                raise ValueError(f"'in' on '{attribute}' needs a list")
+            if op == "prefix" and not isinstance(value, str):
+                raise ValueError(f"'prefix' on '{attribute}' needs a string")
+            if op == "eq" and not isinstance(value, (str, numbers.Real)):
+                raise ValueError(f"'eq' on '{attribute}' needs a string, number or boolean (use 'in' for a list)")
+            predicates.append((attribute, op, value))
+    return predicates
+
+
+def _holds(value, op, operand):
+    if op == "eq":
+        return _equal(value, operand)
+    if op == "in":
+        return any(_equal(value, item) for item in operand)
+    if op == "prefix":
+        return isinstance(value, str) and value.startswith(operand)
+    if not _is_number(value):
+        return False
+    if op == "lt":
+        return value < operand
+    if op == "lte":
+        return value <= operand
+    if op == "gt":
+        return value > operand
+    return value >= operand
+
+
+def matches_filters(agent, predicates):
+    """Check parsed predicates directly against one profile (no index)."""
+    additional = agent.get("additionalCapabilities") or {}
+    for attribute, op, operand in predicates:
+        if attribute not in additional or not _holds(additional[attribute], op, operand):
+            return False
+    return True
+
+
+class _NumericColumn:
+    def __init__(self):
+        self.values = []
+        self.dids = []
+
+    def add(self, value, did):
+        position = bisect.bisect_right(self.values, value)
+        self.values.insert(position, value)
+        self.dids.insert(position, did)
+
+    def remove(self, value, did):
+        position = bisect.bisect_left(self.values, value)
+        while position < len(self.values) and self.values[position] == value:
+            if self.dids[position] == did:
+                del self.values[position]
+                del self.dids[position]
+                return
+            position += 1
+
+    def span(self, op, operand):
+        if op == "lt":
+            return 0, bisect.bisect_left(self.values, operand)
+        if op == "lte":
+            return 0, bisect.bisect_right(self.values, operand)
+        if op == "gt":
+            return bisect.bisect_right(self.values, operand), len(self.values)
+        if op == "gte":
+            return bisect.bisect_left(self.values, operand), len(self.values)
+        # eq on a number
+        return bisect.bisect_left(self.values, operand), bisect.bisect_right(self.values, operand)
+
+
+class _StringColumn:
+    def __init__(self):
+        self.by_value = {}
+        self.sorted_values = []
+
+    def add(self, value, did):
+        dids = self.by_value.get(value)
+        if dids is None:
+            dids = self.by_value[value] = set()
+            bisect.insort(self.sorted_values, value)
+        dids.add(did)
+
+    def remove(self, value, did):
+        dids = self.by_value.get(value)
+        if dids is None:
+            return
+        dids.discard(did)
+        if not dids:
+            del self.by_value[value]
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, value)]
+
+    def values_with_prefix(self, prefix):
+        start = bisect.bisect_left(self.sorted_values, prefix)
+        for value in self.sorted_values[start:]:
+            if not value.startswith(prefix):
+                break
+            yield value
+
+
+class AttributeIndex:
+    """
+    Secondary index over additionalCapabilities, implementing the add/remove
+    protocol of CapabilityRegistry.
+    """
+    def __init__(self):
+        self._numeric = {}
+        self._strings = {}
+        self._booleans = {}  # attribute -> {True: dids, False: dids}
+        self._indexed = {}  # did -> {attribute: value} as indexed, for removal
+
+    def add(self, did, profile):
+        if did in self._indexed:
+            self.remove(did)
+        indexed = {}
+        for attribute, value in (profile.get("additionalCapabilities") or {}).items():
+            if isinstance(value, bool):
+                self._booleans.setdefault(attribute, {True: set(), False: set()})[value].add(did)
+            elif _is_number(value):
+                self._numeric.setdefault(attribute, _NumericColumn()).add(value, did)
+            elif isinstance(value, str):
+                self._strings.setdefault(attribute, _StringColumn()).add(value, did)
+            else:
+                continue
+            indexed[attribute] = value
+        self._indexed[did] = indexed
+
+    def remove(self, did, profile=None):
+        for attribute, value in self._indexed.pop(did, {}).items():
+            if isinstance(value, bool):
+                self._booleans[attribute][value].discard(did)
+            elif _is_number(value):
+                self._numeric[attribute].remove(value, did)
+            else:
+                self._strings[attribute].remove(value, did)
+
+    def _selection(self, attribute, op, operand):
+        """Return (estimated size, callable producing the matching dids) for one predicate."""
+        numeric = self._numeric.get(attribute)
+        strings = self._strings.get(attribute)
+        booleans = self._booleans.get(attribute)
+        if op == "eq" and isinstance(operand, bool):
+            dids = booleans[operand] if booleans is not None else ()
+            return len(dids), lambda: dids
+        if op in RANGE_OPERATORS or (op == "eq" and _is_number(operand)):
+            if numeric is None:
+                return 0, lambda: ()
+            lo, hi = numeric.span(op, operand)
+            return hi - lo, lambda: numeric.dids[lo:hi]
+        if op == "in":
+            sets = []
+            for v in operand:
+                if isinstance(v, bool):
+                    if booleans is not None:
+                        sets.append(booleans[v])
+                elif _is_number(v) and numeric is not None:
+                    lo, hi = numeric.span("eq", v)
+                    sets.append(set(numeric.dids[lo:hi]))
+                elif strings is not None and isinstance(v, str) and v in strings.by_value:
+                    sets.append(strings.by_value[v])
+            return sum(len(s) for s in sets), lambda: set().union(*sets)
+        if strings is None:
+            return 0, lambda: ()
+        if op == "eq":
+            dids = strings.by_value.get(operand, ())
+            return len(dids), lambda: dids
+        sets = [strings.by_value[v] for v in strings.values_with_prefix(operand)]
+        return sum(len(s) for s in sets), lambda: set().union(*sets)
+
+    def query(self, predicates):
+        """
+        Return the set of agentDIDs satisfying every predicate, or None when there
+        are no predicates (meaning "no restriction").
+        """
+        if not predicates:
+            return None
+        ranked = sorted(((self._selection(*predicate), predicate) for predicate in predicates), key=lambda item: item[0][0])
+        (size, produce), best = ranked[0]
+        if size == 0:
+            return set()
+        rest = [predicate for _, predicate in ranked[1:]]
+        result = set()
+        for did in produce():
+            indexed = self._indexed[did]
+            if all(attribute in indexed and _holds(indexed[attribute], op, operand) for attribute, op, operand in rest):
+                result.add(did)
+        return result
@@ -0,0 +1,210 @@
+"""
+capability_registry.py
+In-memory registry of advertised agent capability profiles.
+
+CapabilityRegistry is a drop-in replacement for the plain dict that
+AgentDiscoveryTool.handle_advertisement() stores profiles in (keyed by agentDID).
+It additionally keeps profiles bucketed by agentCapability and gives every
+capability result set a monotonic version, so discovery responses can carry an
+ETag and repeat polls can be answered with 304 Not Modified.
+
+Secondary indexes (the SemanticIndex from capability_embeddings.py, the
+AttributeIndex from capability_query.py) are
+registered with add_index() and kept up to date on every insert and removal.
+"""
+import bisect
+import hashlib
+import json
+import time
+from collections.abc import MutableMapping
+from datetime import timezone
+
+from registry_versions import VersionMap
+
+# Version key covering every profile, for queries that are not scoped to one capability.
+ALL_CAPABILITIES = "*"
+
+
+def certificate_edges(profile):
+    """
+    The notBefore and notAfter times of the profile's certificate as timestamps:
+    the moments its discovery results change without any advertisement. Empty if
+    the certificate cannot be parsed (such a profile is never matched).
+    """
+    try:
+        from cryptography import x509
+        cert = x509.load_pem_x509_certificate(profile["certificate"]["certificatePEM"].encode())
+    except Exception:
+        return ()
+    return (cert.not_valid_before.replace(tzinfo=timezone.utc).timestamp(),
+            cert.not_valid_after.replace(tzinfo=timezone.utc).timestamp())
+
+
+class CapabilityRegistry(MutableMapping):
+    def __init__(self, *args, **kwargs):
+        self._profiles = {}
+        self._by_capability = {}
+        self._sorted_dids = {}  # capability -> agentDIDs in sorted order, for paging
+        self._edges = {}  # version key -> sorted certificate validity edges (see certificate_edges)
+        self._profile_edges = {}  # agentDID -> its profile's certificate_edges
+        self.indexes = []
+        self._semantic_index = None
+        self._attribute_index = None
+        self._health = None
+        self.versions = VersionMap(ttl=None)
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, did):
+        return self._profiles[did]
+
+    def __setitem__(self, did, profile):
+        old = self._profiles.get(did)
+        if old is not None:
+            self._unindex(did, old)
+        self._profiles[did] = profile
+        capability = profile.get("agentCapability")
+        self._by_capability.setdefault(capability, {})[did] = profile
+        bisect.insort(self._sorted_dids.setdefault(capability, []), did)
+        edges = certificate_edges(profile)
+        if edges:
+            self._profile_edges[did] = edges
+        for edge in edges:
+            for key in (capability, ALL_CAPABILITIES):
+                bisect.insort(self._edges.setdefault(key, []), edge)
+        for index in self.indexes:
+            index.add(did, profile)
+        self.versions.bump(capability)
+        self.versions.bump(ALL_CAPABILITIES)
+
+    def __delitem__(self, did):
+        profile = self._profiles.pop(did)
+        self._unindex(did, profile)
+        if self._health is not None:
+            self._health.forget(did)
+
+    def __iter__(self):
+        return iter(self._profiles)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def _unindex(self, did, profile, bump=True):
+        capability = profile.get("agentCapability")
+        bucket = self._by_capability.get(capability)
+        if bucket is not None:
+            bucket.pop(did, None)
+            if not bucket:
+                del self._by_capability[capability]
+        dids = self._sorted_dids.get(capability)
+        if dids is not None:
+            position = bisect.bisect_left(dids, did)
+            if position < len(dids) and dids[position] == did:
+                del dids[position]
+            if not dids:
+                del self._sorted_dids[capability]
+        for edge in self._profile_edges.pop(did, ()):
+            for key in (capability, ALL_CAPABILITIES):
+                edges = self._edges[key]
+                del edges[bisect.bisect_left(edges, edge)]
+                if not edges:
+                    del self._edges[key]
+        for index in self.indexes:
+            index.remove(did, profile)
+        if bump:
+            self.versions.bump(capability)
+            self.versions.bump(ALL_CAPABILITIES)
+
+    def remove_matching(self, provider_name, agent_category=None, version=None, agent_name=None):
+        """
+        Remove every profile whose providerName (and agentCategory, version and
+        agentName where given) match, bumping each affected capability's version
+        once for the whole batch. Returns the removed agentDIDs.
+        """
+        wanted = {"providerName": provider_name, "agentCategory": agent_category,
+                  "version": version, "agentName": agent_name}
+        wanted = {field: value for field, value in wanted.items() if value is not None}
+        removed = [did for did, profile in self._profiles.items()
+                   if all(profile.get(field) == value for field, value in wanted.items())]
+        capabilities = set()
+        for did in removed:
+            profile = self._profiles.pop(did)
+            self._unindex(did, profile, bump=False)
+            if self._health is not None:
+                self._health.forget(did)
+            capabilities.add(profile.get("agentCapability"))
+        for capability in capabilities:
+            self.versions.bump(capability)
+        if capabilities:
+            self.versions.bump(ALL_CAPABILITIES)
+        return removed
+
+    def add_index(self, index):
+        """Register a secondary index (an object with add(did, profile) / remove(did, profile))."""
+        for did, profile in self._profiles.items():
+            index.add(did, profile)
+        self.indexes.append(index)
+        return index
+
+    def semantic_index(self):
+        """The embedding index over all profiles, built on first use and then maintained incrementally."""
+        if self._semantic_index is None:
+            from capability_embeddings import SemanticIndex
+            self._semantic_index = self.add_index(SemanticIndex())
+        return self._semantic_index
+
+    def attribute_index(self):
+        """The additionalCapabilities index used for filtered queries, built on first use."""
+        if self._attribute_index is None:
+            from capability_query import AttributeIndex
+            self._attribute_index = self.add_index(AttributeIndex())
+        return self._attribute_index
+
+    def health_table(self):
+        """Live latency/error statistics per agent (see agent_health.py), created on first use."""
+        if self._health is None:
+            from agent_health import HealthTable
+            self._health = HealthTable()
+        return self._health
+
+    def has_capability(self, capability):
+        """Exact membership test for agentCapability, so discovery misses skip all matching work."""
+        return capability in self._by_capability
+
+    def agents_for(self, capability):
+        """Profiles advertising exactly this agentCapability."""
+        return list(self._by_capability.get(capability, {}).values())
+
+    def iter_agents(self, capability, after=None):
+        """
+        Lazily yield the profiles advertising capability in agentDID order, starting
+        after the agentDID `after`. Each step re-seeks by key, so profiles added or
+        removed while a page is being produced do not skip or repeat others.
+        """
+        while True:
+            dids = self._sorted_dids.get(capability)
+            if not dids:
+                return
+            position = bisect.bisect_right(dids, after) if after is not None else 0
+            if position >= len(dids):
+                return
+            after = dids[position]
+            yield self._profiles[after]
+
+    def result_etag(self, capability, query_parameters=None, media_type="application/json"):
+        """
+        Return (etag, last_modified) for the discovery result set of capability
+        filtered by query_parameters, in the representation media_type. Only the
+        in-memory version map is consulted.
+        A certificate becoming valid or expiring changes the result set too, so the
+        ETag also covers how many of the certificate validity edges have passed.
+        """
+        # Semantic results can include agents of any capability
+        key = ALL_CAPABILITIES if (query_parameters or {}).get("matchMode") == "semantic" else capability
+        version, last_modified = self.versions.version(key)
+        edges = self._edges.get(key, ())
+        passed = bisect.bisect_right(edges, time.time())
+        if passed:
+            last_modified = max(last_modified, edges[passed - 1])
+        query = json.dumps([capability, query_parameters or {}, passed, media_type], sort_keys=True)
+        digest = hashlib.sha1(query.encode("utf-8")).hexdigest()[:12]
+        return self.versions.make_etag(version, digest), last_modified
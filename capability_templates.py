@@ -0,0 +1,138 @@
+"""
+capability_templates.py
+Shared, immutable capability templates for advertised agent profiles.
+
+A template holds the parts of a profile that are the same for every agent of one
+kind: the MCP tool and resource schemas (mcpServerInformation) and default
+additionalCapabilities. Templates are read from AGENT_CAPABILITY_TEMPLATES
+(default capability_templates.json) on first use. Each is validated once against
+capability_template.schema.json, its tool and resource schemas are checked as
+JSON Schemas, and then it is frozen.
+
+An advertisement names its template in requestingAgent.capabilityTemplate
+(default AGENT_DEFAULT_CAPABILITY_TEMPLATE) and may carry additionalCapabilities
+of its own. Only those deltas are checked per advertisement. Every profile built
+from a template shares the template's frozen structures, and a profile without
+deltas shares its additionalCapabilities too.
+"""
+import json
+import os
+import threading
+
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_PATH = os.environ.get("AGENT_CAPABILITY_TEMPLATES", os.path.join(SCHEMA_DIR, "capability_templates.json"))
+TEMPLATE_SCHEMA_FILE = os.path.join(SCHEMA_DIR, "capability_template.schema.json")
+DEFAULT_TEMPLATE = os.environ.get("AGENT_DEFAULT_CAPABILITY_TEMPLATE", "translation")
+
+
+class FrozenDict(dict):
+    """
+    A dict that refuses mutation. It is still a dict, so json.dumps, isinstance
+    checks and .get() work as before. .copy() returns an ordinary mutable dict.
+    """
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("capability templates are immutable")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """Deep immutable copy of parsed JSON: objects become FrozenDicts, arrays tuples."""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def _json_kind(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    return type(value).__name__
+
+
+class CapabilityTemplate:
+    __slots__ = ("id", "mcp_server_information", "additional_capabilities")
+
+    def __init__(self, template_id, definition):
+        self.id = template_id
+        self.mcp_server_information = freeze(definition["mcpServerInformation"])
+        self.additional_capabilities = freeze(definition["additionalCapabilities"])
+
+    def additional_capabilities_with(self, delta):
+        """
+        The template's additionalCapabilities with an advertisement's own values laid
+        over them. A value for an attribute the template defines must keep its JSON
+        type. Raises ValueError. Without a delta the template's frozen dict is returned.
+        """
+        if not delta:
+            return self.additional_capabilities
+        if not isinstance(delta, dict):
+            raise ValueError("additionalCapabilities must be an object")
+        for attribute, value in delta.items():
+            if not isinstance(value, (str, int, float)):
+                raise ValueError(f"additionalCapabilities.{attribute} must be a string, number or boolean")
+            default = self.additional_capabilities.get(attribute)
+            if default is not None and _json_kind(value) != _json_kind(default):
+                raise ValueError(f"additionalCapabilities.{attribute} must be a {_json_kind(default)} "
+                                 f"in template '{self.id}'")
+        merged = dict(self.additional_capabilities)
+        merged.update(delta)
+        return FrozenDict(merged)
+
+
+class CapabilityTemplates:
+    """Templates by id, loaded and validated on first use."""
+    def __init__(self, path=TEMPLATES_PATH):
+        self.path = path
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from jsonschema.validators import validator_for
+        with open(TEMPLATE_SCHEMA_FILE) as f:
+            template_schema = json.load(f)
+        validator = validator_for(template_schema)(template_schema)
+        with open(self.path) as f:
+            definitions = json.load(f)
+        templates = {}
+        for template_id, definition in definitions.items():
+            errors = sorted(validator.iter_errors(definition), key=lambda e: list(e.path))
+            if errors:
+                raise ValueError(f"Capability template '{template_id}' is invalid: {errors[0].message}")
+            information = definition["mcpServerInformation"]
+            embedded = [tool[key] for tool in information["tools"] for key in ("parameters", "results") if key in tool]
+            embedded += [resource["returns"] for resource in information["resources"] if "returns" in resource]
+            for schema in embedded:
+                validator_for(schema).check_schema(schema)
+            templates[template_id] = CapabilityTemplate(template_id, definition)
+        return templates
+
+    def get(self, template_id):
+        """The template with this id, or None."""
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = self._load()
+        return self._templates.get(template_id)
+
+    def preload(self):
+        self.get(DEFAULT_TEMPLATE)
+        return self
+
+
+# Templates used by AgentDiscoveryTool.handle_advertisement().
+CAPABILITY_TEMPLATES = CapabilityTemplates()
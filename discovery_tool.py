@@ -9,43 +9,132 @@ Requirements:
 - jsonschema
 - (Optional: cryptography, requests, etc. for production)
 """
+import base64
+import hashlib
+import itertools
 import json
-from jsonschema import validate, ValidationError
+import os
+from collections import namedtuple
 from datetime import datetime
-from cryptography import x509
-from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.x509.oid import NameOID
-from cryptography.hazmat.primitives.asymmetric import padding
-import base64
+from capability_registry import CapabilityRegistry
+from capability_query import matches_filters, parse_filters
+from capability_templates import CAPABILITY_TEMPLATES, DEFAULT_TEMPLATE
+from request_profiler import stage
+
+# jsonschema and the cryptography x509 stack are imported on first use, and the
+# schema files and CA certificate are read on first use, so importing this module
+# (e.g. from agent_discovery_api.py) stays cheap.
+SCHEMA_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Load schemas from external JSON files for validation
 def load_schema(path):
-    import json
+    if not os.path.isabs(path):
+        path = os.path.join(SCHEMA_DIR, path)
     with open(path) as f:
         return json.load(f)
 
 # Updated: The agent identifier for requestingAgent must now use the following fields in this order:
 # protocol, agentName, agentCategory, providerName, version, [extension (optional)]
 # The schema enforces this structure for all validations below.
-AGENT_CAPABILITY_REQUEST_SCHEMA = load_schema("agent_capability_request.schema.json")
-AGENT_CAPABILITY_RESPONSE_SCHEMA = load_schema("agent_capability_response.schema.json")
+AGENT_CAPABILITY_REQUEST_SCHEMA_FILE = "agent_capability_request.schema.json"
+AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE = "agent_capability_response.schema.json"
+_LAZY_SCHEMAS = {
+    "AGENT_CAPABILITY_REQUEST_SCHEMA": AGENT_CAPABILITY_REQUEST_SCHEMA_FILE,
+    "AGENT_CAPABILITY_RESPONSE_SCHEMA": AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE,
+}
+
+def __getattr__(name):
+    # AGENT_CAPABILITY_REQUEST_SCHEMA / AGENT_CAPABILITY_RESPONSE_SCHEMA are loaded on first access
+    if name in _LAZY_SCHEMAS:
+        schema = load_schema(_LAZY_SCHEMAS[name])
+        globals()[name] = schema
+        return schema
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Upper bound on queryParameters.pageSize.
+MAX_PAGE_SIZE = 1000
+
+DiscoveryPlan = namedtuple("DiscoveryPlan", "query predicates semantic max_results min_score page_size after fingerprint selection")
+
+def selects_at_random(plan):
+    """
+    True when the answer is a load-aware pick among the exact matches (an opt-in
+    "p2c" or "weighted" selection, unpaged), so the same request can get a different
+    respondingAgent, or NDJSON order, each time.
+    """
+    return not plan.semantic and plan.page_size is None and plan.selection != "first"
+
+def query_fingerprint(request_json):
+    """Digest of the capability and query options that a pagination cursor is bound to."""
+    query = {k: v for k, v in request_json.get("queryParameters", {}).items() if k not in ("cursor", "pageSize")}
+    text = json.dumps([request_json["requestingAgent"]["agentCapability"], query], sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+def encode_cursor(position, fingerprint):
+    """Opaque cursor: the position to resume after, bound to the query it came from."""
+    raw = json.dumps([position, fingerprint], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, fingerprint):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position, cursor_fingerprint = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("malformed cursor")
+    if cursor_fingerprint != fingerprint:
+        raise ValueError("cursor does not belong to this query")
+    return position
 
 class AgentDiscoveryTool:
-    def __init__(self, request_schema, response_schema, ca_cert_path=None):
+    def __init__(self, request_schema, response_schema, ca_cert_path=None, templates=CAPABILITY_TEMPLATES):
+        """
+        request_schema / response_schema: schema dicts, or schema file names that are
+        loaded on first use. The CA certificate is also read on first use, as are the
+        capability templates (see capability_templates.py).
+        """
         self.request_schema = request_schema
         self.response_schema = response_schema
-        self.ca_cert = None
-        if ca_cert_path:
-            with open(ca_cert_path, 'rb') as f:
-                self.ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+        self.ca_cert_path = ca_cert_path
+        self.templates = templates
+        self._ca_cert = None
+        self._validators = {}
+
+    @property
+    def ca_cert(self):
+        if self._ca_cert is None and self.ca_cert_path:
+            from cryptography import x509
+            from cryptography.hazmat.backends import default_backend
+            with open(self.ca_cert_path, 'rb') as f:
+                self._ca_cert = x509.load_pem_x509_certificate(f.read(), default_backend())
+        return self._ca_cert
+
+    def _validator(self, kind):
+        validator = self._validators.get(kind)
+        if validator is None:
+            from jsonschema.validators import validator_for
+            schema = self.request_schema if kind == "request" else self.response_schema
+            if isinstance(schema, str):
+                schema = load_schema(schema)
+            cls = validator_for(schema)
+            cls.check_schema(schema)
+            validator = self._validators[kind] = cls(schema)
+        return validator
+
+    def preload(self):
+        """Load schemas, validators, capability templates and the CA certificate now instead of on first use."""
+        self._validator("request")
+        self._validator("response")
+        self.templates.preload()
+        return self.ca_cert
 
     def validate_certificate(self, cert_pem):
         """
         Parse PEM, check signature against CA, check validity period.
         Returns (True, None) if valid, else (False, reason)
         """
+        from cryptography import x509
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric import padding
         try:
             cert = x509.load_pem_x509_certificate(cert_pem.encode(), default_backend())
             # Check validity period
@@ -68,70 +157,286 @@ class AgentDiscoveryTool:
         except Exception as e:
             return False, f"Certificate parse/validation error: {e}"
 
+    def _validate(self, kind, instance):
+        from jsonschema.exceptions import best_match
+        error = best_match(self._validator(kind).iter_errors(instance))
+        if error is not None:
+            return False, str(error)
+        return True, None
+
     def validate_request(self, request_json):
-        try:
-            validate(instance=request_json, schema=self.request_schema)
-            return True, None
-        except ValidationError as e:
-            return False, str(e)
+        return self._validate("request", request_json)
 
     def validate_response(self, response_json):
-        try:
-            validate(instance=response_json, schema=self.response_schema)
-            return True, None
-        except ValidationError as e:
-            return False, str(e)
+        return self._validate("response", response_json)
+
+    @staticmethod
+    def _matches_query(agent, query):
+        additional = agent.get("additionalCapabilities", {})
+        return (
+            (not query.get("languagePair") or additional.get("languagePair") == query.get("languagePair")) and
+            (not query.get("domainExpertise") or additional.get("domainExpertise") == query.get("domainExpertise")) and
+            (not query.get("providerName") or agent.get("providerName") == query.get("providerName")) and
+            (not query.get("agentCategory") or agent.get("agentCategory") == query.get("agentCategory"))
+        )
 
-    def handle_discovery(self, request_json, available_agents):
+    def handle_discovery(self, request_json, available_agents, plan=None):
         """
         Process a discovery request and return a compliant response.
-        available_agents: list of dicts describing agent capability profiles.
+        available_agents: list of dicts describing agent capability profiles, or a
+        CapabilityRegistry (only the requested capability's bucket is scanned).
+        plan: the result of plan_discovery() if the caller already validated the
+        request with it.
+
+        With queryParameters.matchMode == "semantic" agents are ranked by embedding
+        similarity instead of requiring an exact agentCapability match (see
+        capability_embeddings.py). The text matched is queryParameters.capabilityQuery
+        if given, else the requesting agent's agentCapability; maxResults (default 10)
+        and minScore (default 0.2) bound the ranked "matches" list in the response.
+
+        queryParameters.filters adds range/IN/prefix conditions on
+        additionalCapabilities (see capability_query.py); with a CapabilityRegistry
+        they are answered from its attribute index.
+
+        queryParameters.pageSize switches to paginated results: the response lists
+        up to pageSize "matches" and a "nextCursor" to pass back as
+        queryParameters.cursor for the following page (null on the last page).
+        Exact matches are paged in agentDID order. Matches are produced lazily, so
+        certificates are only verified for the agents on the requested page.
+
+        For a single exact match from a CapabilityRegistry, queryParameters.selection
+        picks among the matching agents using the live health statistics that
+        POST /feedback maintains (see agent_health.py): "p2c" or "weighted". The
+        default, "first", keeps the first match in registry order, so plain
+        discovery stays deterministic and cacheable.
         """
+        if plan is None:
+            with stage("discovery.plan"):
+                failure, plan = self.plan_discovery(request_json)
+            if failure is not None:
+                return failure
+        with stage("discovery.match"):
+            response = self._collect_matches(request_json, available_agents, plan)
+        if response["status"] != "success":
+            return response
+        with stage("discovery.validate_response"):
+            valid, error = self.validate_response(response)
+        if not valid:
+            return {
+                "status": "failure",
+                "errorMessage": f"Response validation error: {error}",
+                "respondingAgent": None
+            }
+        return response
+
+    def _collect_matches(self, request_json, available_agents, plan):
+        # Matches are produced lazily, so this is where the registry is scanned and
+        # certificates are verified
+        matches = self._iter_matches(request_json, available_agents, plan)
+        if plan.page_size is not None:
+            page = list(itertools.islice(matches, plan.page_size))
+            response = {
+                "status": "success",
+                "errorMessage": None,
+                "respondingAgent": page[0][1]["agent"] if page else None,
+                "matches": [match for _, match in page],
+                "nextCursor": encode_cursor(page[-1][0], plan.fingerprint) if len(page) == plan.page_size else None
+            }
+        elif plan.semantic:
+            page = [match for _, match in itertools.islice(matches, plan.max_results)]
+            if not page:
+                return self._no_match()
+            response = {
+                "status": "success",
+                "errorMessage": None,
+                "respondingAgent": page[0]["agent"],
+                "matches": page
+            }
+        else:
+            first = next(matches, None)
+            if first is None:
+                return self._no_match()
+            response = {
+                "status": "success",
+                "errorMessage": None,
+                "respondingAgent": first[1]["agent"]
+            }
+        return response
+
+    def stream_discovery(self, request_json, available_agents, plan=None):
+        """
+        Streaming variant of handle_discovery for NDJSON responses.
+        Returns (failure_response, None) if the request is rejected up front, else
+        (None, records): a generator of {"agent": ...} (plus "score" in semantic
+        mode) records, each produced and validated only when the consumer asks for
+        it, followed by one {"status": "success", "count": n, "nextCursor": ...}
+        trailer. Without pageSize every exact match is streamed.
+        """
+        if plan is None:
+            failure, plan = self.plan_discovery(request_json)
+            if failure is not None:
+                return failure, None
+        return None, self._stream_records(request_json, available_agents, plan)
+
+    def _stream_records(self, request_json, available_agents, plan):
+        limit = plan.page_size if plan.page_size is not None else (plan.max_results if plan.semantic else None)
+        taken = count = 0
+        last = None
+        for last, match in itertools.islice(self._iter_matches(request_json, available_agents, plan), limit):
+            taken += 1
+            valid, error = self.validate_response({"status": "success", "errorMessage": None, "respondingAgent": match["agent"]})
+            if not valid:
+                continue
+            count += 1
+            yield match
+        next_cursor = None
+        if plan.page_size is not None and taken == plan.page_size:
+            next_cursor = encode_cursor(last, plan.fingerprint)
+        yield {"status": "success", "errorMessage": None, "count": count, "nextCursor": next_cursor}
+
+    @staticmethod
+    def _no_match():
+        return {
+            "status": "failure",
+            "errorMessage": "No matching agent found or certificate invalid.",
+            "respondingAgent": None
+        }
+
+    def plan_discovery(self, request_json):
+        """Validate the request and parse its query options. Returns (failure_response, None) or (None, plan)."""
         valid, error = self.validate_request(request_json)
         if not valid:
             return {
                 "status": "failure",
                 "errorMessage": f"Request validation error: {error}",
                 "respondingAgent": None
-            }
+            }, None
         query = request_json.get("queryParameters", {})
-        matches = []
-        for agent in available_agents:
-            if (
-                agent["agentCapability"] == request_json["requestingAgent"]["agentCapability"] and
-                (not query.get("languagePair") or agent.get("additionalCapabilities", {}).get("languagePair") == query.get("languagePair")) and
-                (not query.get("domainExpertise") or agent.get("additionalCapabilities", {}).get("domainExpertise") == query.get("domainExpertise"))
-            ):
-                # Validate agent certificate
-                cert_pem = agent["certificate"]["certificatePEM"]
-                valid_cert, cert_error = self.validate_certificate(cert_pem)
-                if not valid_cert:
-                    continue  # Skip agents with invalid certs
-                matches.append(agent)
-        if not matches:
+        try:
+            predicates = parse_filters(query["filters"]) if "filters" in query else []
+        except ValueError as e:
             return {
                 "status": "failure",
-                "errorMessage": "No matching agent found or certificate invalid.",
+                "errorMessage": f"Invalid query filters: {e}",
                 "respondingAgent": None
-            }
-        response = {
-            "status": "success",
-            "errorMessage": None,
-            "respondingAgent": matches[0]
-        }
-        valid, error = self.validate_response(response)
-        if not valid:
+            }, None
+        min_score = query.get("minScore", 0.2)
+        if isinstance(min_score, bool) or not isinstance(min_score, (int, float)):
             return {
                 "status": "failure",
-                "errorMessage": f"Response validation error: {error}",
+                "errorMessage": "Request validation error: minScore must be a number",
                 "respondingAgent": None
-            }
-        return response
+            }, None
+        page_size = query.get("pageSize")
+        max_results = query.get("maxResults", 10)
+        fingerprint = query_fingerprint(request_json)
+        try:
+            if page_size is not None and (isinstance(page_size, bool) or not isinstance(page_size, int) or not 1 <= page_size <= MAX_PAGE_SIZE):
+                raise ValueError(f"pageSize must be an integer between 1 and {MAX_PAGE_SIZE}")
+            if isinstance(max_results, bool) or not isinstance(max_results, int) or max_results < 0:
+                raise ValueError("maxResults must be a non-negative integer")
+            after = decode_cursor(query["cursor"], fingerprint) if query.get("cursor") else None
+        except ValueError as e:
+            return {
+                "status": "failure",
+                "errorMessage": f"Invalid pagination: {e}",
+                "respondingAgent": None
+            }, None
+        return None, DiscoveryPlan(
+            query=query,
+            predicates=predicates,
+            semantic=query.get("matchMode") == "semantic",
+            max_results=max_results,
+            min_score=min_score,
+            page_size=page_size,
+            after=after,
+            fingerprint=fingerprint,
+            selection=query.get("selection", "first"),
+        )
+
+    def _iter_matches(self, request_json, available_agents, plan):
+        """
+        Lazily yield (position, match) for certificate-valid matches, where position
+        is what a cursor resumes after (the agentDID for exact matches when paging,
+        the rank for semantic matches).
+        """
+        if plan.semantic:
+            yield from self._iter_semantic_matches(request_json, available_agents, plan)
+            return
+        query, predicates = plan.query, plan.predicates
+        capability = request_json["requestingAgent"]["agentCapability"]
+        paged = plan.page_size is not None
+        registry = available_agents
+        if isinstance(available_agents, CapabilityRegistry):
+            if not registry.has_capability(capability):
+                # Unknown capabilities (typos, retired ones) end here, before any index query
+                return
+            if predicates:
+                # Answer the filters from the attribute index instead of scanning the bucket
+                # Sorted, so the page order and the agent selected below do not
+                # depend on set iteration order
+                dids = sorted(did for did in registry.attribute_index().query(predicates)
+                              if plan.after is None or did > plan.after)
+                available_agents = (registry[did] for did in dids if did in registry)
+                predicates = []
+            elif paged:
+                available_agents = registry.iter_agents(capability, after=plan.after)
+            else:
+                available_agents = registry.agents_for(capability)
+        elif paged:
+            available_agents = sorted(
+                (agent for agent in available_agents if plan.after is None or agent.get("agentDID", "") > plan.after),
+                key=lambda agent: agent.get("agentDID", ""))
+        candidates = (agent for agent in available_agents
+                      if agent["agentCapability"] == capability and self._matches_query(agent, query) and matches_filters(agent, predicates))
+        if isinstance(registry, CapabilityRegistry) and not paged and plan.selection != "first":
+            # Load-aware choice among all matches; certificates are still only checked
+            # for the chosen agent (and fallbacks if it fails)
+            candidates = registry.health_table().selection_order(list(candidates), plan.selection)
+        for agent in candidates:
+            # Validate agent certificate
+            cert_pem = agent["certificate"]["certificatePEM"]
+            valid_cert, cert_error = self.validate_certificate(cert_pem)
+            if not valid_cert:
+                continue  # Skip agents with invalid certs
+            yield agent.get("agentDID", ""), {"agent": agent}
+
+    def _iter_semantic_matches(self, request_json, available_agents, plan):
+        from capability_embeddings import SemanticIndex
+        query = plan.query
+        text = query.get("capabilityQuery") or request_json["requestingAgent"]["agentCapability"]
+        wanted = plan.page_size if plan.page_size is not None else plan.max_results
+        start = plan.after + 1 if isinstance(plan.after, int) else 0
+        if isinstance(available_agents, CapabilityRegistry):
+            index = available_agents.semantic_index()
+        else:
+            index = SemanticIndex()
+            for position, agent in enumerate(available_agents):
+                index.add(agent.get("agentDID", position), agent)
+        # Over-fetch so that agents dropped by the filters or certificate checks below
+        # do not shrink the result below the requested count; if they drop even more,
+        # search again with twice the limit until the caller stops or the index runs
+        # out. The ranking is deterministic, so a larger limit extends the same list.
+        limit, first = max(start + wanted * 4, 1), start
+        while True:
+            ranked = index.search(text, limit=limit, min_score=plan.min_score)
+            for rank in range(first, len(ranked)):
+                score, agent = ranked[rank]
+                if not self._matches_query(agent, query) or not matches_filters(agent, plan.predicates):
+                    continue
+                valid_cert, cert_error = self.validate_certificate(agent["certificate"]["certificatePEM"])
+                if not valid_cert:
+                    continue
+                yield rank, {"score": round(score, 4), "agent": agent}
+            if len(ranked) < limit:
+                return
+            first, limit = len(ranked), limit * 2
 
     def handle_advertisement(self, request_json, agent_registry):
         """
         Process an advertisement request and register the agent if valid.
-        agent_registry: dict to store agent profiles by DID.
+        agent_registry: dict to store agent profiles by DID (a CapabilityRegistry
+        additionally bumps the version of the advertised capability).
         """
         valid, error = self.validate_request(request_json)
         if not valid:
@@ -150,68 +455,43 @@ class AgentDiscoveryTool:
                 "errorMessage": f"Certificate validation failed: {cert_error}",
                 "respondingAgent": None
             }
-        # Add required mcpServerInformation and additionalCapabilities for compliance
+        # The MCP schema and default additionalCapabilities come from the agent's
+        # capability template, validated and frozen once and shared by every profile
+        # built from it; only the advertisement's own additionalCapabilities are checked
+        template_id = agent_profile.get("capabilityTemplate", DEFAULT_TEMPLATE)
+        template = self.templates.get(template_id)
+        if template is None:
+            return {
+                "status": "failure",
+                "errorMessage": f"Request validation error: unknown capabilityTemplate '{template_id}'",
+                "respondingAgent": None
+            }
+        try:
+            additional = template.additional_capabilities_with(agent_profile.get("additionalCapabilities"))
+        except ValueError as e:
+            return {
+                "status": "failure",
+                "errorMessage": f"Request validation error: {e}",
+                "respondingAgent": None
+            }
         agent_profile = agent_profile.copy()
-        agent_profile["mcpServerInformation"] = {
-            "tools": [
-                {
-                    "name": "translate_text",
-                    "description": "Translates text from one language to another",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "text": { "type": "string" },
-                            "sourceLanguage": { "type": "string" },
-                            "targetLanguage": { "type": "string" }
-                        },
-                        "required": ["text", "sourceLanguage", "targetLanguage"]
-                    },
-                    "results": {
-                        "type": "object",
-                        "properties": {
-                            "translatedText": { "type": "string" }
-                        },
-                        "required": ["translatedText"]
-                    }
-                }
-            ],
-            "resources": [
-                {
-                    "name": "supported_languages",
-                    "description": "Returns a list of supported languages",
-                    "returns": {
-                        "type": "array",
-                        "items": { "type": "string" }
-                    }
-                }
-            ]
-        }
-        agent_profile["additionalCapabilities"] = {
-            "languagePair": "en-fr",
-            "domainExpertise": "Legal",
-            "latency": 150,
-            "bleuScore": 38.5
-        }
+        agent_profile["capabilityTemplate"] = template.id
+        agent_profile["mcpServerInformation"] = template.mcp_server_information
+        agent_profile["additionalCapabilities"] = additional
         agent_registry[agent_profile["agentDID"]] = agent_profile
-        response = {
+        # Nothing needs validating against the response schema: the request was
+        # validated above and the template when it was loaded
+        return {
             "status": "success",
             "errorMessage": None,
             "respondingAgent": agent_profile
         }
-        valid, error = self.validate_response(response)
-        if not valid:
-            return {
-                "status": "failure",
-                "errorMessage": f"Response validation error: {error}",
-                "respondingAgent": None
-            }
-        return response
 
 # Example usage
 if __name__ == "__main__":
     # TODO: Paste full schemas for AGENT_CAPABILITY_REQUEST_SCHEMA and AGENT_CAPABILITY_RESPONSE_SCHEMA
     # For demo, use {} or minimal schemas
-    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA, AGENT_CAPABILITY_RESPONSE_SCHEMA, ca_cert_path="ca.pem")
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path="ca.pem")
     agent_registry = {}
     available_agents = []  # List of agent profiles
 
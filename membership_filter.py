@@ -0,0 +1,51 @@
+"""
+membership_filter.py
+Bloom filter for answering "definitely not present" without touching storage.
+
+A key that was added is always reported present. A key that was never added is
+reported absent except for a false positive rate of about error_rate while no
+more than `capacity` keys have been added. The bits live in one bytearray, about
+1.2 bytes per key at a 1% error rate.
+"""
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("capacity must be positive and error_rate in (0, 1)")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """Add key. Returns False if it (probably) was already present, so len() counts distinct keys."""
+        positions = self._positions(key)
+        with self._lock:
+            bits = self._bits
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return False
+            for p in positions:
+                bits[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+            return True
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def __len__(self):
+        return self._count
@@ -0,0 +1,129 @@
+"""
+rate_limiter.py
+Admission control for the write endpoints (/register, /renew, /deactivate).
+
+- TokenBucketLimiter: per-key token buckets stored in two fixed-size arrays
+  (4-byte token count + 4-byte millisecond timestamp per slot). Keys are hashed to
+  slots, so memory stays constant no matter how many agents are tracked: the
+  default 2**20 slots cost 8 MiB. Two keys sharing a slot share a bucket, which can
+  only make the limit stricter for them, never looser.
+- ConcurrencyLimiter: a global cap on in-flight write requests per process.
+
+Both are checked before any schema validation or certificate work, and rejected
+requests get an immediate 429 with a Retry-After header.
+"""
+import functools
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from array import array
+
+from request_profiler import stage
+
+WRITE_RATE = float(os.environ.get("AGENT_WRITE_RATE", "1.0"))       # tokens per second per key
+WRITE_BURST = float(os.environ.get("AGENT_WRITE_BURST", "5"))        # bucket capacity
+RATE_LIMIT_SLOTS = int(os.environ.get("AGENT_RATE_LIMIT_SLOTS", str(2 ** 20)))
+MAX_CONCURRENT_WRITES = int(os.environ.get("AGENT_MAX_CONCURRENT_WRITES", "32"))
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate, burst, slots=RATE_LIMIT_SLOTS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self.clock = clock
+        self._start = clock()
+        self._lock = threading.Lock()
+        # A zero timestamp marks an untouched slot, which starts with a full bucket.
+        self._tokens = array("f", bytes(4 * slots))
+        self._stamps = array("I", bytes(4 * slots))
+
+    def _now_ms(self):
+        # Milliseconds since start, offset by one so that 0 stays "never used".
+        # Wraps after ~49 days; elapsed times are computed modulo 2**32.
+        return (int((self.clock() - self._start) * 1000) + 1) & 0xFFFFFFFF
+
+    def _refill(self, slot, now_ms):
+        stamp = self._stamps[slot]
+        if stamp == 0:
+            return self.burst
+        elapsed = ((now_ms - stamp) & 0xFFFFFFFF) / 1000.0
+        return min(self.burst, self._tokens[slot] + elapsed * self.rate)
+
+    @stage("rate_limit")
+    def check(self, keys, cost=1.0):
+        """
+        Take `cost` tokens from the bucket of every key. Returns 0 if the request is
+        admitted, otherwise the number of seconds until it would be (nothing is taken).
+        """
+        slots = [hash(key) % self.slots for key in keys]
+        with self._lock:
+            now_ms = self._now_ms()
+            levels = [self._refill(slot, now_ms) for slot in slots]
+            short = max((cost - level for level in levels), default=0.0)
+            if short > 0:
+                return short / self.rate if self.rate > 0 else math.inf
+            for slot, level in zip(slots, levels):
+                self._tokens[slot] = level - cost
+                self._stamps[slot] = now_ms
+            return 0
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def try_acquire(self):
+        return self._semaphore.acquire(blocking=False)
+
+    def release(self):
+        self._semaphore.release()
+
+
+WRITE_LIMITER = TokenBucketLimiter(WRITE_RATE, WRITE_BURST)
+WRITE_CONCURRENCY = ConcurrencyLimiter(MAX_CONCURRENT_WRITES)
+
+
+def rate_limit_keys(request_json):
+    """
+    Rate-limit keys for a write request: the agent identity and, when present, the
+    fingerprint of the certificate PEM it carries (a hash of the raw PEM text, so no
+    certificate parsing is needed). Works on unvalidated input.
+    """
+    if not isinstance(request_json, dict):
+        return ["malformed"]
+    agent = request_json.get("requestingAgent", request_json)
+    if not isinstance(agent, dict):
+        return ["malformed"]
+    identity = ".".join(str(agent.get(field, "")) for field in ("protocol", "agentName", "agentCategory", "providerName", "version"))
+    keys = ["id:" + identity]
+    certificate = agent.get("certificate")
+    if isinstance(certificate, dict) and isinstance(certificate.get("certificatePEM"), str):
+        fingerprint = hashlib.sha256(certificate["certificatePEM"].encode("utf-8")).hexdigest()
+        keys.append("cert:" + fingerprint)
+    return keys
+
+
+def send_too_many_requests(handler, retry_after, message="Too many requests"):
+    handler.send_response(429)
+    handler.send_header('Content-Type', 'application/json')
+    handler.send_header('Retry-After', str(max(1, math.ceil(retry_after))))
+    handler.end_headers()
+    handler.wfile.write(json.dumps({"status": "failure", "errorMessage": message}).encode('utf-8'))
+
+
+def admission_controlled(do_method):
+    """Decorator for do_POST: reject with 429 when MAX_CONCURRENT_WRITES are in flight."""
+    @functools.wraps(do_method)
+    def wrapper(handler):
+        if not WRITE_CONCURRENCY.try_acquire():
+            send_too_many_requests(handler, 1, "Server busy: too many concurrent write requests")
+            return
+        try:
+            return do_method(handler)
+        finally:
+            WRITE_CONCURRENCY.release()
+    return wrapper
@@ -0,0 +1,370 @@
+"""
+registration_journal.py
+Write-behind registration queue with durable group commit.
+
+Without a journal, every registration commits its own SQLite transaction before
+the response goes out. With AGENT_JOURNAL_DIR set, store_registration() instead
+appends the registration to an append-only journal and returns once the entry
+is durable:
+
+- A flusher thread collects the registrations submitted during one group
+  interval (AGENT_JOURNAL_GROUP_MS, default 2 ms). It writes them with one
+  write() and one fsync(), then releases every waiting request at once. A
+  registration therefore waits for at most one interval plus one fsync, and the
+  fsync is shared by the whole group.
+- A drainer thread inserts the durable entries into SQLite in batches, one
+  transaction per shard (agent_registration_db.apply_journal_entries). Each
+  transaction also records how far the shard has applied the journal.
+- On startup the journal is replayed. Entries that a shard already holds
+  according to its checkpoint are skipped, so a crash between the journal and
+  SQLite loses nothing and duplicates nothing. A torn last line was never
+  acknowledged and is dropped.
+- Once everything written has been applied and the file is past
+  AGENT_JOURNAL_MAX_BYTES, the file is truncated and starts a new generation,
+  named by the header line.
+
+Status lookups see a journaled registration once it is drained, normally within
+a group interval or two. A deactivation first applies every journal in
+AGENT_JOURNAL_DIR (drain_journals), so a registration acknowledged before it
+cannot be drained afterwards and re-activate the agent.
+
+Each server process needs a journal of its own. A journal holds an exclusive
+flock on its file for as long as it is open, and journal_for() takes the first
+file it can lock: <AGENT_JOURNAL_DIR>/<name>.journal, then <name>-1.journal and
+so on for further worker processes. A restarted worker picks up (and replays)
+the file its predecessor left behind.
+"""
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import agent_registration_db
+
+JOURNAL_DIR = os.environ.get("AGENT_JOURNAL_DIR")
+JOURNAL_GROUP_MS = float(os.environ.get("AGENT_JOURNAL_GROUP_MS", "2"))
+JOURNAL_MAX_BYTES = int(os.environ.get("AGENT_JOURNAL_MAX_BYTES", str(64 * 1024 * 1024)))
+# Longest a request waits for its group to become durable.
+JOURNAL_SUBMIT_TIMEOUT = float(os.environ.get("AGENT_JOURNAL_SUBMIT_TIMEOUT", "10"))
+# Seconds before retrying when SQLite rejects a batch (e.g. locked); entries stay queued.
+# The wait doubles with every failed attempt, up to DRAIN_RETRY_MAX_INTERVAL.
+DRAIN_RETRY_INTERVAL = 0.5
+DRAIN_RETRY_MAX_INTERVAL = 30
+# Failed attempts at one batch before the drainer gives up. The journal then refuses
+# new registrations; its entries stay in the file and are replayed on the next start.
+JOURNAL_DRAIN_ATTEMPTS = int(os.environ.get("AGENT_JOURNAL_DRAIN_ATTEMPTS", "8"))
+
+
+class JournalError(Exception):
+    pass
+
+
+class JournalLocked(JournalError):
+    """The journal file is open in another process."""
+
+
+def _header_generation(line):
+    try:
+        record = json.loads(line) if line.endswith(b"\n") else None
+    except ValueError:
+        return None
+    return record.get("journal") if isinstance(record, dict) else None
+
+
+def read_journal(path, generation=None, offset=0):
+    """
+    Return (generation, entries, valid_length) for the journal at path: entries
+    are (end_offset, agent) for every complete line after the header. A missing
+    or empty file has generation None. If the header still names generation,
+    parsing resumes at offset, the valid_length of an earlier read, and only the
+    entries written since are returned.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.readline()
+            current = _header_generation(header)
+            if current is None:
+                return None, [], 0
+            start = offset if current == generation and offset > len(header) else len(header)
+            f.seek(start)
+            data = f.read()
+    except FileNotFoundError:
+        return None, [], 0
+    entries, end = [], start
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b"\n"):
+            break
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        end += len(line)
+        entries.append((end, record))
+    return current, entries, end
+
+
+def journal_generation(path):
+    """The generation named by the header line of the journal at path, or None."""
+    try:
+        with open(path, "rb") as f:
+            return _header_generation(f.readline())
+    except FileNotFoundError:
+        return None
+
+
+class RegistrationJournal:
+    def __init__(self, path, name, group_interval=JOURNAL_GROUP_MS / 1000, max_bytes=JOURNAL_MAX_BYTES,
+                 apply=agent_registration_db.apply_journal_entries):
+        self.path = path
+        self.name = name
+        self.group_interval = group_interval
+        self.max_bytes = max_bytes
+        self.apply = apply
+        self._cond = threading.Condition()
+        self._pending = []
+        self._submitted = 0
+        self._durable = 0
+        self._error = None
+        self._closing = False
+        self._applied_offset = 0
+        self._drain_queue = queue.Queue()
+        created = not os.path.exists(path)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._fd)
+            raise JournalLocked(f"{path} is in use by another process")
+        try:
+            if created:
+                directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+            self._replay()
+        except BaseException:
+            # Closing the file releases the flock, so a later attempt can replay it
+            os.close(self._fd)
+            raise
+        self._flusher = threading.Thread(target=self._flush_loop, name=f"journal-flush-{name}", daemon=True)
+        self._drainer = threading.Thread(target=self._drain_loop, name=f"journal-drain-{name}", daemon=True)
+        self._flusher.start()
+        self._drainer.start()
+
+    def _replay(self):
+        generation, entries, _ = read_journal(self.path)
+        if entries:
+            applied = self.apply(self.name, generation, entries)
+            print(f"[registration_journal] {self.name}: replayed {len(entries)} entries, {len(applied)} were not yet in the database")
+        self._start_generation()
+
+    def _start_generation(self):
+        """Truncate the file to a fresh header. Only safe when every entry has been applied."""
+        generation = uuid.uuid4().hex
+        header = (json.dumps({"journal": generation}) + "\n").encode("utf-8")
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, header, 0)
+        os.fsync(self._fd)
+        with self._cond:
+            self.generation = generation
+            self._end_offset = self._applied_offset = len(header)
+
+    def submit(self, agent, timeout=JOURNAL_SUBMIT_TIMEOUT):
+        """Journal one registration and wait until it is durable. Raises JournalError."""
+        line = (json.dumps(agent, separators=(",", ":")) + "\n").encode("utf-8")
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._error is not None or self._closing:
+                raise JournalError(f"Registration journal unavailable: {self._error or 'closed'}")
+            self._pending.append((line, agent))
+            self._submitted += 1
+            ticket = self._submitted
+            self._cond.notify_all()
+            while self._durable < ticket:
+                if self._error is not None:
+                    raise JournalError(f"Registration journal write failed: {self._error}")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise JournalError("Timed out waiting for the registration journal")
+                self._cond.wait(remaining)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            # Let the rest of the group arrive; closing flushes at once
+            if not self._closing:
+                time.sleep(self.group_interval)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                drained = self._applied_offset == self._end_offset
+            try:
+                if drained and self._end_offset > self.max_bytes:
+                    self._start_generation()
+                data = b"".join(line for line, _ in batch)
+                os.pwrite(self._fd, data, self._end_offset)
+                os.fsync(self._fd)
+            except OSError as e:
+                print(f"[registration_journal] {self.name}: write failed: {e}")
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            entries = []
+            offset = self._end_offset
+            for line, agent in batch:
+                offset += len(line)
+                entries.append((offset, agent))
+            with self._cond:
+                self._end_offset = offset
+                self._durable += len(batch)
+                self._cond.notify_all()
+            self._drain_queue.put((self.generation, entries))
+
+    def _drain_loop(self):
+        item = self._drain_queue.get()
+        while item is not None:
+            generation, entries = item
+            item = None
+            # Coalesce whatever else is already durable into the same transactions
+            while item is None:
+                try:
+                    more = self._drain_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is not None and more[0] == generation:
+                    entries.extend(more[1])
+                else:
+                    item = more or ()
+            delay = DRAIN_RETRY_INTERVAL
+            for attempt in range(1, JOURNAL_DRAIN_ATTEMPTS + 1):
+                try:
+                    self.apply(self.name, generation, entries)
+                    break
+                except Exception as e:
+                    if attempt == JOURNAL_DRAIN_ATTEMPTS:
+                        print(f"[registration_journal] {self.name}: drain failed {attempt} times, giving up: {e}")
+                        with self._cond:
+                            self._error = e
+                            self._cond.notify_all()
+                        return
+                    print(f"[registration_journal] {self.name}: drain failed, retrying in {delay:g}s: {e}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, DRAIN_RETRY_MAX_INTERVAL)
+            with self._cond:
+                if generation == self.generation:
+                    self._applied_offset = entries[-1][0]
+                self._cond.notify_all()
+            if item == ():
+                return
+            if item is None:
+                item = self._drain_queue.get()
+
+    def wait_drained(self, timeout=None):
+        """
+        Block until everything durable has been applied to SQLite. Returns True if
+        so, False on timeout or once the journal has failed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._durable < self._submitted or self._applied_offset < self._end_offset:
+                if self._error is not None:
+                    return False
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self):
+        """Flush and drain everything submitted, then stop both threads."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._drain_queue.put(None)
+        self._drainer.join()
+        os.close(self._fd)
+
+
+_journals = {}
+_journals_lock = threading.Lock()
+
+
+def journal_for(name):
+    """
+    The journal of this process for name, opened (and replayed) on first use; None
+    without AGENT_JOURNAL_DIR. Takes the first of name, name-1, ... whose file no
+    other process holds.
+    """
+    if not JOURNAL_DIR:
+        return None
+    journal = _journals.get(name)
+    if journal is None:
+        with _journals_lock:
+            journal = _journals.get(name)
+            if journal is None:
+                os.makedirs(JOURNAL_DIR, exist_ok=True)
+                slot = 0
+                while journal is None:
+                    slot_name = name if slot == 0 else f"{name}-{slot}"
+                    try:
+                        journal = RegistrationJournal(os.path.join(JOURNAL_DIR, f"{slot_name}.journal"), slot_name)
+                    except JournalLocked:
+                        slot += 1
+                _journals[name] = journal
+    return journal
+
+
+_drained = {}
+_drained_lock = threading.Lock()
+
+
+def drain_journals(directory=None):
+    """
+    Apply the durable entries of every journal in directory (default
+    AGENT_JOURNAL_DIR) to SQLite, including journals other processes are still
+    writing. Entries a shard already holds are skipped by its checkpoint, so this
+    is safe to run while their own drainers are active. Each journal is read
+    from where the previous call left off in the same generation, so only bytes
+    appended since are parsed. Returns the number of registrations inserted.
+    """
+    directory = directory or JOURNAL_DIR
+    if not directory:
+        return 0
+    inserted = 0
+    for path in sorted(glob.glob(os.path.join(directory, "*.journal"))):
+        with _drained_lock:
+            drained = _drained.get(path, (None, 0))
+        generation, entries, valid_length = read_journal(path, *drained)
+        if entries:
+            name = os.path.basename(path)[:-len(".journal")]
+            # The owner may have applied these entries and started a new generation
+            # since they were read; re-inserting them would duplicate them
+            inserted += len(agent_registration_db.apply_journal_entries(
+                name, generation, entries, is_current=lambda: journal_generation(path) == generation))
+        if generation is not None:
+            with _drained_lock:
+                _drained[path] = (generation, valid_length)
+    return inserted
+
+
+def store_registration(agent, journal_name="registration"):
+    """
+    insert_registration(), through the named journal when AGENT_JOURNAL_DIR is set:
+    returns once the registration is durable in the journal. Raises JournalError.
+    """
+    journal = journal_for(journal_name)
+    if journal is None:
+        agent_registration_db.insert_registration(agent)
+        return
+    agent_registration_db._check_writable()
+    journal.submit(agent)
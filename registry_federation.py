@@ -0,0 +1,286 @@
+"""
+registry_federation.py
+Hierarchical delegation between registry instances, in the manner of DNS zones.
+
+An agent identity is protocol.agentName.agentCategory.providerName.version, and
+its providerName and providerName/agentCategory prefixes act as zones. A registry
+started with a delegation table answers for its own zones and hands the delegated
+ones to other instances:
+
+    AGENT_DELEGATIONS='{"anthropic": "http://10.0.0.2:8083",
+                        "openai/translator": {"status": "http://10.0.0.3:8083",
+                                              "discovery": "http://10.0.0.3:8084"}}'
+
+(or AGENT_DELEGATIONS=@delegations.json). The most specific zone wins. A string
+target is used for every service. A dict names a base URL per service
+(registration, renewal, deactivation, status, discovery); services it leaves out
+are answered locally.
+
+- Lookups for a delegated zone are forwarded: GET /status and POST /status/batch
+  (by providerName/agentCategory), and POST /discover scoped with
+  queryParameters.providerName. Answers are cached for the upstream's
+  Cache-Control max-age, else FEDERATION_TTL seconds. "Not found" answers are
+  cached for NEGATIVE_TTL seconds. Expired answers are revalidated with
+  If-None-Match when the upstream gave an ETag.
+- Writes for a delegated zone get 307 Temporary Redirect to the delegated
+  instance, and clients re-send them there with their body.
+- Forwarded requests carry X-Agent-DNS-Hops. After MAX_HOPS forwards a request is
+  refused with 508 Loop Detected, so a delegation cycle cannot loop forever.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+FEDERATION_TTL = float(os.environ.get("AGENT_FEDERATION_TTL", "30"))
+NEGATIVE_TTL = float(os.environ.get("AGENT_FEDERATION_NEGATIVE_TTL", "5"))
+FORWARD_TIMEOUT = float(os.environ.get("AGENT_FEDERATION_TIMEOUT", "5"))
+MAX_HOPS = 8
+HOPS_HEADER = "X-Agent-DNS-Hops"
+ZONE_HEADER = "X-Agent-DNS-Zone"
+
+SERVICE_PATHS = {
+    "registration": "/register",
+    "renewal": "/renew",
+    "deactivation": "/deactivate",
+    "status": "/status",
+    "discovery": "/discover",
+}
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+_NO_STORE_RE = re.compile(r"(?:^|,)\s*no-store\s*(?:,|$)")
+
+
+class FederationError(Exception):
+    """The delegated registry could not be reached or gave an unusable answer."""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+def load_delegations(raw):
+    """Parse an AGENT_DELEGATIONS value: inline JSON, or @path to a JSON file."""
+    if raw.startswith("@"):
+        with open(raw[1:]) as f:
+            return json.load(f)
+    return json.loads(raw)
+
+
+def forwarded_hops(headers):
+    try:
+        return int(headers.get(HOPS_HEADER, 0))
+    except ValueError:
+        return MAX_HOPS
+
+
+class Federation:
+    def __init__(self, delegations, ttl=FEDERATION_TTL, negative_ttl=NEGATIVE_TTL, timeout=FORWARD_TIMEOUT,
+                 max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.clock = clock
+        self.zones = {}  # (providerName, agentCategory or None) -> {service: base URL}
+        for zone, target in delegations.items():
+            provider_name, _, agent_category = zone.partition("/")
+            if not provider_name or "/" in agent_category:
+                raise ValueError(f"invalid zone '{zone}': use providerName or providerName/agentCategory")
+            targets = dict.fromkeys(SERVICE_PATHS, target) if isinstance(target, str) else dict(target)
+            unknown = set(targets) - set(SERVICE_PATHS)
+            if unknown:
+                raise ValueError(f"unknown services for zone '{zone}': {sorted(unknown)}")
+            self.zones[(provider_name, agent_category or None)] = {s: url.rstrip("/") for s, url in targets.items()}
+        self._cache = OrderedDict()  # key -> [value, etag, expires]
+        self._lock = threading.Lock()
+        self._session = None
+
+    @classmethod
+    def from_env(cls):
+        raw = os.environ.get("AGENT_DELEGATIONS")
+        return cls(load_delegations(raw)) if raw else None
+
+    def zone_for(self, provider_name, agent_category=None):
+        """Return (zone name, {service: base URL}) of the most specific delegated zone, or (None, None)."""
+        if not provider_name:
+            return None, None
+        if agent_category and (provider_name, agent_category) in self.zones:
+            return f"{provider_name}/{agent_category}", self.zones[(provider_name, agent_category)]
+        if (provider_name, None) in self.zones:
+            return provider_name, self.zones[(provider_name, None)]
+        return None, None
+
+    def upstream(self, service, provider_name, agent_category=None):
+        """Return (zone, base URL) if this service is delegated for the identity, else (None, None)."""
+        zone, targets = self.zone_for(provider_name, agent_category)
+        if targets is None or service not in targets:
+            return None, None
+        return zone, targets[service]
+
+    # Cache
+
+    def _cached(self, key):
+        """Return (fresh, value, etag); value/etag of an expired entry are kept for revalidation."""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False, None, None
+            self._cache.move_to_end(key)
+            return self.clock() < entry[2], entry[0], entry[1]
+
+    def _store(self, key, value, etag, ttl):
+        with self._lock:
+            if ttl <= 0:
+                # Not cacheable; an older entry must not be served or revalidated either
+                self._cache.pop(key, None)
+                return
+            self._cache[key] = [value, etag, self.clock() + ttl]
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _ttl(self, response):
+        """Seconds to cache an upstream answer: 0 for no-store, else its max-age, else self.ttl."""
+        cache_control = response.headers.get("Cache-Control", "")
+        if _NO_STORE_RE.search(cache_control):
+            return 0
+        match = _MAX_AGE_RE.search(cache_control)
+        return float(match.group(1)) if match else self.ttl
+
+    # Forwarding
+
+    def _request(self, method, url, hops, etag=None, **kwargs):
+        """Send one forwarded request. A 508 from upstream is raised as a loop so that every hop reports it."""
+        if self._session is None:
+            import requests
+            with self._lock:
+                if self._session is None:
+                    self._session = requests.Session()
+        headers = {HOPS_HEADER: str(hops + 1)}
+        if etag:
+            headers["If-None-Match"] = etag
+        try:
+            response = self._session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+        except Exception as e:
+            raise FederationError(f"{url}: {e}")
+        if response.status_code == 508:
+            raise FederationError(f"delegation loop detected at {url}", status=508)
+        return response
+
+    def lookup_status(self, base_url, agent_name, provider_name, agent_category, hops=0):
+        """Return the agent's status from the delegated registry (None if unknown there)."""
+        key = ("status", base_url, agent_name, provider_name, agent_category)
+        fresh, value, etag = self._cached(key)
+        if fresh:
+            return value
+        params = {"agentName": agent_name, "providerName": provider_name}
+        if agent_category:
+            params["agentCategory"] = agent_category
+        response = self._request("GET", base_url + "/status", hops, etag=etag, params=params)
+        if response.status_code == 304:
+            self._store(key, value, response.headers.get("ETag", etag), self._ttl(response))
+            return value
+        if response.status_code == 404:
+            self._store(key, None, None, self.negative_ttl)
+            return None
+        if response.status_code != 200:
+            raise FederationError(f"{base_url}/status answered {response.status_code}")
+        value = response.json()["status"]
+        self._store(key, value, response.headers.get("ETag"), self._ttl(response))
+        return value
+
+    def lookup_statuses(self, base_url, lookups, hops=0):
+        """Batched lookup_status for (agent_name, provider_name, agent_category) tuples; one upstream request for the misses."""
+        results = {}
+        missing = []
+        for lookup in lookups:
+            fresh, value, _ = self._cached(("status", base_url) + tuple(lookup))
+            if fresh:
+                results[lookup] = value
+            else:
+                missing.append(lookup)
+        missing = list(dict.fromkeys(missing))
+        if missing:
+            agents = [{"agentName": n, "providerName": p, "agentCategory": c} for n, p, c in missing]
+            response = self._request("POST", base_url + "/status/batch", hops, json={"agents": agents})
+            if response.status_code != 200:
+                raise FederationError(f"{base_url}/status/batch answered {response.status_code}")
+            ttl = self._ttl(response)
+            for lookup, result in zip(missing, response.json()["results"]):
+                value = None if result["status"] == "not found" else result["status"]
+                self._store(("status", base_url) + tuple(lookup), value, result.get("etag"), ttl if value is not None else self.negative_ttl)
+                results[lookup] = value
+        return [results[lookup] for lookup in lookups]
+
+    def discover(self, base_url, request_json, hops=0):
+        """
+        Forward a discovery request; returns (status_code, response body, headers),
+        headers being the upstream's Cache-Control, if any, to pass on. Answers are
+        cached like status lookups: not at all for no-store (a load-aware pick),
+        else for the upstream's max-age or self.ttl.
+        """
+        digest = hashlib.sha1(json.dumps(request_json, sort_keys=True).encode("utf-8")).hexdigest()
+        key = ("discover", base_url, digest)
+        fresh, value, etag = self._cached(key)
+        if fresh:
+            return value
+        response = self._request("POST", base_url + "/discover", hops, etag=etag, json=request_json)
+        if response.status_code == 304 and value is not None:
+            self._store(key, value, response.headers.get("ETag", etag), self._ttl(response))
+            return value
+        try:
+            body = response.json()
+        except ValueError:
+            raise FederationError(f"{base_url}/discover answered {response.status_code} without JSON")
+        cache_control = response.headers.get("Cache-Control")
+        value = (response.status_code, body, {"Cache-Control": cache_control} if cache_control else {})
+        if response.status_code == 200:
+            self._store(key, value, response.headers.get("ETag"), self._ttl(response))
+        elif response.status_code == 404:
+            self._store(key, value, None, self.negative_ttl)
+        return value
+
+
+FEDERATION = Federation.from_env()
+
+
+def send_json(handler, code, payload, headers=None):
+    handler.send_response(code)
+    handler.send_header('Content-Type', 'application/json')
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(json.dumps(payload).encode('utf-8'))
+
+
+def check_hops(handler):
+    """Send 508 and return None if the request was forwarded too often, else return the hop count."""
+    hops = forwarded_hops(handler.headers)
+    if hops >= MAX_HOPS:
+        send_json(handler, 508, {"status": "failure", "errorMessage": "Delegation loop detected"})
+        return None
+    return hops
+
+
+def refer_delegated_write(handler, request_json, service, path=None):
+    """
+    For a write whose identity falls in a delegated zone, answer 307 pointing at the
+    authoritative registry (at path, default the service's usual endpoint) and
+    return True. Returns False if the write is local.
+    """
+    if handler.federation is None or not isinstance(request_json, dict):
+        return False
+    agent = request_json.get("requestingAgent", request_json)
+    if not isinstance(agent, dict):
+        return False
+    zone, base_url = handler.federation.upstream(service, agent.get("providerName"), agent.get("agentCategory"))
+    if base_url is None:
+        return False
+    location = base_url + (path or SERVICE_PATHS[service])
+    send_json(handler, 307, {"status": "failure", "errorMessage": f"Zone '{zone}' is delegated to {location}"},
+              {"Location": location, ZONE_HEADER: zone})
+    return True
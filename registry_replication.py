@@ -0,0 +1,176 @@
+"""
+registry_replication.py
+Primary/replica log shipping for the agent registry.
+
+- The primary appends every committed registry mutation to a change log: an
+  append-only file with one JSON entry per line. Each entry's log sequence number
+  (LSN) is its byte offset in the file, so several primary processes (the
+  registration, renewal and deactivation servers) can append to one log with
+  O_APPEND writes and no other coordination.
+- A replica is a read-only process that tails the change log and re-applies the
+  entries to its own local SQLite copy (or, for discovery, to an in-memory
+  CapabilityRegistry). Before serving a read it catches up if its last sync is
+  older than the configured maximum staleness.
+
+Running on one machine with several processes:
+
+    AGENT_REGISTRY_ROLE=primary AGENT_CHANGE_LOG=/tmp/registry.changelog python agent_registration_api.py
+    AGENT_REGISTRY_ROLE=replica AGENT_CHANGE_LOG=/tmp/registry.changelog AGENT_DB_PATH=/tmp/replica1.db python agent_status_api.py
+    AGENT_CHANGE_LOG=/tmp/registry.changelog AGENT_DB_PATH=/tmp/replica2.db python registry_replication.py --follow
+"""
+import json
+import os
+import threading
+import time
+
+import agent_registration_db
+
+
+class ChangeLog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def append(self, op, data):
+        """Append one entry and fsync it. Returns the entry's LSN (byte offset)."""
+        line = json.dumps({"ts": time.time(), "op": op, "data": data}, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            # A single write() on an O_APPEND descriptor places the whole entry at the
+            # current end of file, even with other processes appending concurrently.
+            os.write(self._fd, line.encode("utf-8"))
+            os.fsync(self._fd)
+            return os.lseek(self._fd, 0, os.SEEK_CUR) - len(line.encode("utf-8"))
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_entries(path, offset):
+    """
+    Yield (entry, next_offset) for every complete line after offset. A trailing
+    partial line (an append still in progress) is left for the next read.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            yield json.loads(line), offset
+
+
+def _apply_insert(data, change_offset):
+    agent_registration_db._write_registration(data, change_offset)
+
+
+def _apply_deactivate(data, change_offset):
+    agent_registration_db._deactivate(data["agentName"], data.get("providerName"), data.get("agentCategory"), change_offset)
+
+
+def _apply_deactivate_bulk(data, change_offset):
+    agent_registration_db._deactivate_matching(data["providerName"], data.get("agentCategory"), data.get("version"), change_offset)
+
+
+# Appliers that replay registry mutations into this process's local SQLite shards.
+# They take the entry's end offset and record it with their writes, so they are
+# used with a DatabaseCheckpoint.
+DB_APPLIERS = {
+    "insert": _apply_insert,
+    "deactivate": _apply_deactivate,
+    "deactivate_bulk": _apply_deactivate_bulk,
+}
+
+
+class DatabaseCheckpoint:
+    """
+    How far the local SQLite shards have applied the change log. Each shard stores
+    its offset in the same transaction as the rows an entry changes there (see
+    agent_registration_db._claim_change), so after a crash a replica resumes
+    without applying any entry to a shard twice.
+    """
+    def load(self):
+        return agent_registration_db.change_log_offset()
+
+    def save(self, offset):
+        # Shards that the last entries did not touch move forward too, so a
+        # restart does not re-read those entries
+        agent_registration_db.advance_change_log_offset(offset)
+
+
+class Replica:
+    """
+    Applies change log entries through `appliers` (op name -> callable(data)).
+    Ops without an applier are skipped. With a checkpoint (e.g. DatabaseCheckpoint)
+    the replica resumes from checkpoint.load(), appliers are called as
+    applier(data, end_offset) so they can store the position with their writes,
+    and checkpoint.save(offset) runs after each pass. Without one the replica
+    replays the log from the beginning (suitable for in-memory targets). An
+    applier that raises ends the pass before its entry, and the exception
+    propagates; the next catch_up() retries from that entry.
+    """
+    def __init__(self, log_path, appliers, checkpoint=None):
+        self.log_path = log_path
+        self.appliers = appliers
+        self.checkpoint = checkpoint
+        self.offset = checkpoint.load() if checkpoint is not None else 0
+        self.synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def catch_up(self):
+        """Apply every complete entry appended since the last sync. Returns the count applied."""
+        with self._lock:
+            applied = 0
+            try:
+                size = os.path.getsize(self.log_path)
+            except OSError:
+                size = 0
+            if size > self.offset:
+                start = self.offset
+                for entry, next_offset in read_entries(self.log_path, self.offset):
+                    applier = self.appliers.get(entry["op"])
+                    if applier is not None:
+                        if self.checkpoint is not None:
+                            applier(entry["data"], next_offset)
+                        else:
+                            applier(entry["data"])
+                        applied += 1
+                    self.offset = next_offset
+                if self.checkpoint is not None and self.offset > start:
+                    self.checkpoint.save(self.offset)
+            self.synced_at = time.time()
+            return applied
+
+    def ensure_fresh(self, max_staleness):
+        if time.time() - self.synced_at > max_staleness:
+            self.catch_up()
+
+    def follow(self, interval=0.2, stop_event=None):
+        """Keep applying the log until stop_event is set (or forever)."""
+        while stop_event is None or not stop_event.is_set():
+            self.catch_up()
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Apply the registry change log to a local replica database.")
+    parser.add_argument("--follow", action="store_true", help="keep tailing the change log instead of exiting after one pass")
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between polls in --follow mode")
+    args = parser.parse_args()
+    agent_registration_db.init_db()
+    replica = Replica(agent_registration_db.CHANGE_LOG_PATH, DB_APPLIERS, checkpoint=DatabaseCheckpoint())
+    if args.follow:
+        print(f"Following {agent_registration_db.CHANGE_LOG_PATH} into {agent_registration_db.DB_PATH}...")
+        replica.follow(args.interval)
+    else:
+        print(f"Applied {replica.catch_up()} change log entries.")
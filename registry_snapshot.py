@@ -0,0 +1,347 @@
+"""
+registry_snapshot.py
+Export and import of the whole registration registry as one columnar,
+memory-mappable snapshot file.
+
+Seeding a new node from SQLite or the change log replays rows one at a time. A
+snapshot instead stores every column as a flat array of 32-bit string ids into a
+table of interned strings. Provider names, categories, capabilities, protocols
+and versions repeat across millions of agents, and each distinct value is stored
+once. The certificate, a2aAgentCard and mcpClientInformation blobs are kept as
+the JSON text SQLite holds and are only parsed when a row's field is read. The
+file also carries a precomputed capability index: row ids sorted by
+(agentCapability, agentDID) with the start of each capability's run.
+
+Layout (native byte order, recorded in the metadata):
+
+    MAGIC, version, metadata length   struct HEADER
+    metadata                          JSON: row count, columns, section offsets
+    string offsets                    uint64 x (strings + 1)
+    string data                       UTF-8
+    one section per column            uint32 string id per row, NULL_ID for NULL
+    capability ids                    uint32 string id per capability, sorted by name
+    capability starts                 uint32 x (capabilities + 1) into capability order
+    capability order                  uint32 row ids
+
+RegistrySnapshot opens the file with mmap and answers from it in place: opening
+parses only the metadata, and a lookup decodes only the strings it returns.
+import_snapshot() loads a snapshot into the local SQLite shards, one executemany
+per shard.
+
+    python registry_snapshot.py export registry.snap
+    python registry_snapshot.py import registry.snap
+    python registry_snapshot.py info registry.snap
+
+A snapshot also records the change log size at export time. A replica that
+imports it resumes the log from that offset instead of from the beginning.
+Entries appended while the export was running are applied again, which only
+adds a duplicate registration row and leaves every agent's latest status
+unchanged.
+"""
+import bisect
+import functools
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Mapping
+
+import agent_registration_db
+
+MAGIC = b"ADNSSNAP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+NULL_ID = 0xFFFFFFFF
+# Decoded strings kept per open snapshot
+STRING_CACHE_SIZE = 65536
+
+# Registration columns exported, in table order (the autoincrement id is not kept).
+COLUMNS = (
+    "protocol", "agentName", "agentCategory", "providerName", "version", "extension", "agentPolicyId",
+    "agentUseJustification", "agentCapability", "agentEndpoint", "agentDID", "certificate", "csrPEM",
+    "a2aAgentCard", "mcpClientInformation", "agentDNSName", "registrationTimestamp", "agentStatus",
+)
+# Columns holding JSON text, parsed on access by SnapshotRow.
+JSON_COLUMNS = ("certificate", "a2aAgentCard", "mcpClientInformation")
+
+
+class SnapshotError(Exception):
+    """The file is not a registry snapshot this version can read."""
+
+
+def _align(f):
+    padding = -f.tell() % 8
+    if padding:
+        f.write(b"\0" * padding)
+
+
+def write_snapshot(path, rows, columns=COLUMNS, json_columns=JSON_COLUMNS, change_log_offset=None):
+    """
+    Write rows (sequences of str or None, in `columns` order) to a snapshot file.
+    Returns the number of rows written. The file is written next to `path` and
+    renamed into place, so readers never see a partial snapshot.
+    """
+    strings = {}
+    column_ids = [array("I") for _ in columns]
+    capability_column = columns.index("agentCapability")
+    did_column = columns.index("agentDID")
+    count = 0
+    for row in rows:
+        for ids, value in zip(column_ids, row):
+            if value is None:
+                ids.append(NULL_ID)
+            else:
+                string_id = strings.get(value)
+                if string_id is None:
+                    string_id = strings[value] = len(strings)
+                ids.append(string_id)
+        count += 1
+    if len(strings) >= NULL_ID:
+        raise SnapshotError("too many distinct strings for one snapshot")
+
+    values = list(strings)
+    offsets = array("Q", [0])
+    data = bytearray()
+    for value in values:
+        data += value.encode("utf-8")
+        offsets.append(len(data))
+
+    capability_ids = column_ids[capability_column]
+    did_ids = column_ids[did_column]
+    order = sorted((row for row in range(count) if capability_ids[row] != NULL_ID),
+                   key=lambda row: (values[capability_ids[row]], values[did_ids[row]] if did_ids[row] != NULL_ID else ""))
+    capabilities = array("I")
+    starts = array("I")
+    for position, row in enumerate(order):
+        if not capabilities or capabilities[-1] != capability_ids[row]:
+            capabilities.append(capability_ids[row])
+            starts.append(position)
+    starts.append(len(order))
+
+    sections = [("stringOffsets", offsets), ("stringData", data)]
+    sections += [("column:" + name, ids) for name, ids in zip(columns, column_ids)]
+    sections += [("capabilities", capabilities), ("capabilityStarts", starts), ("capabilityOrder", array("I", order))]
+
+    # Section offsets depend on the metadata length, which depends on the offsets;
+    # repeat the layout until the length stops changing
+    created_at = time.time()
+    metadata_length = 0
+    while True:
+        position = HEADER.size + metadata_length
+        offsets_by_name = {}
+        for name, section in sections:
+            position += -position % 8
+            offsets_by_name[name] = position
+            position += len(section) * (section.itemsize if isinstance(section, array) else 1)
+        metadata = {
+            "byteOrder": sys.byteorder,
+            "rows": count,
+            "strings": len(values),
+            "capabilities": len(capabilities),
+            "columns": list(columns),
+            "jsonColumns": list(json_columns),
+            "sections": offsets_by_name,
+            "changeLogOffset": change_log_offset,
+            "createdAt": created_at,
+        }
+        encoded = json.dumps(metadata).encode("utf-8")
+        if len(encoded) == metadata_length:
+            break
+        metadata_length = len(encoded)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        f.write(encoded)
+        for name, section in sections:
+            _align(f)
+            assert f.tell() == metadata["sections"][name]
+            f.write(section.tobytes() if isinstance(section, array) else section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class SnapshotRow(Mapping):
+    """One registration row read from a snapshot. Fields are decoded, and JSON columns parsed, on first access."""
+
+    __slots__ = ("_snapshot", "_row", "_cache")
+
+    def __init__(self, snapshot, row):
+        self._snapshot = snapshot
+        self._row = row
+        self._cache = {}
+
+    def __getitem__(self, column):
+        if column not in self._cache:
+            value = self._snapshot.value(self._row, column)
+            if value is not None and column in self._snapshot.json_columns:
+                value = json.loads(value)
+            self._cache[column] = value
+        return self._cache[column]
+
+    def __iter__(self):
+        return iter(self._snapshot.columns)
+
+    def __len__(self):
+        return len(self._snapshot.columns)
+
+    def __repr__(self):
+        return f"SnapshotRow({self._row}, agentName={self['agentName']!r})"
+
+
+class RegistrySnapshot:
+    """Read-only view of a snapshot file, answered from the memory map in place."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, metadata_length = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} is not a registry snapshot")
+            if version != FORMAT_VERSION:
+                raise SnapshotError(f"{path} has snapshot format {version}, expected {FORMAT_VERSION}")
+            self.metadata = json.loads(self._mmap[HEADER.size:HEADER.size + metadata_length])
+            if self.metadata["byteOrder"] != sys.byteorder:
+                raise SnapshotError(f"{path} was written on a {self.metadata['byteOrder']}-endian machine")
+        except (struct.error, ValueError, KeyError) as e:
+            self._mmap.close()
+            raise SnapshotError(f"{path}: unreadable snapshot header ({e})")
+        except SnapshotError:
+            self._mmap.close()
+            raise
+        self.columns = tuple(self.metadata["columns"])
+        self.json_columns = frozenset(self.metadata["jsonColumns"])
+        self.change_log_offset = self.metadata.get("changeLogOffset")
+        self._rows = self.metadata["rows"]
+        self._view = memoryview(self._mmap)
+        sections = self.metadata["sections"]
+        strings = self.metadata["strings"]
+        capabilities = self.metadata["capabilities"]
+        self._string_offsets = self._array(sections["stringOffsets"], strings + 1, "Q")
+        self._string_data = sections["stringData"]
+        self._columns = {name: self._array(sections["column:" + name], self._rows, "I") for name in self.columns}
+        self._capabilities = self._array(sections["capabilities"], capabilities, "I")
+        self._capability_starts = self._array(sections["capabilityStarts"], capabilities + 1, "I")
+        self._capability_order = self._array(sections["capabilityOrder"], self._capability_starts[-1], "I")
+        # Repeated values (providers, capabilities, statuses) are decoded once
+        self.string = functools.lru_cache(maxsize=STRING_CACHE_SIZE)(self._decode)
+
+    def _array(self, offset, length, typecode):
+        size = array(typecode).itemsize
+        return self._view[offset:offset + length * size].cast(typecode)
+
+    def close(self):
+        for view in (self._string_offsets, self._capabilities, self._capability_starts, self._capability_order,
+                     *self._columns.values(), self._view):
+            view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._rows
+
+    def _decode(self, string_id):
+        """Decode one interned string (None for NULL_ID). Reached through self.string, which caches."""
+        if string_id == NULL_ID:
+            return None
+        start = self._string_data + self._string_offsets[string_id]
+        end = self._string_data + self._string_offsets[string_id + 1]
+        return str(self._view[start:end], "utf-8")
+
+    def value(self, row, column):
+        return self.string(self._columns[column][row])
+
+    def row(self, row):
+        if not 0 <= row < self._rows:
+            raise IndexError(row)
+        return SnapshotRow(self, row)
+
+    def __iter__(self):
+        return (SnapshotRow(self, row) for row in range(self._rows))
+
+    def iter_tuples(self):
+        """Yield every row as a tuple of raw column strings, in `columns` order (for bulk loading)."""
+        columns = [self._columns[name] for name in self.columns]
+        string = self.string
+        for row in range(self._rows):
+            yield tuple(string(ids[row]) for ids in columns)
+
+    def capabilities(self):
+        return [self.string(string_id) for string_id in self._capabilities]
+
+    def agents_for(self, capability):
+        """Rows advertising exactly this agentCapability, in agentDID order, from the precomputed index."""
+        # The capability ids are sorted by their strings, so this bisects without a full decode
+        position = bisect.bisect_left(range(len(self._capabilities)), capability,
+                                      key=lambda i: self.string(self._capabilities[i]))
+        if position == len(self._capabilities) or self.string(self._capabilities[position]) != capability:
+            return []
+        start, end = self._capability_starts[position], self._capability_starts[position + 1]
+        return [SnapshotRow(self, row) for row in self._capability_order[start:end]]
+
+
+def _registration_rows():
+    agent_registration_db.sync_replica()
+    query = f"SELECT {', '.join(COLUMNS)} FROM agent_registrations ORDER BY id"
+    for path in agent_registration_db.shard_paths():
+        conn = agent_registration_db._connect(path)
+        try:
+            yield from conn.execute(query)
+        finally:
+            conn.close()
+
+
+def export_snapshot(path):
+    """Write every registration in the local shards to a snapshot. Returns the row count."""
+    try:
+        change_log_offset = os.path.getsize(agent_registration_db.CHANGE_LOG_PATH)
+    except OSError:
+        change_log_offset = None
+    count = write_snapshot(path, _registration_rows(), change_log_offset=change_log_offset)
+    print(f"[export_snapshot] Wrote {count} registrations to {path}")
+    return count
+
+
+def import_snapshot(path):
+    """
+    Replace the registrations in the local shards with the snapshot's rows.
+    Returns the row count. A replica also resumes its change log from the offset
+    recorded at export time.
+    """
+    with RegistrySnapshot(path) as snapshot:
+        if snapshot.columns != COLUMNS:
+            raise SnapshotError(f"{path} has columns {snapshot.columns}, expected {COLUMNS}")
+        offset = snapshot.change_log_offset if agent_registration_db.REGISTRY_ROLE == 'replica' else None
+        count = agent_registration_db.replace_registrations(COLUMNS, snapshot.iter_tuples(), offset)
+    print(f"[import_snapshot] Loaded {count} registrations from {path}")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export or import the registry as a columnar snapshot.")
+    parser.add_argument("command", choices=("export", "import", "info"))
+    parser.add_argument("path")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    if args.command == "export":
+        export_snapshot(args.path)
+    elif args.command == "import":
+        import_snapshot(args.path)
+    else:
+        with RegistrySnapshot(args.path) as snapshot:
+            print(f"{len(snapshot)} registrations, {snapshot.metadata['strings']} distinct strings, "
+                  f"{snapshot.metadata['capabilities']} capabilities, change log offset {snapshot.change_log_offset}")
+    print(f"Done in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,133 @@
+"""
+registry_versions.py
+In-memory version map used to answer conditional reads (ETag / If-None-Match)
+for agent status and discovery result sets without going back to the database.
+
+Each key (an agent identity, a capability, ...) carries a monotonic version. ETags are
+prefixed with a per-process epoch so that versions handed out before a restart
+can never be mistaken for versions handed out after it.
+"""
+import os
+import threading
+import time
+from email.utils import formatdate
+
+# Entries older than this many seconds are re-validated against the backing store.
+# Mutations made by other processes (e.g. the registration server writing to the
+# same SQLite file) become visible to conditional reads after at most this long.
+VERSION_TTL = float(os.environ.get("AGENT_VERSION_TTL", "5"))
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Compare an If-None-Match header against an ETag using the weak comparison
+    function from RFC 9110 (W/ prefixes are ignored).
+    """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class VersionMap:
+    """
+    Thread-safe map of key -> (version, last_modified).
+
+    ttl=None means the owner of the map is the only writer (e.g. an in-memory
+    registry) and entries never need re-validation. With a numeric ttl the map is
+    a cache in front of a shared store: entries are populated through observe()
+    and expire after ttl seconds.
+    """
+    def __init__(self, ttl=VERSION_TTL):
+        self.ttl = ttl
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.created = time.time()
+        self._lock = threading.Lock()
+        self._counter = 0
+        # key -> [version, last_modified, fingerprint, checked_at]
+        self._entries = {}
+
+    def _next_version(self):
+        self._counter += 1
+        return self._counter
+
+    def make_etag(self, version, suffix=None):
+        if suffix:
+            return f'"{self.epoch}-{version:x}-{suffix}"'
+        return f'"{self.epoch}-{version:x}"'
+
+    def observe(self, key, fingerprint):
+        """
+        Record the state of key as just read from the backing store. The version
+        only advances when the fingerprint differs from the last one observed.
+        Returns (etag, last_modified).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != fingerprint:
+                entry = [self._next_version(), now, fingerprint, now]
+                self._entries[key] = entry
+            else:
+                entry[3] = now
+            return self.make_etag(entry[0]), entry[1]
+
+    def bump(self, key):
+        """Advance the version of key after a mutation made by the map's owner."""
+        now = time.time()
+        with self._lock:
+            self._entries[key] = [self._next_version(), now, None, now]
+
+    def invalidate(self, key):
+        """Forget key so that the next read goes back to the backing store."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_many(self, keys):
+        """invalidate() for a batch of keys under a single lock acquisition."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def version(self, key):
+        """Return (version, last_modified) for key; unknown keys report version 0."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return 0, self.created
+            return entry[0], entry[1]
+
+    def current(self, key):
+        """
+        Return (etag, last_modified) for key if a fresh entry exists, else None.
+        Never touches the backing store.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[3] > self.ttl:
+                del self._entries[key]
+                return None
+            return self.make_etag(entry[0]), entry[1]
+
+
+# Versions of agent records served by the status API, keyed by
+# agent_registration_db.version_key(agentName, providerName, agentCategory).
+AGENT_VERSIONS = VersionMap()
@@ -0,0 +1,143 @@
+"""
+request_profiler.py
+Diagnostics for a running registry process: an on-demand sampling profiler and a
+ring buffer of slow requests with their stage timings.
+
+- sample_stacks() looks at every thread's Python stack (sys._current_frames) at
+  a fixed interval for a number of seconds and counts identical stacks. Nothing
+  is instrumented, so the overhead is a stack walk per thread per interval, and
+  only while a profile is being taken. folded() renders the counts in the
+  "frame;frame;frame count" format read by flamegraph.pl, speedscope and inferno.
+- KeepAliveMixin times every request. Code on the request's thread wraps its
+  steps in `with stage("name"):`, and stage() is a no-op on any other thread.
+  A request that takes longer than AGENT_SLOW_REQUEST_MS (default 500) is kept,
+  with all of its stages, in SLOW_REQUESTS, the last AGENT_SLOW_REQUEST_BUFFER
+  (default 256) of them.
+
+Both are served on the admin endpoints, see api_common.serve_admin().
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+SLOW_REQUEST_MS = float(os.environ.get("AGENT_SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_BUFFER = int(os.environ.get("AGENT_SLOW_REQUEST_BUFFER", "256"))
+PROFILE_INTERVAL = float(os.environ.get("AGENT_PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.environ.get("AGENT_PROFILE_MAX_SECONDS", "60"))
+
+_current = threading.local()
+# One profile at a time: concurrent samplers would only sample each other
+_profile_lock = threading.Lock()
+
+
+class StageTimer:
+    """Timings of one request: (stage, start_ms, duration_ms) relative to its start."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of the current request, if any."""
+    timer = getattr(_current, "timer", None)
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.stages.append((name, round((start - timer.started) * 1000, 3),
+                             round((time.perf_counter() - start) * 1000, 3)))
+
+
+class SlowRequestLog:
+    """Bounded, thread-safe ring buffer of slow request records, oldest dropped first."""
+    def __init__(self, threshold_ms=SLOW_REQUEST_MS, capacity=SLOW_REQUEST_BUFFER):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Start timing a request on this thread. Returns its StageTimer."""
+        timer = StageTimer()
+        _current.timer = timer
+        return timer
+
+    def end(self, timer, method, path, status):
+        """
+        Finish the request timed by timer; keep it if it was slow. Returns the record
+        or None. status None means no request arrived (the connection was closed).
+        """
+        _current.timer = None
+        total_ms = timer.elapsed_ms()
+        if status is None or total_ms < self.threshold_ms or self._entries.maxlen == 0:
+            return None
+        entry = {
+            "ts": time.time(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "totalMs": round(total_ms, 3),
+            "thread": threading.current_thread().name,
+            "stages": [{"stage": name, "startMs": start, "durationMs": duration} for name, start, duration in timer.stages],
+        }
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self, limit=None):
+        """Newest first."""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit else entries
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample all other threads' stacks for `seconds`. Returns (Counter of
+    root-first stack tuples, number of samples), or None if another profile is
+    already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        me = threading.get_ident()
+        labels = {}
+        counts = Counter()
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    stack.append(label)
+                    frame = frame.f_back
+                counts[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return counts, samples
+    finally:
+        _profile_lock.release()
+
+
+def folded(counts):
+    """Folded stack lines, heaviest first."""
+    return "".join(f"{';'.join(frames)} {count}\n" for frames, count in counts.most_common())
+
+
+# Slow requests of this process, filled by KeepAliveMixin.
+SLOW_REQUESTS = SlowRequestLog()
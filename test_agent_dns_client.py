@@ -0,0 +1,153 @@
+"""
+test_agent_dns_client.py
+Tests for the client SDK against in-process status and discovery servers backed by
+a temporary database.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import agent_registration_db as db
+from agent_discovery_api import DiscoveryHandler
+from agent_dns_client import AgentDNSClient, AsyncAgentDNSClient, ResolutionCache
+from agent_status_api import StatusHandler
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, make_profile, make_discovery_request
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def serve(handler_class):
+    stats = {"connections": 0, "requests": []}
+
+    class Counting(handler_class):
+        def setup(self):
+            stats["connections"] += 1
+            super().setup()
+
+        def parse_request(self):
+            # Counted before the response is sent, so the client never races the count
+            parsed = super().parse_request()
+            if parsed:
+                stats["requests"].append((self.command, self.path))
+            return parsed
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Counting)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+def make_agent(name):
+    return {
+        "protocol": "a2a",
+        "agentName": name,
+        "agentCategory": "translator",
+        "providerName": "openai",
+        "version": "1.0",
+        "agentCapability": "DocumentTranslation",
+        "agentDID": f"did:example:{name}",
+        "registrationTimestamp": "2025-04-20T11:03:00Z",
+    }
+
+def test_status_keep_alive_cache_and_batching():
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 2
+        server, stats = serve(StatusHandler)
+        base = f"http://127.0.0.1:{server.server_port}"
+        clock = FakeClock()
+        client = AgentDNSClient(urls={"status": base + "/status", "status_batch": base + "/status/batch"},
+                                stale_ttl=30, cache=ResolutionCache(clock=clock))
+        try:
+            for i in range(5):
+                db.insert_registration(make_agent(f"Agent{i}"))
+            db.deactivate_agent("Agent3")
+            assert client.status("Agent1") == "active"
+            assert client.status("Agent1") == "active"
+            assert client.status("Ghost") is None
+            # The second lookup was a cache hit; both requests shared one connection
+            assert len(stats["requests"]) == 2
+            assert stats["connections"] == 1
+            statuses = client.status_many(["Agent0", "Agent1", ("Agent3", "openai", "translator"), "Ghost2"])
+            assert statuses == ["active", "active", "inactive", None]
+            assert stats["requests"][-1] == ("POST", "/status/batch")
+            assert len(stats["requests"]) == 3
+            # Past max-age the stale answer is served while a conditional GET revalidates it
+            clock.now += 10
+            assert client.status("Agent1") == "active"
+            client._refresher.shutdown(wait=True)
+            assert len(stats["requests"]) == 4
+            state, value, _ = client.cache.lookup(("status", "Agent1", None, None))
+            assert (state, value) == ("fresh", "active")
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_async_status_calls_are_batched():
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 1
+        server, stats = serve(StatusHandler)
+        base = f"http://127.0.0.1:{server.server_port}"
+        try:
+            for i in range(20):
+                db.insert_registration(make_agent(f"Agent{i}"))
+
+            async def main():
+                async with AsyncAgentDNSClient(urls={"status": base + "/status", "status_batch": base + "/status/batch"}) as client:
+                    return await asyncio.gather(*(client.status(f"Agent{i}") for i in range(20)))
+
+            assert asyncio.run(main()) == ["active"] * 20
+            assert stats["requests"] == [("POST", "/status/batch")]
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_discovery_cache_revalidates_with_etag():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    profile = make_profile("TranslatorB", "DocumentTranslation", cert_pem)
+    registry[profile["agentDID"]] = profile
+    handler = type("Handler", (DiscoveryHandler,), {"tool": tool, "registry": registry, "replica": None})
+    server, stats = serve(handler)
+    clock = FakeClock()
+    client = AgentDNSClient(urls={"discover": f"http://127.0.0.1:{server.server_port}/discover"},
+                            discovery_ttl=5, stale_ttl=0, cache=ResolutionCache(clock=clock))
+    try:
+        request = make_discovery_request("DocumentTranslation", cert_pem)
+        status, body = client.discover(request)
+        assert status == 200 and body["respondingAgent"]["agentName"] == "TranslatorB"
+        assert client.discover(request) == (200, body)
+        assert len(stats["requests"]) == 1
+        clock.now += 6
+        assert client.discover(request) == (200, body)
+        assert len(stats["requests"]) == 2
+        # A load-aware pick is made per request and never cached
+        request = make_discovery_request("DocumentTranslation", cert_pem, selection="p2c")
+        assert client.discover(request) == (200, body)
+        assert client.discover(request) == (200, body)
+        assert len(stats["requests"]) == 4
+        assert stats["connections"] == 1
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_status_keep_alive_cache_and_batching()
+    test_async_status_calls_are_batched()
+    test_discovery_cache_revalidates_with_etag()
+    print("All client tests passed.")
@@ -0,0 +1,131 @@
+"""
+test_agent_health.py
+Tests for live health statistics and load-aware discovery selection.
+"""
+import collections
+import http.client
+import json
+import random
+import shutil
+import ssl
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+import api_common
+from agent_discovery_api import DiscoveryHandler
+from api_common import enable_tls, server_tls_context
+from agent_health import HealthTable, parse_feedback
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, issue_tls_certificates, make_profile, make_discovery_request
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_decayed_statistics():
+    clock = FakeClock()
+    table = HealthTable(half_life=10, clock=clock)
+    for _ in range(20):
+        table.record("did:a", 1000, error=False)
+    assert table.expected_cost("did:a", 100) > 900
+    table.record("did:b", 100, error=True)
+    table.record("did:b", None, error=True)
+    latency, latency_samples, error_rate, _ = table.stats("did:b")
+    assert latency == 100 and latency_samples == 1 and error_rate == 1.0
+    assert table.expected_cost("did:b", 100) > table.expected_cost("did:c", 100) == 100
+    # Without new reports the estimate falls back towards the advertised latency
+    clock.now += 200
+    assert table.expected_cost("did:a", 100) < 101
+    table.forget("did:a")
+    assert table.stats("did:a") is None
+
+def test_table_is_bounded():
+    table = HealthTable(max_agents=16, rng=random.Random(1))
+    for i in range(100):
+        table.record(f"did:{i}", 10)
+    assert len(table) == 16
+    assert len(table._latency) == 16
+
+def test_parse_feedback():
+    assert parse_feedback({"agentDID": "did:a", "latencyMs": 12.5}) == [("did:a", 12.5, False)]
+    assert parse_feedback({"reports": [{"agentDID": "did:a", "success": False}]}) == [("did:a", None, True)]
+    for bad in [[], {"reports": []}, {"agentDID": "did:a"}, {"agentDID": "did:a", "latencyMs": -1}, {"agentDID": 3, "latencyMs": 1}]:
+        try:
+            parse_feedback(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {bad!r}")
+
+def test_discovery_steers_away_from_slow_agents():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    for i in range(4):
+        profile = make_profile(f"Translator{i}", "DocumentTranslation", cert_pem, latency=150)
+        registry[profile["agentDID"]] = profile
+    saved = api_common.CA_CERT_PATH, api_common._ca_cert
+    tmpdir = tempfile.mkdtemp()
+    paths = issue_tls_certificates(tmpdir)
+    with open(paths["client_cert"]) as f:
+        client_pem = f.read()
+    reporter = make_profile("Reporter", "Orchestration", client_pem)
+    registry[reporter["agentDID"]] = reporter
+    api_common.CA_CERT_PATH, api_common._ca_cert = paths["ca"], None
+    handler = type("Handler", (DiscoveryHandler,), {"tool": tool, "registry": registry, "replica": None,
+                                                    "log_message": lambda *args: None})
+    server = enable_tls(ThreadingHTTPServer(("127.0.0.1", 0), handler),
+                        server_tls_context(paths["server_cert"], paths["server_key"], paths["ca"], "optional"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    anonymous = ssl.create_default_context(cafile=paths["ca"])
+    authenticated = ssl.create_default_context(cafile=paths["ca"])
+    authenticated.load_cert_chain(paths["client_cert"], paths["client_key"])
+
+    def post_feedback(context, body):
+        conn = http.client.HTTPSConnection("localhost", server.server_port, context=context)
+        conn.request("POST", "/feedback", body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        result = response.status, json.loads(response.read())
+        conn.close()
+        return result
+
+    try:
+        reports = [{"agentDID": "did:example:translator0", "latencyMs": 5000, "success": False}] * 10
+        reports.append({"agentDID": "did:example:unknown", "latencyMs": 10})
+        # The reporter's certificate is public; pasting it into the body without its key proves nothing
+        status, body = post_feedback(anonymous, {"requestingAgent": reporter, "reports": reports})
+        assert status == 401 and body["status"] == "failure"
+        # Authenticated, but claiming to be an agent advertised with another certificate
+        impostor = make_discovery_request("DocumentTranslation", cert_pem)["requestingAgent"]
+        assert post_feedback(authenticated, {"requestingAgent": dict(impostor, agentDID="did:example:translator1"), "reports": reports})[0] == 403
+        assert post_feedback(authenticated, {"reports": reports})[0] == 403
+        assert registry.health_table().stats("did:example:translator0") is None
+        status, body = post_feedback(authenticated, {"requestingAgent": reporter, "reports": reports})
+        assert status == 200
+        assert body == {"status": "success", "errorMessage": None, "recorded": 10, "ignored": 1}
+    finally:
+        server.shutdown()
+        server.server_close()
+        api_common.CA_CERT_PATH, api_common._ca_cert = saved
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    chosen = collections.Counter()
+    for _ in range(200):
+        response = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, selection="p2c"), registry)
+        chosen[response["respondingAgent"]["agentName"]] += 1
+    # Power of two choices never picks the worst agent and spreads load over the rest
+    assert chosen["Translator0"] == 0
+    assert len(chosen) == 3
+    # Load-aware selection is opt-in: by default the first match in registry order answers
+    first = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem), registry)
+    assert first["respondingAgent"]["agentName"] == "Translator0"
+
+if __name__ == "__main__":
+    test_decayed_statistics()
+    test_table_is_bounded()
+    test_parse_feedback()
+    test_discovery_steers_away_from_slow_agents()
+    print("All agent health tests passed.")
@@ -0,0 +1,213 @@
+"""
+test_agent_registration_db.py
+Tests for the sharded SQLite registry layer. Uses a temporary directory so the
+real agent_registration.db is never touched.
+"""
+import os
+import threading
+from http.server import ThreadingHTTPServer
+import requests
+import agent_registration_db as db
+import agent_deactivation_api
+import api_common
+from agent_deactivation_api import DeactivationHandler
+from api_common import enable_tls, server_tls_context
+from rate_limiter import TokenBucketLimiter
+from test_support import issue_tls_certificates, make_agent, temp_db
+
+def test_sharded_routing_and_fan_out():
+    with temp_db(4):
+        db.init_db()
+        assert len(db.shard_paths()) == 4
+        assert all(os.path.exists(p) for p in db.shard_paths())
+        providers = ["openai", "anthropic", "google", "mistral", "cohere", "meta"]
+        for i, provider in enumerate(providers):
+            db.insert_registration(make_agent(f"Agent{i}", provider))
+        # Each row lives only in the shard its providerName/agentCategory hashes to
+        for i, provider in enumerate(providers):
+            expected = db.shard_for(provider, "translator")
+            for path in db.shard_paths():
+                conn = db._connect(path)
+                count = conn.execute("SELECT COUNT(*) FROM agent_registrations WHERE agentName=?", (f"Agent{i}",)).fetchone()[0]
+                conn.close()
+                assert count == (1 if path == expected else 0)
+        # Routed and fanned-out reads agree
+        assert db.get_agent_status("Agent0", "openai", "translator") == "active"
+        assert db.get_agent_status("Agent0") == "active"
+        assert db.get_agent_status("Missing") is None
+        assert len(db.scan_registrations("agentName")) == len(providers)
+        assert db.deactivate_agent("Agent1")
+        assert db.get_agent_status("Agent1") == "inactive"
+        assert not db.deactivate_agent("Agent1")
+
+def test_single_shard_uses_db_path():
+    with temp_db():
+        assert db.shard_paths() == [db.DB_PATH]
+        db.insert_registration(make_agent("TestAgent", "openai"))
+        assert db.get_agent_status("TestAgent") == "active"
+
+def test_name_filter_sees_other_writers():
+    saved = db.NAME_FILTER_MAX_STALENESS, db.NAME_FILTER_CAPACITY
+    with temp_db(2):
+        try:
+            db.NAME_FILTER_CAPACITY = 4
+            for i in range(10):
+                db.insert_registration(make_agent(f"Agent{i}", "openai" if i % 2 else "google"))
+            assert db.get_agent_status("Agent3") == "active"
+            # The filter outgrew its capacity and was rebuilt larger
+            assert db._name_filter.capacity >= 10
+            assert not db.agent_may_exist("Typo")
+            # A row written by another process (straight into SQLite) is not in the filter yet
+            db.NAME_FILTER_MAX_STALENESS = 3600
+            conn = db._connect(db.shard_for("openai", "translator"))
+            conn.execute("INSERT INTO agent_registrations (agentName, providerName, agentCategory, agentStatus) VALUES ('Remote', 'openai', 'translator', 'active')")
+            conn.commit()
+            conn.close()
+            assert db.get_agent_status("Remote") is None
+            db.NAME_FILTER_MAX_STALENESS = 0
+            assert db.get_agent_status("Remote") == "active"
+            assert db.get_agent_statuses([("Remote", None, None), ("Typo", None, None)]) == {
+                ("Remote", None, None): "active", ("Typo", None, None): None}
+        finally:
+            db.NAME_FILTER_MAX_STALENESS, db.NAME_FILTER_CAPACITY = saved
+
+def test_bulk_deactivation_by_identity_prefix():
+    with temp_db(4):
+        agents = [("A", "openai", "translator", "1.0"), ("B", "openai", "translator", "2.0"),
+                  ("C", "openai", "summarizer", "1.0"), ("D", "google", "translator", "1.0")]
+        for name, provider, category, version in agents:
+            db.insert_registration(make_agent(name, provider, category, version))
+        db.AGENT_VERSIONS.observe(db.version_key("A", "openai"), "active")
+        assert db.deactivate_agents("openai", "translator", "1.0") == ["A"]
+        assert db.AGENT_VERSIONS.current(db.version_key("A", "openai")) is None
+        assert db.get_agent_status("B") == "active"
+        # Already inactive rows are not reported again
+        assert db.deactivate_agents("openai") == ["B", "C"]
+        assert db.deactivate_agents("openai") == []
+        assert db.get_agent_status("D") == "active"
+        try:
+            db.deactivate_agents("openai", None, "1.0")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected a non-prefix pattern to be rejected")
+        conn = db._connect(db.shard_for("openai", "translator"))
+        plan = " ".join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN UPDATE agent_registrations SET agentStatus='inactive' WHERE providerName=? AND agentCategory=?",
+            ("openai", "translator")))
+        conn.close()
+        assert "idx_agent_registrations_identity" in plan
+
+def post_json(url, body, **kwargs):
+    response = requests.post(url, json=body, timeout=5, **kwargs)
+    return response.status_code, response.json()
+
+def test_bulk_deactivation_requires_provider_agent():
+    saved = api_common.CA_CERT_PATH, api_common._ca_cert, agent_deactivation_api.WRITE_LIMITER
+    # Every request below comes from the same agent; keep its bucket out of the way
+    agent_deactivation_api.WRITE_LIMITER = TokenBucketLimiter(1000, 1000)
+    handler = type("Handler", (DeactivationHandler,), {"federation": None, "log_message": lambda *args: None})
+    with temp_db(2) as tmpdir:
+        paths = issue_tls_certificates(tmpdir)
+        api_common.CA_CERT_PATH, api_common._ca_cert = paths["ca"], None
+        plain = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server = enable_tls(ThreadingHTTPServer(("127.0.0.1", 0), handler),
+                            server_tls_context(paths["server_cert"], paths["server_key"], paths["ca"], "optional"))
+        for httpd in (plain, server):
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f"https://localhost:{server.server_port}/deactivate/bulk"
+        client = {"cert": (paths["client_cert"], paths["client_key"]), "verify": paths["ca"]}
+        try:
+            with open(paths["client_cert"]) as f:
+                cert_pem = f.read()
+            with open(paths["server_cert"]) as f:
+                other_pem = f.read()
+            admin = make_agent("Admin", "openai", certificate={"certificatePEM": cert_pem})
+            db.insert_registration(admin)
+            db.insert_registration(make_agent("Other", "google", certificate={"certificatePEM": other_pem}))
+            requester = {key: admin[key] for key in ("agentName", "agentCategory", "providerName", "certificate")}
+            assert post_json(url, {"providerName": "openai"}, **client)[0] == 400
+            # The registered certificate is public (discovery returns it); without its
+            # key, over plain HTTP or TLS without a client certificate, it proves nothing
+            copied = {"providerName": "openai", "requestingAgent": requester}
+            assert post_json(f"http://127.0.0.1:{plain.server_port}/deactivate/bulk", copied)[0] == 401
+            assert post_json(url, copied, verify=paths["ca"])[0] == 401
+            assert db.get_agent_status("Admin") == "active"
+            # A client holding one key cannot present another agent's certificate in the body
+            other = dict(requester, agentName="Other", providerName="google", certificate={"certificatePEM": other_pem})
+            assert post_json(url, {"providerName": "google", "requestingAgent": other}, **client)[0] == 401
+            # An authenticated agent may not retire another provider or claim another identity
+            status, body = post_json(url, {"providerName": "google", "requestingAgent": requester}, **client)
+            assert status == 403 and body["status"] == "failure"
+            claimed = dict(requester, agentName="Other", providerName="google")
+            assert post_json(url, {"providerName": "google", "requestingAgent": claimed}, **client)[0] == 403
+            assert db.get_agent_status("Other") == "active"
+            status, body = post_json(url, copied, **client)
+            assert status == 200 and body["deactivatedAgents"] == ["Admin"]
+            # Its own registration is inactive now, so it cannot ask again
+            assert post_json(url, copied, **client)[0] == 403
+        finally:
+            for httpd in (plain, server):
+                httpd.shutdown()
+                httpd.server_close()
+            api_common.CA_CERT_PATH, api_common._ca_cert, agent_deactivation_api.WRITE_LIMITER = saved
+
+def test_identity_selects_rows_within_a_shard():
+    with temp_db():
+        db.insert_registration(make_agent("X", "openai"))
+        db.insert_registration(make_agent("X", "google"))
+        db.insert_registration(make_agent("Y", "google"))
+        db.AGENT_VERSIONS.observe(db.version_key("X", "openai", "translator"), "active")
+        db.AGENT_VERSIONS.observe(db.version_key("X", "google", "translator"), "active")
+        assert not db.deactivate_agent("X", "anthropic", "translator")
+        assert db.deactivate_agent("X", "google", "translator")
+        assert db.get_agent_status("X", "google", "translator") == "inactive"
+        assert db.get_agent_status("X", "openai", "translator") == "active"
+        assert db.get_agent_status("Y", "openai", "translator") is None
+        assert db.get_agent_status("Y", "google") == "active"
+        # The batch lookup filters on the same identity and answers each lookup separately
+        lookups = [("X", "google", "translator"), ("X", "openai", "translator"), ("Y", "openai", "translator"), ("X", None, None)]
+        assert db.get_agent_statuses(lookups) == {("X", "google", "translator"): "inactive",
+                                                  ("X", "openai", "translator"): "active",
+                                                  ("Y", "openai", "translator"): None,
+                                                  ("X", None, None): "inactive"}
+        # Only the deactivated identity's cached version is dropped
+        assert db.AGENT_VERSIONS.current(db.version_key("X", "google", "translator")) is None
+        assert db.AGENT_VERSIONS.current(db.version_key("X", "openai", "translator")) is not None
+
+def test_name_filter_rebuild_keeps_concurrent_registrations():
+    saved = db.NAME_FILTER_MAX_STALENESS, db.NAME_FILTER_CAPACITY, db.BloomFilter
+    writers = []
+
+    class RacingFilter(db.BloomFilter):
+        def __len__(self):
+            # A registration commits after the rebuilt filter was scanned, before it is swapped in
+            if self.capacity > 2 and not writers:
+                writers.append(threading.Thread(target=db.insert_registration, args=(make_agent("Late", "openai"),)))
+                writers[0].start()
+                writers[0].join(timeout=0.5)
+            return super().__len__()
+
+    with temp_db():
+        try:
+            db.NAME_FILTER_CAPACITY, db.NAME_FILTER_MAX_STALENESS = 2, 3600
+            db.BloomFilter = RacingFilter
+            assert not db.agent_may_exist("Early")
+            for name in ("A", "B", "C"):
+                db.insert_registration(make_agent(name, "openai"))
+            db._refresh_name_filter()
+            writers[0].join()
+            assert db._name_filter.capacity > 2
+            assert db.agent_may_exist("Late") and db.get_agent_status("Late") == "active"
+        finally:
+            db.NAME_FILTER_MAX_STALENESS, db.NAME_FILTER_CAPACITY, db.BloomFilter = saved
+
+if __name__ == "__main__":
+    test_sharded_routing_and_fan_out()
+    test_single_shard_uses_db_path()
+    test_name_filter_sees_other_writers()
+    test_bulk_deactivation_by_identity_prefix()
+    test_bulk_deactivation_requires_provider_agent()
+    test_identity_selects_rows_within_a_shard()
+    test_name_filter_rebuild_keeps_concurrent_registrations()
+    print("Registry DB tests passed.")
@@ -0,0 +1,136 @@
+"""
+test_api_common.py
+Tests for the lazily initialised handler resources.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import agent_registration_db as db
+import api_common
+from agent_status_api import StatusHandler
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def test_service_imports_defer_heavy_dependencies():
+    script = (
+        "import sys\n"
+        "import agent_registration_api, agent_renewal_api, agent_deactivation_api, agent_status_api, agent_discovery_api\n"
+        "print(sorted(m for m in ('jsonschema', 'cryptography') if m in sys.modules))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script], cwd="/", env=dict(os.environ, PYTHONPATH=REPO_DIR),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip().splitlines()[-1] == "[]"
+
+def test_validators_are_cached():
+    name = "agent_deactivation_request_schema.json"
+    assert api_common.schema_validator(name) is api_common.schema_validator(name)
+    valid, error = api_common.validate_json_schema({"agentName": "TestAgent"}, name)
+    assert not valid and "required" in error
+    valid, error = api_common.validate_json_schema(
+        {"protocol": "a2a", "agentName": "TestAgent", "agentCategory": "translator", "providerName": "openai", "version": "1.0"}, name)
+    assert valid and error == ''
+
+def test_invalid_certificate_rejected():
+    try:
+        api_common.verify_certificate_pem("-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----")
+    except Exception:
+        pass
+    else:
+        raise AssertionError("Expected an invalid certificate to be rejected")
+
+def raw_request(port, head, body=b""):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(head.encode("ascii") + b"\r\n" + body)
+        response = b""
+        while b"\r\n\r\n" not in response:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+        return int(response.split(b" ", 2)[1])
+
+def test_json_depth_prescan():
+    assert not api_common.json_depth_exceeds('{"a": [1, {"b": "[[[[[[]]]]]]"}]}', 3)
+    assert api_common.json_depth_exceeds('{"a": [1, {"b": 2}]}', 2)
+    assert not api_common.json_depth_exceeds('"\\"[[["', 0)
+    assert api_common.json_depth_exceeds('["a\\\\", ["b"]]', 1)
+    assert api_common.json_depth_exceeds('[[[[ "\\', 3) and not api_common.json_depth_exceeds('["[[[[\\', 3)
+    # An unterminated string of escaped quotes is scanned once, not once per quote
+    started = time.perf_counter()
+    assert not api_common.json_depth_exceeds('"' + '\\"' * 200000 + '[[', 1)
+    assert time.perf_counter() - started < 1
+
+def test_buffers_are_reused():
+    pool = api_common.BufferPool(initial_size=1024)
+    buffer = pool.acquire(100)
+    assert len(buffer) == 1024
+    pool.release(buffer)
+    assert pool.acquire(1000) is buffer
+    assert len(pool.acquire(3000)) == 4096
+
+def test_request_body_limits():
+    saved = db.DB_PATH, db.DB_SHARDS
+    handler = type("Handler", (StatusHandler,), {"max_body_bytes": 512, "log_message": lambda *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 1
+            post = "POST /status/batch HTTP/1.1\r\nHost: x\r\n"
+            body = b'{"agents": [{"agentName": "A"}]}'
+            assert raw_request(port, post + f"Content-Length: {len(body)}\r\n", body) == 200
+            assert raw_request(port, post) == 411
+            assert raw_request(port, post + "Transfer-Encoding: chunked\r\n", b"5\r\nhello\r\n0\r\n\r\n") == 411
+            assert raw_request(port, post + "Content-Length: -1\r\n") == 400
+            # Rejected from the header alone: nothing of the claimed gigabyte is sent
+            assert raw_request(port, post + "Content-Length: 1000000000\r\n") == 413
+            deep = b'{"agents": ' + b"[" * 40 + b"]" * 40 + b"}"
+            assert raw_request(port, post + f"Content-Length: {len(deep)}\r\n", deep) == 400
+            assert raw_request(port, post + "Content-Length: 4\r\n", b'"\xff"x') == 400
+            assert raw_request(port, post + "Content-Length: 5\r\n", b"{nope") == 400
+            # Names that are not strings are a bad request, not a 500
+            for agent in (b'{"agentName": 5}', b'{"agentName": ["A"]}', b'{"agentName": "A", "providerName": {}}'):
+                bad = b'{"agents": [' + agent + b']}'
+                assert raw_request(port, post + f"Content-Length: {len(bad)}\r\n", bad) == 400
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_unread_body_closes_connection():
+    handler = type("Handler", (StatusHandler,), {"log_message": lambda *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        smuggled = b"GET /admin/x HTTP/1.1\r\nHost: x\r\n\r\n"
+        head = f"POST /nope HTTP/1.1\r\nHost: x\r\nContent-Length: {len(smuggled)}\r\n\r\n"
+        with socket.create_connection(("127.0.0.1", server.server_port), timeout=5) as sock:
+            sock.sendall(head.encode("ascii") + smuggled)
+            response = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+        # One 404, then the server hangs up instead of answering the body as a request
+        assert response.startswith(b"HTTP/1.1 404") and response.count(b"HTTP/1.1 ") == 1
+        assert b"Connection: close" in response
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_service_imports_defer_heavy_dependencies()
+    test_validators_are_cached()
+    test_invalid_certificate_rejected()
+    test_json_depth_prescan()
+    test_buffers_are_reused()
+    test_request_body_limits()
+    test_unread_body_closes_connection()
+    print("API common tests passed.")
@@ -0,0 +1,74 @@
+"""
+test_authentication_authorization.py
+Tests for TokenVerifier and the per-key verifier cache behind validate_jwt. They
+need python-jose, and are skipped without it.
+"""
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+pytest.importorskip("jose")
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+import authentication_authorization as auth
+
+def make_key_pair():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption()).decode()
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private_pem, public_pem
+
+def expect_value_error(fn, *args):
+    try:
+        fn(*args)
+    except ValueError:
+        return
+    raise AssertionError(f"Expected ValueError from {fn.__name__}{args!r}")
+
+def test_token_verifier_cache():
+    private_pem, public_pem = make_key_pair()
+    now = time.time()
+    token = jwt.encode({"sub": "TranslatorB", "aud": "agent-dns", "exp": int(now) + 60}, private_pem,
+                       algorithm="RS256", headers={"kid": "k1"})
+    assert auth.validate_jwt(token, public_pem, "agent-dns")["sub"] == "TranslatorB"
+    assert auth.validate_jwt(token, public_pem, "agent-dns")["sub"] == "TranslatorB"
+    # The audience is part of the cache key, so a cached token is still checked against it
+    expect_value_error(auth.validate_jwt, token, public_pem, "someone-else")
+    # A JWK dict is unhashable: verified without the per-key cache
+    public_jwk = jwk.construct(public_pem, "RS256").to_dict()
+    assert auth.validate_jwt(token, public_jwk, "agent-dns")["sub"] == "TranslatorB"
+    expect_value_error(auth.validate_jwt, token, "not a key", "agent-dns")
+    assert len(auth._verifiers) <= auth.MAX_VERIFIERS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jwks_path = os.path.join(tmpdir, "jwks.json")
+        with open(jwks_path, "w") as f:
+            json.dump({"keys": [dict(public_jwk, kid="k1")]}, f)
+        verifier = auth.TokenVerifier(jwks_path=jwks_path)
+        assert verifier.verify(token, "agent-dns")["aud"] == "agent-dns"
+        assert len(verifier._cache) == 1
+        expired = jwt.encode({"sub": "TranslatorB", "aud": "agent-dns", "exp": int(now) - 10}, private_pem,
+                             algorithm="RS256", headers={"kid": "k1"})
+        expect_value_error(verifier.verify, expired, "agent-dns")
+        assert len(verifier._cache) == 1
+
+def test_unreadable_jwks_is_a_value_error():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jwks_path = os.path.join(tmpdir, "jwks.json")
+        expect_value_error(auth.TokenVerifier, None, jwks_path)
+        for content in ("{not json", '{"no": "keys"}', '{"keys": [{"kty": "nonsense"}]}'):
+            with open(jwks_path, "w") as f:
+                f.write(content)
+            expect_value_error(auth.TokenVerifier, None, jwks_path)
+
+if __name__ == "__main__":
+    test_token_verifier_cache()
+    test_unreadable_jwks_is_a_value_error()
+    print("Authentication & authorization tests passed.")
@@ -0,0 +1,95 @@
+"""
+test_capability_embeddings.py
+Tests for offline semantic capability matching.
+"""
+from capability_embeddings import HashingEmbedder, SemanticIndex, agent_text, tokenize
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA, AGENT_CAPABILITY_RESPONSE_SCHEMA
+from test_support import issue_test_certificates, make_profile, make_discovery_request
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+def test_tokenize_splits_camel_case():
+    assert tokenize("LegalTranslation v2_en-fr") == ["legal", "translation", "v", "2", "en", "fr"]
+    assert tokenize("OCRService") == ["ocr", "service"]
+
+def test_related_capabilities_embed_closer():
+    embedder = HashingEmbedder()
+    legal = embedder.embed("LegalTranslation")
+    assert cosine(legal, embedder.embed("DocumentTranslation")) > cosine(legal, embedder.embed("ImageRecognition"))
+
+def test_index_ranks_and_updates_incrementally():
+    index = SemanticIndex()
+    pure = SemanticIndex()
+    pure.np = None
+    pure._matrix = []
+    profiles = [
+        make_profile("TranslatorB", "DocumentTranslation", "", "Legal translation service", ["Translation"]),
+        make_profile("OcrBot", "ImageRecognition", "", "Reads scanned images", ["OCR"]),
+        make_profile("Summarizer", "TextSummarization", "", "Summarises long documents", ["Summarization"]),
+    ]
+    for profile in profiles:
+        index.add(profile["agentDID"], profile)
+        pure.add(profile["agentDID"], profile)
+    results = index.search("LegalTranslation", limit=3)
+    assert results[0][1]["agentName"] == "TranslatorB"
+    assert [r[1]["agentName"] for r in results] == [r[1]["agentName"] for r in pure.search("LegalTranslation", limit=3)]
+    index.remove("did:example:translatorb")
+    assert all(r[1]["agentName"] != "TranslatorB" for r in index.search("LegalTranslation"))
+    assert len(index) == 2
+
+def test_large_index_matches_exhaustive_search():
+    # Larger than the registries the old LSH filter kicked in for; every query must
+    # return exactly what scoring each profile on its own returns
+    embedder = HashingEmbedder()
+    index = SemanticIndex(embedder)
+    domains = ["Legal", "Medical", "Financial", "Code", "Image", "Speech", "Document", "Patent"]
+    tasks = ["Translation", "Summarization", "Review", "Recognition", "Classification", "Extraction"]
+    vectors = []
+    for i in range(6000):
+        capability = f"{domains[i % 8]}{tasks[(i // 8) % 6]}{'' if i % 5 else 'Pro'}"
+        profile = make_profile(f"Agent{i}", capability, "", f"{domains[(i * 7) % 8]} work {i % 97}", [tasks[(i * 5) % 6]])
+        index.add(profile["agentDID"], profile)
+        vectors.append((profile["agentName"], embedder.embed(agent_text(profile))))
+    for text in ("LegalTranslation", "MedicalSummarization", "CodeReview"):
+        query = embedder.embed(text)
+        exact = sorted(((cosine(vector, query), position, name) for position, (name, vector) in enumerate(vectors)),
+                       key=lambda item: (-item[0], item[1]))[:10]
+        results = index.search(text, limit=10)
+        assert [r[1]["agentName"] for r in results] == [name for _, _, name in exact], text
+        # A larger limit extends the same ranking
+        assert [r[1]["agentName"] for r in index.search(text, limit=25)[:10]] == [name for _, _, name in exact]
+
+def test_semantic_discovery_returns_ranked_matches():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA, AGENT_CAPABILITY_RESPONSE_SCHEMA, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    for profile in [
+        make_profile("TranslatorB", "DocumentTranslation", cert_pem, "Legal translation service", ["Translation"]),
+        make_profile("TranslatorC", "Translation", cert_pem, "General translation", ["Translation"]),
+        make_profile("OcrBot", "ImageRecognition", cert_pem, "Reads scanned images", ["OCR"]),
+    ]:
+        registry[profile["agentDID"]] = profile
+    exact = tool.handle_discovery(make_discovery_request("LegalTranslation", cert_pem), registry)
+    assert exact["status"] == "failure"
+    response = tool.handle_discovery(make_discovery_request("LegalTranslation", cert_pem, matchMode="semantic"), registry)
+    assert response["status"] == "success", response["errorMessage"]
+    names = [m["agent"]["agentName"] for m in response["matches"]]
+    assert set(names) == {"TranslatorB", "TranslatorC"}
+    scores = [m["score"] for m in response["matches"]]
+    assert scores == sorted(scores, reverse=True)
+    # A plain list of profiles works too
+    listed = tool.handle_discovery(make_discovery_request("LegalTranslation", cert_pem, matchMode="semantic"), list(registry.values()))
+    assert [m["agent"]["agentName"] for m in listed["matches"]] == names
+    for bad in ({"minScore": "abc"}, {"minScore": True}, {"maxResults": -1}, {"maxResults": 2.5}):
+        rejected = tool.handle_discovery(make_discovery_request("LegalTranslation", cert_pem, matchMode="semantic", **bad), registry)
+        assert rejected["status"] == "failure" and rejected["errorMessage"].startswith(("Request validation error", "Invalid pagination"))
+
+if __name__ == "__main__":
+    test_tokenize_splits_camel_case()
+    test_related_capabilities_embed_closer()
+    test_index_ranks_and_updates_incrementally()
+    test_large_index_matches_exhaustive_search()
+    test_semantic_discovery_returns_ranked_matches()
+    print("Semantic matching tests passed.")
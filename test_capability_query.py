@@ -0,0 +1,81 @@
+"""
+test_capability_query.py
+Tests for multi-attribute filters over additionalCapabilities.
+"""
+import random
+
+from capability_query import AttributeIndex, matches_filters, parse_filters
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, make_profile, make_discovery_request
+
+def test_parse_filters_rejects_bad_conditions():
+    assert parse_filters({"languagePair": "en-fr", "latency": {"lt": 200}}) == [("languagePair", "eq", "en-fr"), ("latency", "lt", 200)]
+    for bad in ["latency<200", {"latency": {"lt": "fast"}}, {"latency": {"near": 1}}, {"region": {"in": "eu"}}, {"region": {}},
+                {"languagePair": ["en-fr", "de"]}, {"region": {"eq": {"a": 1}}}]:
+        try:
+            parse_filters(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {bad!r}")
+
+def test_index_matches_full_scan():
+    rng = random.Random(7)
+    index = AttributeIndex()
+    profiles = {}
+    for i in range(300):
+        profile = make_profile(f"Agent{i}", "DocumentTranslation", "",
+                               latency=rng.randint(50, 400), bleuScore=rng.uniform(20, 50),
+                               region=rng.choice(["eu-west", "eu-central", "us-east"]),
+                               domainExpertise=rng.choice(["Legal", "Finance", "Medical"]),
+                               certified=rng.choice([True, False, 1]))
+        profiles[profile["agentDID"]] = profile
+        index.add(profile["agentDID"], profile)
+    for did in list(profiles)[::3]:
+        index.remove(did, profiles.pop(did))
+    queries = [
+        {"latency": {"lt": 200}, "bleuScore": {"gt": 35}},
+        {"latency": {"gte": 100, "lte": 150}, "domainExpertise": {"in": ["Legal", "Finance"]}},
+        {"region": {"prefix": "eu-"}, "latency": 120},
+        {"region": "ap-south"},
+        {"certified": True, "latency": {"lt": 300}},
+        {"certified": {"in": [False, 1]}},
+        {"certified": 1},
+    ]
+    for filters in queries:
+        predicates = parse_filters(filters)
+        expected = {did for did, profile in profiles.items() if matches_filters(profile, predicates)}
+        assert index.query(predicates) == expected, filters
+    assert index.query([]) is None
+
+def test_discovery_applies_filters():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    for profile in [
+        make_profile("Fast", "DocumentTranslation", cert_pem, latency=120, bleuScore=38),
+        make_profile("Slow", "DocumentTranslation", cert_pem, latency=450, bleuScore=41),
+        make_profile("FastOcr", "ImageRecognition", cert_pem, latency=80, bleuScore=40),
+    ]:
+        registry[profile["agentDID"]] = profile
+    request = make_discovery_request("DocumentTranslation", cert_pem, filters={"latency": {"lt": 200}, "bleuScore": {"gt": 35}})
+    response = tool.handle_discovery(request, registry)
+    assert response["status"] == "success"
+    assert response["respondingAgent"]["agentName"] == "Fast"
+    assert tool.handle_discovery(request, list(registry.values()))["respondingAgent"]["agentName"] == "Fast"
+    registry["did:example:fast"] = make_profile("Fast", "DocumentTranslation", cert_pem, latency=300, bleuScore=38)
+    assert tool.handle_discovery(request, registry)["status"] == "failure"
+    # The index answers in agentDID order, so the same query always selects the same agent
+    for name in ("Fast2", "Fast0", "Fast1"):
+        profile = make_profile(name, "DocumentTranslation", cert_pem, latency=100, bleuScore=40)
+        registry[profile["agentDID"]] = profile
+    first = make_discovery_request("DocumentTranslation", cert_pem, filters={"latency": 100}, selection="first")
+    assert tool.handle_discovery(first, registry)["respondingAgent"]["agentName"] == "Fast0"
+    invalid = make_discovery_request("DocumentTranslation", cert_pem, filters={"latency": {"lt": "fast"}})
+    assert tool.handle_discovery(invalid, registry)["errorMessage"].startswith("Invalid query filters")
+
+if __name__ == "__main__":
+    test_parse_filters_rejects_bad_conditions()
+    test_index_matches_full_scan()
+    test_discovery_applies_filters()
+    print("All capability query tests passed.")
@@ -0,0 +1,89 @@
+"""
+test_capability_templates.py
+Tests for frozen capability templates and advertisements that reference them.
+"""
+import copy
+import json
+import os
+import pickle
+import tempfile
+from capability_registry import CapabilityRegistry
+from capability_templates import CapabilityTemplates, freeze
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, make_profile
+
+def advertisement(name, cert_pem, **fields):
+    agent = make_profile(name, "DocumentTranslation", cert_pem)
+    del agent["additionalCapabilities"]
+    agent.update(fields)
+    return {"requestType": "advertisement", "requestingAgent": agent}
+
+def test_frozen_values():
+    frozen = freeze({"a": [1, {"b": 2}]})
+    assert isinstance(frozen, dict) and frozen["a"][1] == {"b": 2}
+    for mutate in (lambda: frozen.__setitem__("c", 1), lambda: frozen.update(c=1), lambda: frozen.pop("a"),
+                   lambda: frozen["a"][1].setdefault("c", 1)):
+        try:
+            mutate()
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("Expected a frozen template to refuse mutation")
+    assert json.loads(json.dumps(frozen)) == {"a": [1, {"b": 2}]}
+    assert copy.deepcopy(frozen) is frozen
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+    mutable = frozen.copy()
+    mutable["c"] = 3
+    assert "c" not in frozen
+
+def test_templates_are_validated_once():
+    templates = CapabilityTemplates()
+    template = templates.get("translation")
+    assert template is templates.get("translation") and templates.get("missing") is None
+    assert template.mcp_server_information["tools"][0]["name"] == "translate_text"
+    assert template.additional_capabilities_with(None) is template.additional_capabilities
+    merged = template.additional_capabilities_with({"languagePair": "en-de", "certified": True})
+    assert merged["languagePair"] == "en-de" and merged["latency"] == 150 and merged["certified"] is True
+    for delta in ({"latency": "fast"}, {"languagePair": 3}, {"latency": True}, {"nested": {"a": 1}}):
+        try:
+            template.additional_capabilities_with(delta)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"Expected {delta} to be rejected")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "templates.json")
+        bad_tool = {"name": "t", "description": "", "parameters": {"type": 5}}
+        for definition in ({"additionalCapabilities": {}},
+                           {"mcpServerInformation": {"tools": [bad_tool], "resources": []}, "additionalCapabilities": {}}):
+            with open(path, "w") as f:
+                json.dump({"broken": definition}, f)
+            try:
+                CapabilityTemplates(path).get("broken")
+            except Exception:
+                pass
+            else:
+                raise AssertionError("Expected an invalid template to be rejected at load")
+
+def test_advertisements_share_template_structures():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    first = tool.handle_advertisement(advertisement("TranslatorA", cert_pem), registry)
+    second = tool.handle_advertisement(advertisement("TranslatorB", cert_pem, additionalCapabilities={"languagePair": "en-de"}), registry)
+    assert first["status"] == second["status"] == "success"
+    a, b = registry["did:example:translatora"], registry["did:example:translatorb"]
+    assert a["capabilityTemplate"] == "translation"
+    assert a["mcpServerInformation"] is b["mcpServerInformation"]
+    assert a["additionalCapabilities"]["languagePair"] == "en-fr" and b["additionalCapabilities"]["languagePair"] == "en-de"
+    unknown = tool.handle_advertisement(advertisement("TranslatorC", cert_pem, capabilityTemplate="nope"), registry)
+    assert unknown["status"] == "failure" and "nope" in unknown["errorMessage"]
+    mismatched = tool.handle_advertisement(advertisement("TranslatorD", cert_pem, additionalCapabilities={"latency": "low"}), registry)
+    assert mismatched["status"] == "failure" and "latency" in mismatched["errorMessage"]
+    assert len(registry) == 2
+
+if __name__ == "__main__":
+    test_frozen_values()
+    test_templates_are_validated_once()
+    test_advertisements_share_template_structures()
+    print("Capability template tests passed.")
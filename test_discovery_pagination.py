@@ -0,0 +1,133 @@
+"""
+test_discovery_pagination.py
+Tests for cursor-paginated and NDJSON-streamed discovery.
+"""
+import http.client
+import json
+import threading
+from http.server import HTTPServer
+
+from agent_discovery_api import DiscoveryHandler
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, make_profile, make_discovery_request
+
+class CountingTool(AgentDiscoveryTool):
+    certificate_checks = 0
+
+    def validate_certificate(self, cert_pem):
+        self.certificate_checks += 1
+        return super().validate_certificate(cert_pem)
+
+def make_registry(cert_pem, count=25):
+    registry = CapabilityRegistry()
+    for i in range(count):
+        profile = make_profile(f"Translator{i:03d}", "DocumentTranslation", cert_pem, latency=100 + i)
+        registry[profile["agentDID"]] = profile
+    ocr = make_profile("OcrBot", "ImageRecognition", cert_pem)
+    registry[ocr["agentDID"]] = ocr
+    return registry
+
+def test_cursor_walks_every_agent_once():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = CountingTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = make_registry(cert_pem)
+    seen = []
+    cursor = None
+    while True:
+        query = {"pageSize": 10}
+        if cursor:
+            query["cursor"] = cursor
+        checks_before = tool.certificate_checks
+        response = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, **query), registry)
+        assert response["status"] == "success"
+        # Only the agents on the page had their certificates verified
+        assert tool.certificate_checks - checks_before == len(response["matches"])
+        seen.extend(match["agent"]["agentName"] for match in response["matches"])
+        cursor = response["nextCursor"]
+        if cursor is None:
+            break
+        # An agent added behind the cursor does not shift the following pages
+        early = make_profile("Translator000a", "DocumentTranslation", cert_pem)
+        registry[early["agentDID"]] = early
+    assert seen == [f"Translator{i:03d}" for i in range(25)]
+
+def test_filtered_pages_and_bad_cursor():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = make_registry(cert_pem)
+    filters = {"latency": {"lt": 110}}
+    first = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, filters=filters, pageSize=6), registry)
+    second = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, filters=filters, pageSize=6, cursor=first["nextCursor"]), registry)
+    names = [m["agent"]["agentName"] for m in first["matches"] + second["matches"]]
+    assert names == [f"Translator{i:03d}" for i in range(10)]
+    assert second["nextCursor"] is None
+    # A cursor is bound to the query it was issued for
+    other = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, pageSize=6, cursor=first["nextCursor"]), registry)
+    assert other["errorMessage"].startswith("Invalid pagination")
+    garbage = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, pageSize=6, cursor="not-a-cursor"), registry)
+    assert garbage["errorMessage"].startswith("Invalid pagination")
+
+def test_semantic_pages_survive_sparse_filters():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = make_registry(cert_pem, count=40)
+    # Only the last 5 of 40 equally scored translators pass, far more than the 4x over-fetch covers
+    query = {"matchMode": "semantic", "filters": {"latency": {"gte": 135}}, "pageSize": 2}
+    seen, cursor = [], None
+    while True:
+        page_query = dict(query, cursor=cursor) if cursor else query
+        response = tool.handle_discovery(make_discovery_request("DocumentTranslation", cert_pem, **page_query), registry)
+        assert response["status"] == "success"
+        seen.extend(match["agent"]["agentName"] for match in response["matches"])
+        cursor = response["nextCursor"]
+        if cursor is None:
+            break
+    assert seen == [f"Translator{i:03d}" for i in range(35, 40)]
+
+def test_ndjson_stream():
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    handler = type("Handler", (DiscoveryHandler,), {"tool": tool, "registry": make_registry(cert_pem), "replica": None,
+                                                    "log_message": lambda *args: None})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        body = json.dumps(make_discovery_request("DocumentTranslation", cert_pem))
+        conn.request("POST", "/discover", body=body, headers={"Content-Type": "application/json", "Accept": "application/x-ndjson"})
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.getheader("Content-Type") == "application/x-ndjson"
+        records = [json.loads(line) for line in response.read().decode("utf-8").splitlines()]
+        assert len(records) == 26
+        assert records[-1] == {"status": "success", "errorMessage": None, "count": 25, "nextCursor": None}
+        assert {r["agent"]["agentCapability"] for r in records[:-1]} == {"DocumentTranslation"}
+        # The JSON representation of the same result set has its own ETag
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        conn.request("POST", "/discover", body=body, headers={"Content-Type": "application/json",
+                                                              "If-None-Match": response.getheader("ETag")})
+        plain = conn.getresponse()
+        plain.read()
+        assert plain.status == 200 and plain.getheader("ETag") != response.getheader("ETag")
+        # A load-aware selection orders the stream per request, so it is not cacheable
+        conn.request("POST", "/discover", body=json.dumps(make_discovery_request("DocumentTranslation", cert_pem, selection="p2c")),
+                     headers={"Content-Type": "application/json", "Accept": "application/x-ndjson"})
+        randomized = conn.getresponse()
+        randomized.read()
+        assert randomized.getheader("ETag") is None and randomized.getheader("Cache-Control") == "no-store"
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        conn.request("POST", "/discover", body=json.dumps(make_discovery_request("DocumentTranslation", cert_pem, maxResults="x")),
+                     headers={"Content-Type": "application/json"})
+        invalid = conn.getresponse()
+        assert invalid.status == 400 and json.loads(invalid.read())["errorMessage"].startswith("Invalid pagination")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_cursor_walks_every_agent_once()
+    test_filtered_pages_and_bad_cursor()
+    test_semantic_pages_survive_sparse_filters()
+    test_ndjson_stream()
+    print("All discovery pagination tests passed.")
@@ -0,0 +1,30 @@
+"""
+test_membership_filter.py
+Tests for the Bloom filter behind negative status lookups.
+"""
+from membership_filter import BloomFilter
+
+def test_no_false_negatives_and_bounded_false_positives():
+    bloom = BloomFilter(5000, error_rate=0.01)
+    added = sum(bloom.add(f"Agent{i}") for i in range(5000))
+    # A new key that collides with earlier ones is reported as already present
+    assert 5000 * 0.98 < added == len(bloom) <= 5000
+    assert all(f"Agent{i}" in bloom for i in range(5000))
+    false_positives = sum(f"Unknown{i}" in bloom for i in range(20000))
+    assert false_positives < 20000 * 0.02
+    # Re-adding a present key does not count it twice
+    assert not bloom.add("Agent1")
+    assert len(bloom) == added
+
+def test_invalid_parameters():
+    for capacity, error_rate in [(0, 0.01), (10, 0), (10, 1)]:
+        try:
+            BloomFilter(capacity, error_rate)
+        except ValueError:
+            continue
+        raise AssertionError((capacity, error_rate))
+
+if __name__ == "__main__":
+    test_no_false_negatives_and_bounded_false_positives()
+    test_invalid_parameters()
+    print("Membership filter tests passed.")
@@ -0,0 +1,111 @@
+"""
+test_mutual_tls.py
+The status server behind the mutual-TLS front door: client certificates are
+required, sessions resume from tickets, and a body certificate identical to the
+verified peer certificate is accepted without being parsed again when the
+handshake checked it against the registry CA.
+"""
+import os
+import socket
+import ssl
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import requests
+
+import agent_registration_db as db
+import api_common
+from agent_status_api import StatusHandler
+from api_common import enable_tls, server_tls_context, verify_request_certificate
+from test_support import issue_tls_certificates
+
+def get_status(context, port, session=None):
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as raw:
+        with context.wrap_socket(raw, server_hostname="localhost", session=session) as tls:
+            tls.sendall(b"GET /status?agentName=TLSAgent HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            response = b""
+            while True:
+                chunk = tls.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+            return response.split(b" ", 2)[1], tls.session, tls.session_reused
+
+def test_status_over_mutual_tls():
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = issue_tls_certificates(tmpdir)
+        db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 1
+        handler = type("Handler", (StatusHandler,), {"log_message": lambda *args: None})
+        server = enable_tls(ThreadingHTTPServer(("127.0.0.1", 0), handler),
+                            server_tls_context(paths["server_cert"], paths["server_key"], paths["ca"], "required"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+        try:
+            db.insert_registration({"agentName": "TLSAgent", "providerName": "openai", "agentCategory": "translator"})
+            response = requests.get(f"https://localhost:{port}/status", params={"agentName": "TLSAgent"},
+                                    cert=(paths["client_cert"], paths["client_key"]), verify=paths["ca"], timeout=5)
+            assert response.status_code == 200 and response.json()["status"] == "active"
+
+            # No client certificate: the handshake is refused
+            try:
+                requests.get(f"https://localhost:{port}/status", params={"agentName": "TLSAgent"}, verify=paths["ca"], timeout=5)
+            except requests.exceptions.RequestException:
+                pass
+            else:
+                raise AssertionError("served a client without a certificate")
+
+            # A returning client resumes its session instead of a full handshake
+            context = ssl.create_default_context(cafile=paths["ca"])
+            context.load_cert_chain(paths["client_cert"], paths["client_key"])
+            code, session, reused = get_status(context, port)
+            assert code == b"200" and not reused
+            code, _, reused = get_status(context, port, session)
+            assert code == b"200" and reused
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_body_certificate_matching_peer_skips_parsing():
+    saved = api_common.CA_CERT_PATH, api_common._ca_cert
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = issue_tls_certificates(tmpdir)
+        with open(paths["client_cert"]) as f:
+            client_pem = f.read()
+        with open(paths["server_cert"]) as f:
+            server_pem = f.read()
+        der = ssl.PEM_cert_to_DER_cert(client_pem)
+
+        def handler_for(context):
+            return SimpleNamespace(connection=SimpleNamespace(getpeercert=lambda binary_form=False: der, context=context))
+
+        # The handshake checked the test CA, not the registry's ca.pem: the body
+        # certificate still has to be issued by the registry
+        other_ca = server_tls_context(paths["server_cert"], paths["server_key"], paths["ca"], "required")
+        try:
+            verify_request_certificate(handler_for(other_ca), client_pem)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("a certificate from another CA was accepted on the handshake's word")
+        try:
+            api_common.CA_CERT_PATH, api_common._ca_cert = paths["ca"], None
+            registry_ca = server_tls_context(paths["server_cert"], paths["server_key"], paths["ca"], "required")
+            # Same CA and same certificate as the handshake: accepted without parsing
+            verify_request_certificate(handler_for(registry_ca), client_pem.replace("\n", "\r\n"))
+            try:
+                verify_request_certificate(handler_for(registry_ca), server_pem)
+            except Exception:
+                pass
+            else:
+                raise AssertionError("a different body certificate must be verified against ca.pem")
+        finally:
+            api_common.CA_CERT_PATH, api_common._ca_cert = saved
+
+if __name__ == "__main__":
+    test_status_over_mutual_tls()
+    test_body_certificate_matching_peer_skips_parsing()
+    print("Mutual TLS tests passed.")
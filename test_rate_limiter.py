@@ -0,0 +1,63 @@
+"""
+test_rate_limiter.py
+Tests for the token-bucket admission control on the write endpoints.
+"""
+from rate_limiter import TokenBucketLimiter, ConcurrencyLimiter, rate_limit_keys
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def test_burst_then_reject_then_refill():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=2.0, burst=3, slots=1024, clock=clock)
+    keys = ["id:a2a.TestAgent.translator.openai.1.0"]
+    assert [limiter.check(keys) for _ in range(3)] == [0, 0, 0]
+    retry_after = limiter.check(keys)
+    assert 0 < retry_after <= 0.5
+    clock.now += 0.5
+    assert limiter.check(keys) == 0
+    assert limiter.check(keys) > 0
+
+def test_keys_are_independent_and_all_must_pass():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rate=1.0, burst=1, slots=1 << 16, clock=clock)
+    assert limiter.check(["id:A", "cert:X"]) == 0
+    # Same certificate under a new name is still limited by the fingerprint key
+    assert limiter.check(["id:B", "cert:X"]) > 0
+    # Rejected checks consume nothing, so id:B still has its token
+    assert limiter.check(["id:B"]) == 0
+
+def test_memory_is_fixed_per_slot():
+    limiter = TokenBucketLimiter(rate=1.0, burst=5, slots=1 << 20)
+    assert limiter._tokens.itemsize + limiter._stamps.itemsize == 8
+    for i in range(10000):
+        limiter.check([f"id:agent{i}"])
+    assert len(limiter._tokens) == 1 << 20
+
+def test_rate_limit_keys():
+    request = {"requestingAgent": {"protocol": "a2a", "agentName": "TestAgent", "agentCategory": "translator",
+                                   "providerName": "openai", "version": "1.0",
+                                   "certificate": {"certificatePEM": "-----BEGIN CERTIFICATE-----"}}}
+    keys = rate_limit_keys(request)
+    assert keys[0] == "id:a2a.TestAgent.translator.openai.1.0"
+    assert keys[1].startswith("cert:")
+    assert rate_limit_keys({"agentName": "TestAgent"}) == ["id:.TestAgent..."]
+    assert rate_limit_keys([1, 2]) == ["malformed"]
+
+def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+if __name__ == "__main__":
+    test_burst_then_reject_then_refill()
+    test_keys_are_independent_and_all_must_pass()
+    test_memory_is_fixed_per_slot()
+    test_rate_limit_keys()
+    test_concurrency_limiter()
+    print("Rate limiter tests passed.")
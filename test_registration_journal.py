@@ -0,0 +1,238 @@
+"""
+test_registration_journal.py
+Tests for the group-committed registration journal and its crash replay.
+"""
+import json
+import os
+import threading
+import agent_registration_db as db
+import registration_journal
+from registration_journal import JournalError, JournalLocked, RegistrationJournal, drain_journals, read_journal
+from test_support import make_agent, row_count, temp_db
+
+def write_journal(path, generation, agents):
+    lines = [json.dumps({"journal": generation})] + [json.dumps(agent) for agent in agents]
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def test_concurrent_registrations_share_group_commits():
+    with temp_db(2) as tmpdir:
+        batches = []
+
+        def apply(journal, generation, entries):
+            batches.append(len(entries))
+            return db.apply_journal_entries(journal, generation, entries)
+
+        journal = RegistrationJournal(os.path.join(tmpdir, "registration.journal"), "registration",
+                                      group_interval=0.02, apply=apply)
+        threads = [threading.Thread(target=journal.submit, args=(make_agent(f"Agent{i}", ("openai", "google")[i % 2]),))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Every submit returned, so every entry is already in the journal file
+        generation, entries, _ = read_journal(journal.path)
+        assert generation == journal.generation and len(entries) == 20
+        assert journal.wait_drained(timeout=5)
+        assert sum(batches) == 20 and len(batches) < 20
+        assert db.get_agent_status("Agent7") == "active" and row_count("Agent7") == 1
+        journal.close()
+
+def test_replay_after_crash_skips_applied_entries():
+    with temp_db(2) as tmpdir:
+        path = os.path.join(tmpdir, "registration.journal")
+        write_journal(path, "g1", [make_agent(name, provider) for name, provider in (("A", "openai"), ("B", "google"), ("C", "openai"))])
+        with open(path, "a") as f:
+            f.write('{"agentName": "Torn"')
+        generation, entries, valid_length = read_journal(path)
+        assert generation == "g1" and [agent["agentName"] for _, agent in entries] == ["A", "B", "C"]
+        assert valid_length == os.path.getsize(path) - len('{"agentName": "Torn"')
+        # The process died after A reached SQLite but before B and C did
+        assert [agent["agentName"] for agent in db.apply_journal_entries("registration", "g1", entries[:1])] == ["A"]
+        journal = RegistrationJournal(path, "registration")
+        assert [row_count(name) for name in ("A", "B", "C", "Torn")] == [1, 1, 1, 0]
+        # Replaying the same entries again changes nothing
+        assert db.apply_journal_entries("registration", "g1", entries) == []
+        # The replayed file was reset to a fresh generation
+        assert read_journal(path)[:2] == (journal.generation, []) and journal.generation != "g1"
+        journal.close()
+
+def test_journal_starts_new_generation_when_drained():
+    with temp_db(1) as tmpdir:
+        journal = RegistrationJournal(os.path.join(tmpdir, "registration.journal"), "registration",
+                                      group_interval=0, max_bytes=400)
+        first_generation = journal.generation
+        for i in range(5):
+            journal.submit(make_agent(f"Agent{i}"))
+            assert journal.wait_drained(timeout=5)
+        assert journal.generation != first_generation
+        assert os.path.getsize(journal.path) < 800
+        assert all(row_count(f"Agent{i}") == 1 for i in range(5))
+        journal.close()
+        # A restart replays nothing twice
+        RegistrationJournal(journal.path, "registration").close()
+        assert all(row_count(f"Agent{i}") == 1 for i in range(5))
+
+def test_journal_file_is_locked_per_process():
+    saved = registration_journal.JOURNAL_DIR, dict(registration_journal._journals)
+    with temp_db(1) as tmpdir:
+        try:
+            path = os.path.join(tmpdir, "registration.journal")
+            held = RegistrationJournal(path, "registration")
+            try:
+                RegistrationJournal(path, "registration")
+            except JournalLocked:
+                pass
+            else:
+                raise AssertionError("Expected a second writer on the same file to be refused")
+            # journal_for() moves on to the next free slot instead
+            registration_journal.JOURNAL_DIR = tmpdir
+            registration_journal._journals.clear()
+            journal = registration_journal.journal_for("registration")
+            assert journal.path == os.path.join(tmpdir, "registration-1.journal") and journal.name == "registration-1"
+            journal.close()
+            held.close()
+            # Once released, the file can be opened again
+            RegistrationJournal(path, "registration").close()
+        finally:
+            registration_journal.JOURNAL_DIR = saved[0]
+            registration_journal._journals.clear()
+            registration_journal._journals.update(saved[1])
+
+def test_deactivation_drains_pending_registrations_first():
+    with temp_db(2) as tmpdir:
+        # Another process acknowledged A and B but its drainer has not applied them yet
+        path = os.path.join(tmpdir, "registration-1.journal")
+        write_journal(path, "g1", [make_agent("A", "openai"), make_agent("B", "google")])
+        assert drain_journals(tmpdir) == 2
+        assert db.deactivate_agent("A")
+        # The owner's own drain then finds nothing left to insert, so A stays inactive
+        generation, entries, _ = read_journal(path)
+        assert db.apply_journal_entries("registration-1", generation, entries) == []
+        assert db.get_agent_status("A") == "inactive" and row_count("A") == 1
+        assert drain_journals(tmpdir) == 0
+        # Entries read before the owner started a new generation are not applied
+        write_journal(path, "g2", [make_agent("C", "openai")])
+        generation, entries, _ = read_journal(path)
+        write_journal(path, "g3", [])
+        assert db.apply_journal_entries("registration-1", generation, entries,
+                                        is_current=lambda: registration_journal.journal_generation(path) == generation) == []
+        assert row_count("C") == 0
+
+def test_drain_skips_entries_already_drained():
+    saved = db.apply_journal_entries
+    with temp_db(2) as tmpdir:
+        path = os.path.join(tmpdir, "registration-1.journal")
+        write_journal(path, "g1", [make_agent("A", "openai"), make_agent("B", "google")])
+        assert drain_journals(tmpdir) == 2
+        applied = []
+        try:
+            def apply(journal, generation, entries, is_current=None):
+                applied.append([agent["agentName"] for _, agent in entries])
+                return saved(journal, generation, entries, is_current)
+
+            db.apply_journal_entries = apply
+            # Nothing was appended since, so nothing is parsed or applied
+            assert drain_journals(tmpdir) == 0 and applied == []
+            with open(path, "a") as f:
+                f.write(json.dumps(make_agent("C", "openai")) + "\n")
+            assert drain_journals(tmpdir) == 1 and applied == [["C"]]
+        finally:
+            db.apply_journal_entries = saved
+        # Entries every shard already holds are skipped without waiting for the write lock
+        generation, entries, _ = read_journal(path)
+        holder = db.sqlite3.connect(db.shard_for("openai", "translator"), timeout=0)
+        try:
+            holder.execute("BEGIN IMMEDIATE")
+            assert db.apply_journal_entries("registration-1", generation, entries) == []
+        finally:
+            holder.rollback()
+            holder.close()
+
+def test_drainer_gives_up_after_repeated_failures():
+    saved = registration_journal.DRAIN_RETRY_INTERVAL, registration_journal.JOURNAL_DRAIN_ATTEMPTS
+    with temp_db(1) as tmpdir:
+        attempts = []
+
+        def apply(journal, generation, entries):
+            attempts.append(len(entries))
+            raise db.sqlite3.OperationalError("database is locked")
+
+        try:
+            registration_journal.DRAIN_RETRY_INTERVAL, registration_journal.JOURNAL_DRAIN_ATTEMPTS = 0.001, 3
+            journal = RegistrationJournal(os.path.join(tmpdir, "registration.journal"), "registration", apply=apply)
+            journal.submit(make_agent("A", "openai"))
+            assert not journal.wait_drained(timeout=5)
+            assert attempts == [1, 1, 1]
+            try:
+                journal.submit(make_agent("B", "openai"))
+            except JournalError:
+                pass
+            else:
+                raise AssertionError("Expected the failed journal to refuse registrations")
+            journal.close()
+            # The acknowledged entry is still in the file for the next replay
+            assert [agent["agentName"] for _, agent in read_journal(journal.path)[1]] == ["A"]
+        finally:
+            registration_journal.DRAIN_RETRY_INTERVAL, registration_journal.JOURNAL_DRAIN_ATTEMPTS = saved
+
+def test_failed_replay_releases_the_lock():
+    with temp_db(1) as tmpdir:
+        path = os.path.join(tmpdir, "registration.journal")
+        write_journal(path, "g1", [make_agent("A", "openai")])
+
+        def apply(journal, generation, entries):
+            raise db.sqlite3.OperationalError("database is locked")
+
+        try:
+            RegistrationJournal(path, "registration", apply=apply)
+        except db.sqlite3.OperationalError:
+            pass
+        else:
+            raise AssertionError("Expected the replay to fail")
+        # The failed attempt closed its file, so the next one can lock and replay it
+        journal = RegistrationJournal(path, "registration")
+        assert row_count("A") == 1
+        journal.close()
+
+def test_committed_shards_are_recorded_when_another_fails():
+    saved = db.record_change, db._connect
+    with temp_db(2):
+        recorded = []
+        failing = db.shard_for("google", "translator")
+        assert failing != db.shard_for("openai", "translator")
+        try:
+            db.record_change = lambda operation, agent: recorded.append(agent["agentName"])
+
+            def connect(path):
+                conn = saved[1](path)
+                if path == failing:
+                    conn.close()
+                    raise db.sqlite3.OperationalError("disk I/O error")
+                return conn
+
+            db._connect = connect
+            entries = [(10, make_agent("A", "openai")), (20, make_agent("B", "google"))]
+            try:
+                db.apply_journal_entries("registration", "g1", entries)
+            except db.sqlite3.OperationalError:
+                pass
+            else:
+                raise AssertionError("Expected the failing shard to raise")
+            # The openai shard committed A, so A reached the change log even though B did not
+            assert recorded == ["A"]
+        finally:
+            db.record_change, db._connect = saved
+
+if __name__ == "__main__":
+    test_concurrent_registrations_share_group_commits()
+    test_replay_after_crash_skips_applied_entries()
+    test_journal_starts_new_generation_when_drained()
+    test_journal_file_is_locked_per_process()
+    test_deactivation_drains_pending_registrations_first()
+    test_drain_skips_entries_already_drained()
+    test_drainer_gives_up_after_repeated_failures()
+    test_failed_replay_releases_the_lock()
+    test_committed_shards_are_recorded_when_another_fails()
+    print("Registration journal tests passed.")
@@ -0,0 +1,201 @@
+"""
+test_registry_federation.py
+Federation of registry instances on loopback ports: a parent status server in this
+process delegates the "anthropic" zone to a child status server running as a
+separate process with its own database.
+"""
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import agent_registration_db as db
+from agent_discovery_api import DiscoveryHandler
+from agent_registration_api import RegistrationHandler
+from agent_status_api import StatusHandler
+from capability_registry import CapabilityRegistry
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from registry_federation import Federation
+from test_support import issue_test_certificates, make_profile, make_discovery_request
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CHILD_STATUS_SERVER = """
+import sys
+import agent_status_api
+agent_status_api.run(port=int(sys.argv[1]))
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise AssertionError(f"nothing listening on port {port}")
+
+def serve(handler_class, **attributes):
+    attributes["log_message"] = lambda *args: None
+    server = ThreadingHTTPServer(("127.0.0.1", 0), type("Handler", (handler_class,), attributes))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    payload = response.read()
+    conn.close()
+    try:
+        payload = json.loads(payload)
+    except ValueError:
+        pass
+    return response.status, dict(response.getheaders()), payload
+
+def test_zone_matching():
+    federation = Federation({"anthropic": "http://a", "openai/translator": {"status": "http://b"}})
+    assert federation.upstream("status", "anthropic", "anything") == ("anthropic", "http://a")
+    assert federation.upstream("status", "openai", "translator") == ("openai/translator", "http://b")
+    assert federation.upstream("discovery", "openai", "translator") == (None, None)
+    assert federation.upstream("status", "openai", "summarizer") == (None, None)
+    assert federation.upstream("status", None) == (None, None)
+    for bad in [{"": "http://a"}, {"a/b/c": "http://a"}, {"a": {"dns": "http://a"}}]:
+        try:
+            Federation(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {bad!r}")
+
+def test_cache_lifetime_follows_cache_control():
+    federation = Federation({}, ttl=30)
+    lifetimes = [federation._ttl(SimpleNamespace(headers=headers)) for headers in (
+        {}, {"Cache-Control": "max-age=7"}, {"Cache-Control": "no-store"}, {"Cache-Control": "private, no-store"})]
+    assert lifetimes == [30, 7, 0, 0]
+    federation._store("key", "value", None, 30)
+    federation._store("key", "newer", None, 0)
+    assert federation._cached("key") == (False, None, None)
+
+def test_status_lookups_are_delegated_and_cached():
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        child_db = os.path.join(tmpdir, "child.db")
+        child_port = free_port()
+        child = None
+        parent = None
+        try:
+            db.DB_SHARDS = 1
+            db.DB_PATH = child_db
+            db.insert_registration({"agentName": "RemoteAgent", "providerName": "anthropic", "agentCategory": "assistant"})
+            db.DB_PATH = os.path.join(tmpdir, "parent.db")
+            db.insert_registration({"agentName": "LocalAgent", "providerName": "openai", "agentCategory": "translator"})
+            child = subprocess.Popen([sys.executable, "-c", CHILD_STATUS_SERVER, str(child_port)], cwd=REPO_DIR,
+                                     env=dict(os.environ, AGENT_DB_PATH=child_db),
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wait_for_port(child_port)
+            federation = Federation({"anthropic": {"status": f"http://127.0.0.1:{child_port}"}}, ttl=60)
+            parent = serve(StatusHandler, federation=federation)
+            port = parent.server_port
+
+            status, _, body = request(port, "GET", "/status?agentName=LocalAgent&providerName=openai&agentCategory=translator")
+            assert (status, body["status"]) == (200, "active")
+            status, headers, body = request(port, "GET", "/status?agentName=RemoteAgent&providerName=anthropic&agentCategory=assistant")
+            assert (status, body["status"], headers["X-Agent-DNS-Zone"]) == (200, "active", "anthropic")
+            # The parent's own database does not know the delegated agent
+            assert db.get_agent_status("RemoteAgent") is None
+            status, _, _ = request(port, "GET", "/status?agentName=Nobody&providerName=anthropic")
+            assert status == 404
+            status, _, body = request(port, "POST", "/status/batch", {"agents": [
+                {"agentName": "LocalAgent", "providerName": "openai", "agentCategory": "translator"},
+                {"agentName": "RemoteAgent", "providerName": "anthropic", "agentCategory": "assistant"},
+            ]})
+            assert [r["status"] for r in body["results"]] == ["active", "active"]
+
+            # With the child gone, cached delegated answers are still served until they expire
+            child.terminate()
+            child.wait()
+            status, _, body = request(port, "GET", "/status?agentName=RemoteAgent&providerName=anthropic&agentCategory=assistant")
+            assert (status, body["status"]) == (200, "active")
+            status, _, _ = request(port, "GET", "/status?agentName=Other&providerName=anthropic")
+            assert status == 502
+        finally:
+            if child is not None and child.poll() is None:
+                child.terminate()
+                child.wait()
+            if parent is not None:
+                parent.shutdown()
+                parent.server_close()
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_delegation_loop_is_cut():
+    server = serve(StatusHandler)
+    try:
+        server.RequestHandlerClass.federation = Federation({"loop": f"http://127.0.0.1:{server.server_port}"})
+        status, _, body = request(server.server_port, "GET", "/status?agentName=A&providerName=loop")
+        assert status == 508
+        assert "loop" in body["errorMessage"].lower()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_writes_are_referred_and_discovery_forwarded():
+    referrer = serve(RegistrationHandler, federation=Federation({"anthropic": "http://127.0.0.1:9"}))
+    try:
+        status, headers, _ = request(referrer.server_port, "POST", "/register",
+                                     {"requestType": "registration", "requestingAgent": {"agentName": "A", "providerName": "anthropic"}})
+        assert status == 307
+        assert headers["Location"] == "http://127.0.0.1:9/register"
+    finally:
+        referrer.shutdown()
+        referrer.server_close()
+
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    child_registry = CapabilityRegistry()
+    remote = make_profile("RemoteTranslator", "DocumentTranslation", cert_pem)
+    remote["providerName"] = "anthropic"
+    child_registry[remote["agentDID"]] = remote
+    child = serve(DiscoveryHandler, tool=tool, registry=child_registry, replica=None, federation=None)
+    parent = serve(DiscoveryHandler, tool=tool, registry=CapabilityRegistry(), replica=None,
+                   federation=Federation({"anthropic": {"discovery": f"http://127.0.0.1:{child.server_port}"}}))
+    try:
+        scoped = make_discovery_request("DocumentTranslation", cert_pem, providerName="anthropic")
+        status, headers, body = request(parent.server_port, "POST", "/discover", scoped)
+        assert status == 200 and body["respondingAgent"]["agentName"] == "RemoteTranslator"
+        assert headers["X-Agent-DNS-Zone"] == "anthropic"
+        status, _, _ = request(parent.server_port, "POST", "/discover", make_discovery_request("DocumentTranslation", cert_pem))
+        assert status == 404
+        # A load-aware pick is marked no-store upstream: passed on, and never cached by the parent
+        picked = make_discovery_request("DocumentTranslation", cert_pem, providerName="anthropic", selection="p2c")
+        status, headers, body = request(parent.server_port, "POST", "/discover", picked)
+        assert status == 200 and headers["Cache-Control"] == "no-store"
+        del child_registry[remote["agentDID"]]
+        assert request(parent.server_port, "POST", "/discover", picked)[0] == 404
+        # The deterministic answer was cached and is still served
+        status, _, body = request(parent.server_port, "POST", "/discover", scoped)
+        assert status == 200 and body["respondingAgent"]["agentName"] == "RemoteTranslator"
+    finally:
+        for server in (child, parent):
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    test_zone_matching()
+    test_cache_lifetime_follows_cache_control()
+    test_status_lookups_are_delegated_and_cached()
+    test_delegation_loop_is_cut()
+    test_writes_are_referred_and_discovery_forwarded()
+    print("All federation tests passed.")
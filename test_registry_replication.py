@@ -0,0 +1,209 @@
+"""
+test_registry_replication.py
+Primary/replica log shipping on one machine: the primary writes through
+agent_registration_db in this process, replicas run as separate processes with
+their own local SQLite copies.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+import requests
+import agent_discovery_api
+import agent_registration_db as db
+from agent_status_api import StatusHandler
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from registry_replication import ChangeLog, DatabaseCheckpoint, DB_APPLIERS, Replica, read_entries
+from test_support import issue_test_certificates, make_discovery_request, make_profile, row_count, temp_db
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REPLICA_READ = """
+import agent_registration_db
+print(agent_registration_db.get_agent_status("ReplicatedAgent"))
+"""
+
+def replica_status(tmpdir, name, log_path):
+    env = dict(os.environ,
+               AGENT_REGISTRY_ROLE="replica",
+               AGENT_CHANGE_LOG=log_path,
+               AGENT_DB_PATH=os.path.join(tmpdir, name))
+    out = subprocess.run([sys.executable, "-c", REPLICA_READ], cwd=REPO_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return out.strip().splitlines()[-1]
+
+def test_change_log_offsets():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+        first = log.append("insert", {"agentName": "A"})
+        second = log.append("deactivate", {"agentName": "A"})
+        log.close()
+        assert first == 0 and second > first
+        entries = list(read_entries(log.path, 0))
+        assert [e["op"] for e, _ in entries] == ["insert", "deactivate"]
+        assert entries[0][1] == second
+        # A partial trailing line is not consumed
+        with open(log.path, "ab") as f:
+            f.write(b'{"op": "ins')
+        assert len(list(read_entries(log.path, 0))) == 2
+
+def test_replica_processes_follow_primary():
+    saved = db.DB_PATH, db.REGISTRY_ROLE, db.CHANGE_LOG_PATH, db._change_log
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log_path = os.path.join(tmpdir, "registry.changelog")
+        try:
+            db.DB_PATH = os.path.join(tmpdir, "primary.db")
+            db.REGISTRY_ROLE = "primary"
+            db.CHANGE_LOG_PATH = log_path
+            db._change_log = None
+            db.insert_registration({"agentName": "ReplicatedAgent", "providerName": "openai", "agentCategory": "translator"})
+            assert replica_status(tmpdir, "replica1.db", log_path) == "active"
+            db.deactivate_agent("ReplicatedAgent")
+            # A new replica replays the whole log; an existing one resumes from its offset
+            assert replica_status(tmpdir, "replica2.db", log_path) == "inactive"
+            assert replica_status(tmpdir, "replica1.db", log_path) == "inactive"
+        finally:
+            if db._change_log is not None:
+                db._change_log.close()
+            db.DB_PATH, db.REGISTRY_ROLE, db.CHANGE_LOG_PATH, db._change_log = saved
+
+def test_replica_skips_ops_without_applier():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+        log.append("insert", {"agentName": "A"})
+        log.append("advertise", {"agentDID": "did:example:a"})
+        log.close()
+        seen = []
+        replica = Replica(log.path, {"advertise": seen.append})
+        assert replica.catch_up() == 1
+        assert seen == [{"agentDID": "did:example:a"}]
+        assert replica.catch_up() == 0
+
+def test_replica_resumes_without_duplicates():
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "replica.db"), 2
+            log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+            for name, provider in (("A", "openai"), ("B", "google"), ("C", "anthropic")):
+                log.append("insert", {"agentName": name, "providerName": provider, "agentCategory": "translator"})
+            log.append("deactivate", {"agentName": "B", "providerName": "google", "agentCategory": "translator"})
+            log.close()
+            # A replica dies after applying two entries, before its pass finished
+            for entry, next_offset in list(read_entries(log.path, 0))[:2]:
+                DB_APPLIERS[entry["op"]](entry["data"], next_offset)
+            replica = Replica(log.path, DB_APPLIERS, checkpoint=DatabaseCheckpoint())
+            replica.catch_up()
+            assert [row_count(name) for name in ("A", "B", "C")] == [1, 1, 1]
+            assert db.get_agent_status("B") == "inactive"
+            # Every shard has moved past the whole log, so a restart has nothing to read
+            assert db.change_log_offset() == os.path.getsize(log.path)
+            assert Replica(log.path, DB_APPLIERS, checkpoint=DatabaseCheckpoint()).offset == os.path.getsize(log.path)
+        finally:
+            db.DB_PATH, db.DB_SHARDS = saved
+
+def test_failed_insert_is_retried_not_skipped():
+    saved = db._connect
+    with temp_db(2) as tmpdir:
+        try:
+            log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+            log.append("insert", {"agentName": "A", "providerName": "openai", "agentCategory": "translator"})
+            log.append("insert", {"agentName": "B", "providerName": "google", "agentCategory": "translator"})
+            log.close()
+            first_end = next(read_entries(log.path, 0))[1]
+            replica = Replica(log.path, DB_APPLIERS, checkpoint=DatabaseCheckpoint())
+
+            def locked(path):
+                conn = saved(path)
+                if path == db.shard_for("google", "translator"):
+                    conn.close()
+                    raise db.sqlite3.OperationalError("database is locked")
+                return conn
+
+            db._connect = locked
+            try:
+                replica.catch_up()
+            except db.sqlite3.OperationalError:
+                pass
+            else:
+                raise AssertionError("Expected the failed insert to raise")
+            db._connect = saved
+            # The pass stopped before B, and no shard moved past it
+            assert replica.offset == first_end and row_count("A") == 1
+            assert db.change_log_offset() < os.path.getsize(log.path)
+            assert replica.catch_up() == 1 and row_count("B") == 1
+            assert db.change_log_offset() == os.path.getsize(log.path)
+        finally:
+            db._connect = saved
+
+def test_replica_syncs_before_not_modified():
+    saved = db.DB_PATH, db.REGISTRY_ROLE, db.CHANGE_LOG_PATH, db.REPLICA_MAX_STALENESS, db._replica
+    handler = type("Handler", (StatusHandler,), {"log_message": lambda *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/status?agentName=A"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+            log.append("insert", {"agentName": "A", "providerName": "openai", "agentCategory": "translator"})
+            db.DB_PATH, db.REGISTRY_ROLE, db.CHANGE_LOG_PATH = os.path.join(tmpdir, "replica.db"), "replica", log.path
+            db.REPLICA_MAX_STALENESS, db._replica = 0, None
+            first = requests.get(url)
+            assert first.json()["status"] == "active"
+            log.append("deactivate", {"agentName": "A"})
+            log.close()
+            # The cached version is still fresh, but the replica must catch up first
+            second = requests.get(url, headers={"If-None-Match": first.headers["ETag"]})
+            assert second.status_code == 200 and second.json()["status"] == "inactive"
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.REGISTRY_ROLE, db.CHANGE_LOG_PATH, db.REPLICA_MAX_STALENESS, db._replica = saved
+
+def test_discovery_replica_applies_bulk_deactivation():
+    saved = db.REPLICA_MAX_STALENESS
+    ca_path, cert_pem = issue_test_certificates()
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = agent_discovery_api.AGENT_REGISTRY
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log = ChangeLog(os.path.join(tmpdir, "registry.changelog"))
+        profiles = [make_profile("ReplicaA", "DocumentTranslation", cert_pem), make_profile("ReplicaB", "DocumentTranslation", cert_pem)]
+        profiles[1]["providerName"] = "google"
+        for profile in profiles:
+            log.append("advertise", profile)
+        # The same handler setup as a discovery process started with AGENT_REGISTRY_ROLE=replica
+        handler = type("Handler", (agent_discovery_api.DiscoveryHandler,), {
+            "tool": tool, "replica": Replica(log.path, agent_discovery_api.REPLICA_APPLIERS), "log_message": lambda *args: None})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/discover"
+        try:
+            db.REPLICA_MAX_STALENESS = 0
+            request = make_discovery_request("DocumentTranslation", cert_pem, selection="first")
+            first = requests.post(url, json=request)
+            assert first.status_code == 200 and first.json()["respondingAgent"]["agentName"] == "ReplicaA"
+            assert requests.post(url.replace("/discover", "/advertise"), json=profiles[0]).status_code == 403
+            log.append("deactivate_bulk", {"providerName": "openai", "agentCategory": "translator", "version": None})
+            # The replica applies the bulk deactivation before it compares ETags
+            second = requests.post(url, json=request, headers={"If-None-Match": first.headers["ETag"]})
+            assert second.status_code == 200 and second.json()["respondingAgent"]["agentName"] == "ReplicaB"
+            assert [profile["agentName"] for profile in registry.values()] == ["ReplicaB"]
+        finally:
+            log.close()
+            server.shutdown()
+            server.server_close()
+            db.REPLICA_MAX_STALENESS = saved
+            for did in list(registry):
+                del registry[did]
+
+if __name__ == "__main__":
+    test_change_log_offsets()
+    test_replica_processes_follow_primary()
+    test_replica_skips_ops_without_applier()
+    test_replica_resumes_without_duplicates()
+    test_failed_insert_is_retried_not_skipped()
+    test_replica_syncs_before_not_modified()
+    test_discovery_replica_applies_bulk_deactivation()
+    print("Replication tests passed.")
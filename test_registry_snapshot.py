@@ -0,0 +1,69 @@
+"""
+test_registry_snapshot.py
+Round trip of the registry through a columnar snapshot file: export from one set
+of shards, read it in place, import it into a differently sharded database.
+"""
+import os
+import tempfile
+import agent_registration_db as db
+from registry_snapshot import RegistrySnapshot, SnapshotError, export_snapshot, import_snapshot, write_snapshot
+from test_support import make_agent, temp_db
+
+def make_snapshot_agent(name, provider, capability):
+    return make_agent(name, provider, agentCapability=capability, certificate={"subject": f"CN={name}"},
+                      a2aAgentCard={"name": name, "skills": ["translate"]})
+
+def test_export_read_in_place_and_import():
+    with temp_db() as tmpdir:
+        snapshot_path = os.path.join(tmpdir, "registry.snap")
+        db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "source.db"), 3
+        providers = ["openai", "anthropic", "google"]
+        for i in range(30):
+            capability = "DocumentTranslation" if i % 3 else "Summarization"
+            db.insert_registration(make_snapshot_agent(f"Agent{i:02d}", providers[i % 3], capability))
+        db.deactivate_agent("Agent05")
+        assert export_snapshot(snapshot_path) == 30
+
+        with RegistrySnapshot(snapshot_path) as snapshot:
+            assert len(snapshot) == 30
+            assert snapshot.capabilities() == ["DocumentTranslation", "Summarization"]
+            # Repeated values are interned: far fewer strings than cells
+            assert snapshot.metadata["strings"] < 30 * len(snapshot.columns) / 2
+            summarizers = snapshot.agents_for("Summarization")
+            assert [row["agentName"] for row in summarizers] == [f"Agent{i:02d}" for i in range(0, 30, 3)]
+            assert snapshot.agents_for("Unknown") == []
+            row = next(r for r in snapshot if r["agentName"] == "Agent05")
+            assert row["agentStatus"] == "inactive"
+            assert row["a2aAgentCard"] == {"name": "Agent05", "skills": ["translate"]}
+            assert row["csrPEM"] is None
+            assert dict(row)["certificate"] == {"subject": "CN=Agent05"}
+
+        db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "target.db"), 2
+        db.insert_registration(make_snapshot_agent("Stale", "openai", "Summarization"))
+        assert import_snapshot(snapshot_path) == 30
+        assert db.get_agent_status("Stale") is None
+        assert db.get_agent_status("Agent05") == "inactive"
+        assert db.get_agent_statuses([("Agent01", "anthropic", "translator"), ("Agent02", None, None)]) == {
+            ("Agent01", "anthropic", "translator"): "active", ("Agent02", None, None): "active"}
+        assert len(db.scan_registrations("agentName")) == 30
+
+def test_rejects_other_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "not-a.snap")
+        with open(path, "wb") as f:
+            f.write(b"SQLite format 3\0" + b"\0" * 64)
+        try:
+            RegistrySnapshot(path)
+        except SnapshotError:
+            pass
+        else:
+            raise AssertionError("opened a non-snapshot file")
+        empty = os.path.join(tmpdir, "empty.snap")
+        assert write_snapshot(empty, []) == 0
+        with RegistrySnapshot(empty) as snapshot:
+            assert len(snapshot) == 0 and snapshot.capabilities() == []
+
+if __name__ == "__main__":
+    test_export_read_in_place_and_import()
+    test_rejects_other_files()
+    print("Snapshot tests passed.")
@@ -0,0 +1,130 @@
+"""
+test_registry_versions.py
+Tests for the in-memory version map behind ETag / If-None-Match handling.
+"""
+import datetime
+import http.client
+import json
+import threading
+import time
+from http.server import HTTPServer
+from registry_versions import VersionMap, etag_matches
+from capability_registry import CapabilityRegistry
+from agent_discovery_api import DiscoveryHandler
+from discovery_tool import AgentDiscoveryTool, AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE
+from test_support import issue_test_certificates, make_discovery_request, make_profile
+
+def test_observe_only_advances_on_change():
+    versions = VersionMap(ttl=60)
+    etag1, _ = versions.observe("TestAgent", "active")
+    etag2, _ = versions.observe("TestAgent", "active")
+    assert etag1 == etag2
+    etag3, _ = versions.observe("TestAgent", "inactive")
+    assert etag3 != etag1
+    assert versions.current("TestAgent")[0] == etag3
+
+def test_invalidate_and_ttl():
+    versions = VersionMap(ttl=0.05)
+    versions.observe("TestAgent", "active")
+    versions.invalidate("TestAgent")
+    assert versions.current("TestAgent") is None
+    versions.observe("TestAgent", "active")
+    assert versions.current("TestAgent") is not None
+    time.sleep(0.1)
+    assert versions.current("TestAgent") is None
+
+def test_etags_differ_across_epochs():
+    first = VersionMap()
+    time.sleep(0.002)
+    second = VersionMap()
+    assert first.observe("TestAgent", "active")[0] != second.observe("TestAgent", "active")[0]
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", "abc"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"xyz"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+def test_capability_registry_versions():
+    registry = CapabilityRegistry()
+    etag_empty, _ = registry.result_etag("DocumentTranslation", {"languagePair": "en-fr"})
+    registry["did:example:a"] = {"agentDID": "did:example:a", "agentCapability": "DocumentTranslation"}
+    etag_one, _ = registry.result_etag("DocumentTranslation", {"languagePair": "en-fr"})
+    assert etag_one != etag_empty
+    # Other capabilities and other queries are versioned independently
+    other, _ = registry.result_etag("OCR")
+    registry["did:example:b"] = {"agentDID": "did:example:b", "agentCapability": "OCR"}
+    assert registry.result_etag("DocumentTranslation", {"languagePair": "en-fr"})[0] == etag_one
+    assert registry.result_etag("OCR")[0] != other
+    assert registry.result_etag("DocumentTranslation", {"languagePair": "en-de"})[0] != etag_one
+    assert [a["agentDID"] for a in registry.agents_for("DocumentTranslation")] == ["did:example:a"]
+    del registry["did:example:a"]
+    assert registry.agents_for("DocumentTranslation") == []
+    assert registry.result_etag("DocumentTranslation", {"languagePair": "en-fr"})[0] != etag_one
+
+def test_capability_registry_remove_matching():
+    registry = CapabilityRegistry()
+    for i, (provider, version) in enumerate([("openai", "1.0"), ("openai", "2.0"), ("openai", "1.0"), ("google", "1.0")]):
+        registry[f"did:example:{i}"] = {"agentDID": f"did:example:{i}", "agentCapability": "OCR",
+                                        "providerName": provider, "agentCategory": "reader", "version": version}
+    before = registry.versions.version("OCR")[0]
+    assert registry.remove_matching("openai", "reader", "1.0") == ["did:example:0", "did:example:2"]
+    # One bump of "OCR" and one of ALL_CAPABILITIES for the whole batch
+    assert registry.versions.version("OCR")[0] == before + 2
+    assert registry.remove_matching("openai", "writer") == []
+    assert registry.remove_matching("openai") == ["did:example:1"]
+    assert [a["agentDID"] for a in registry.agents_for("OCR")] == ["did:example:3"]
+
+def test_discovery_etag_covers_validation_and_certificate_expiry():
+    ca_path, cert_pem = issue_test_certificates(lifetime=datetime.timedelta(seconds=2))
+    tool = AgentDiscoveryTool(AGENT_CAPABILITY_REQUEST_SCHEMA_FILE, AGENT_CAPABILITY_RESPONSE_SCHEMA_FILE, ca_cert_path=ca_path)
+    registry = CapabilityRegistry()
+    profile = make_profile("TranslatorB", "DocumentTranslation", cert_pem)
+    registry[profile["agentDID"]] = profile
+    handler = type("Handler", (DiscoveryHandler,), {"tool": tool, "registry": registry, "replica": None,
+                                                    "log_message": lambda *args: None})
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def discover(request, if_none_match=None):
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        headers = {"Content-Type": "application/json"}
+        if if_none_match:
+            headers["If-None-Match"] = if_none_match
+        conn.request("POST", "/discover", body=json.dumps(request), headers=headers)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return response.status, response.getheader("ETag")
+
+    try:
+        # Default discovery (first match, no load-aware selection) is cacheable
+        request = make_discovery_request("DocumentTranslation", cert_pem)
+        status, etag = discover(request)
+        assert status == 200 and etag is not None
+        assert discover(request, etag) == (304, etag)
+        # An opt-in load-aware pick is not
+        assert discover(dict(request, queryParameters={"selection": "p2c"})) == (200, None)
+        # An invalid request is rejected, never answered as "not modified"
+        invalid = dict(request, requestingAgent={"agentCapability": "DocumentTranslation"})
+        assert discover(invalid, "*")[0] == 400
+        # Once the matched agent's certificate expires the cached result is stale
+        time.sleep(max(0, registry._edges["DocumentTranslation"][-1] - time.time()) + 1)
+        assert discover(request, etag)[0] == 404
+        del registry[profile["agentDID"]]
+        assert registry._edges == {}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_observe_only_advances_on_change()
+    test_invalidate_and_ttl()
+    test_etags_differ_across_epochs()
+    test_etag_matches()
+    test_capability_registry_versions()
+    test_capability_registry_remove_matching()
+    test_discovery_etag_covers_validation_and_certificate_expiry()
+    print("Registry version tests passed.")
@@ -0,0 +1,106 @@
+"""
+test_request_profiler.py
+Tests for the sampling profiler, the slow-request ring buffer and the admin endpoints.
+"""
+import os
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import requests
+import agent_registration_db as db
+import api_common
+import request_profiler
+from agent_status_api import StatusHandler
+from request_profiler import SlowRequestLog, folded, sample_stacks, stage
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_slow_request_ring_buffer():
+    with stage("outside"):
+        pass  # no request on this thread: a no-op
+    log = SlowRequestLog(threshold_ms=5, capacity=2)
+    assert log.end(log.begin(), "GET", "/fast", 200) is None
+    for i in range(3):
+        timer = log.begin()
+        with stage("db"):
+            time.sleep(0.01)
+        log.end(timer, "GET", f"/slow/{i}", 200)
+    entries = log.entries()
+    assert [e["path"] for e in entries] == ["/slow/2", "/slow/1"]
+    assert entries[0]["stages"][0]["stage"] == "db" and entries[0]["stages"][0]["durationMs"] >= 5
+    assert log.entries(limit=1) == entries[:1]
+
+def test_sample_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), daemon=True)
+    worker.start()
+    try:
+        counts, samples = sample_stacks(0.2, interval=0.002)
+    finally:
+        stop.set()
+        worker.join()
+    assert samples > 10
+    lines = folded(counts).splitlines()
+    busy = [line for line in lines if "busy_loop (test_request_profiler.py:" in line]
+    assert busy and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    # Frames are root first
+    assert busy[0].split(";")[0].startswith("_bootstrap ")
+
+def wait_for_entry(matches, timeout=2.0):
+    # A request is recorded after its response has been flushed, so the client can
+    # see the response first
+    deadline = time.time() + timeout
+    while True:
+        entry = next((entry for entry in request_profiler.SLOW_REQUESTS.entries() if matches(entry)), None)
+        if entry is not None or time.time() > deadline:
+            return entry
+        time.sleep(0.01)
+
+def test_admin_endpoints():
+    saved = db.DB_PATH, db.DB_SHARDS, api_common.ADMIN_TOKEN, request_profiler.SLOW_REQUESTS.threshold_ms
+    handler = type("Handler", (StatusHandler,), {"log_message": lambda *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    admin = {"Authorization": "Bearer s3cret"}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 1
+            db.insert_registration({"agentName": "A", "providerName": "openai", "agentCategory": "translator"})
+            api_common.ADMIN_TOKEN = None
+            assert requests.get(base + "/admin/slow-requests", headers=admin).status_code == 404
+            api_common.ADMIN_TOKEN = "s3cret"
+            assert requests.get(base + "/admin/slow-requests").status_code == 401
+            assert requests.get(base + "/admin/slow-requests", headers={"Authorization": "Bearer nope"}).status_code == 401
+            assert requests.get(base + "/admin/profile?seconds=1000", headers=admin).status_code == 400
+            request_profiler.SLOW_REQUESTS.threshold_ms = 0
+            assert requests.post(base + "/status/batch", json={"agents": [{"agentName": "A"}]}).status_code == 200
+            assert wait_for_entry(lambda entry: entry["path"] == "/status/batch") is not None
+            response = requests.get(base + "/admin/slow-requests?limit=5", headers=admin)
+            assert response.status_code == 200
+            slow = response.json()["requests"]
+            batch = next(entry for entry in slow if entry["path"] == "/status/batch")
+            assert {"read_body", "db.status_batch", "respond"} <= {s["stage"] for s in batch["stages"]}
+            # Idle time on a keep-alive connection before the request line is not counted
+            with requests.Session() as session:
+                assert session.get(base + "/status", params={"agentName": "A"}).status_code == 200
+                time.sleep(0.3)
+                assert session.get(base + "/status", params={"agentName": "A", "again": "1"}).status_code == 200
+            again = wait_for_entry(lambda entry: entry["path"].endswith("again=1"))
+            assert again["totalMs"] < 250
+            response = requests.get(base + "/admin/profile?seconds=0.2", headers=admin)
+            assert response.status_code == 200 and int(response.headers["X-Profile-Samples"]) > 0
+            assert "serve_forever (socketserver.py:" in response.text
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS, api_common.ADMIN_TOKEN, request_profiler.SLOW_REQUESTS.threshold_ms = saved
+
+if __name__ == "__main__":
+    test_slow_request_ring_buffer()
+    test_sample_stacks()
+    test_admin_endpoints()
+    print("Request profiler tests passed.")
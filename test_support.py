@@ -0,0 +1,169 @@
+"""
+test_support.py
+Shared helpers for the offline tests: a throwaway CA and agent certificate (the
+checked-in agent.pem has a fixed validity window), registration and discovery
+payload builders, and a temporary registry database.
+"""
+import datetime
+import os
+import tempfile
+from contextlib import contextmanager
+
+def issue_test_certificates(directory=None, lifetime=None):
+    """
+    Create a CA and an agent certificate signed by it, valid from yesterday until
+    lifetime (a timedelta, default a year) from now. Writes the CA to
+    <directory>/ca.pem and returns (ca_path, agent_pem).
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    directory = directory or tempfile.mkdtemp()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Test Root CA")])
+    ca_cert = (x509.CertificateBuilder().subject_name(ca_name).issuer_name(ca_name)
+               .public_key(ca_key.public_key()).serial_number(x509.random_serial_number())
+               .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=365))
+               .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+               .sign(ca_key, hashes.SHA256()))
+    agent_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    agent_cert = (x509.CertificateBuilder()
+                  .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "TranslatorB")]))
+                  .issuer_name(ca_name).public_key(agent_key.public_key()).serial_number(x509.random_serial_number())
+                  .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + (lifetime or datetime.timedelta(days=365)))
+                  .sign(ca_key, hashes.SHA256()))
+    ca_path = os.path.join(directory, "ca.pem")
+    with open(ca_path, "wb") as f:
+        f.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+    return ca_path, agent_cert.public_bytes(serialization.Encoding.PEM).decode()
+
+def issue_tls_certificates(directory=None):
+    """
+    Create a CA, a server certificate for localhost/127.0.0.1 and a client
+    certificate, with their keys, as PEM files in directory. Returns a dict of paths:
+    ca, server_cert, server_key, client_cert, client_key.
+    """
+    import ipaddress
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+    directory = directory or tempfile.mkdtemp()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ca_key = ec.generate_private_key(ec.SECP256R1())
+    ca_name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Test Registry CA")])
+    ca_cert = (x509.CertificateBuilder().subject_name(ca_name).issuer_name(ca_name)
+               .public_key(ca_key.public_key()).serial_number(x509.random_serial_number())
+               .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=365))
+               .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+               .sign(ca_key, hashes.SHA256()))
+    paths = {"ca": os.path.join(directory, "tls-ca.pem")}
+    with open(paths["ca"], "wb") as f:
+        f.write(ca_cert.public_bytes(serialization.Encoding.PEM))
+    leaves = {
+        "server": ("localhost", ExtendedKeyUsageOID.SERVER_AUTH,
+                   [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+        "client": ("TranslatorB", ExtendedKeyUsageOID.CLIENT_AUTH, None),
+    }
+    for role, (common_name, usage, alt_names) in leaves.items():
+        key = ec.generate_private_key(ec.SECP256R1())
+        builder = (x509.CertificateBuilder()
+                   .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)]))
+                   .issuer_name(ca_name).public_key(key.public_key()).serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=365))
+                   .add_extension(x509.ExtendedKeyUsage([usage]), critical=False))
+        if alt_names:
+            builder = builder.add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        cert = builder.sign(ca_key, hashes.SHA256())
+        paths[f"{role}_cert"] = os.path.join(directory, f"{role}.pem")
+        paths[f"{role}_key"] = os.path.join(directory, f"{role}.key")
+        with open(paths[f"{role}_cert"], "wb") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        with open(paths[f"{role}_key"], "wb") as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                      serialization.NoEncryption()))
+    return paths
+
+def make_profile(name, capability, cert_pem, description="", card_capabilities=None, **additional):
+    """An advertised agent profile as stored by handle_advertisement()."""
+    return {
+        "protocol": "a2a",
+        "agentName": name,
+        "agentCategory": "translator",
+        "providerName": "openai",
+        "version": "1.0",
+        "agentUseJustification": "Test agent",
+        "agentCapability": capability,
+        "agentEndpoint": f"https://{name.lower()}.example.com",
+        "agentDID": f"did:example:{name.lower()}",
+        "certificate": {
+            "certificateSubject": f"CN={name}",
+            "certificateIssuer": "CN=Test Root CA",
+            "certificateSerialNumber": "1",
+            "certificateValidFrom": "2025-01-01T00:00:00Z",
+            "certificateValidTo": "2026-01-01T00:00:00Z",
+            "certificatePEM": cert_pem,
+            "certificatePublicKeyAlgorithm": "RSA",
+            "certificateSignatureAlgorithm": "SHA256withRSA"
+        },
+        "a2aAgentCard": {
+            "agentName": name,
+            "description": description,
+            "capabilities": card_capabilities or [capability],
+            "endpoints": [{"protocol": "HTTP", "url": f"https://{name.lower()}.example.com/a2a"}]
+        },
+        "additionalCapabilities": additional,
+    }
+
+def make_discovery_request(capability, cert_pem, **query):
+    requester = make_profile("DocProcA", capability, cert_pem)
+    del requester["additionalCapabilities"]
+    return {"requestType": "discovery", "requestingAgent": requester, "queryParameters": query}
+
+def make_agent(name, provider="openai", category="translator", version="1.0", **fields):
+    """A registration as insert_registration() stores it; fields add or override columns."""
+    agent = {
+        "protocol": "a2a",
+        "agentName": name,
+        "agentCategory": category,
+        "providerName": provider,
+        "version": version,
+        "agentCapability": "DocumentTranslation",
+        "agentDID": f"did:example:{name}",
+        "registrationTimestamp": "2025-04-20T11:03:00Z",
+    }
+    agent.update(fields)
+    return agent
+
+@contextmanager
+def temp_db(shards=1):
+    """
+    Point agent_registration_db at `shards` fresh shards in a temporary directory
+    for the block and restore the previous DB_PATH and DB_SHARDS afterwards. The
+    name filter is dropped on the way in and out, so no test sees names another
+    test registered. Yields the directory.
+    """
+    import agent_registration_db as db
+    saved = db.DB_PATH, db.DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), shards
+            db._name_filter, db._name_filter_marks = None, {}
+            yield tmpdir
+        finally:
+            db.DB_PATH, db.DB_SHARDS = saved
+            db._name_filter, db._name_filter_marks = None, {}
+
+def row_count(name):
+    """Rows for agentName across all shards, whatever their status."""
+    import agent_registration_db as db
+    count = 0
+    for path in db.shard_paths():
+        conn = db._connect(path)
+        try:
+            count += conn.execute("SELECT COUNT(*) FROM agent_registrations WHERE agentName=?", (name,)).fetchone()[0]
+        finally:
+            conn.close()
+    return count
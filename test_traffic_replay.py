@@ -0,0 +1,95 @@
+"""
+test_traffic_replay.py
+Recording sampled, anonymized traces from a live in-process handler and replaying them.
+"""
+import os
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+import requests
+import agent_registration_db as db
+import traffic_recorder
+from agent_status_api import StatusHandler
+from traffic_recorder import TrafficRecorder, read_trace
+from traffic_replay import load_trace, percentile, replay, summarize
+
+def test_anonymization_is_stable_and_keyed():
+    recorder = TrafficRecorder(None, key="secret")
+    body = {"agentName": "TranslatorB", "agentCapability": "DocumentTranslation",
+            "agentDID": "did:example:translatorb", "agentEndpoint": "https://translatorb.example.com",
+            "certificate": {"certificatePEM": "-----BEGIN CERTIFICATE-----"}, "agents": [{"agentName": "TranslatorB"}]}
+    anonymized = recorder.anonymize(body)
+    assert anonymized["agentName"] == anonymized["agents"][0]["agentName"] != "TranslatorB"
+    assert anonymized["agentCapability"] == "DocumentTranslation"
+    assert anonymized["agentDID"].startswith("did:anon:")
+    assert anonymized["agentEndpoint"].startswith("https://") and "translatorb" not in anonymized["agentEndpoint"]
+    assert anonymized["certificate"]["certificatePEM"] == "x" * len(body["certificate"]["certificatePEM"])
+    assert TrafficRecorder(None, key="other").anonymize(body)["agentName"] != anonymized["agentName"]
+    path = recorder.anonymize_path("/status?agentName=TranslatorB&protocol=a2a")
+    assert path == f"/status?agentName={anonymized['agentName']}&protocol=a2a"
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99.9) == 100
+    assert percentile([7], 90) == 7
+    assert percentile([], 50) is None
+
+def test_record_and_replay():
+    saved = db.DB_PATH, db.DB_SHARDS, traffic_recorder.TRAFFIC_RECORDER
+    handler = type("Handler", (StatusHandler,), {"log_message": lambda *args: None})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        try:
+            db.DB_PATH, db.DB_SHARDS = os.path.join(tmpdir, "agent_registration.db"), 1
+            db.insert_registration({"agentName": "HotAgent", "providerName": "openai", "agentCategory": "translator"})
+            trace_path = os.path.join(tmpdir, "registry.trace")
+            recorder = TrafficRecorder(trace_path, sample=1.0, key="k")
+            traffic_recorder.TRAFFIC_RECORDER = recorder
+            with requests.Session() as session:
+                for _ in range(3):
+                    assert session.get(base + "/status", params={"agentName": "HotAgent"}).status_code == 200
+                assert session.post(base + "/status/batch", json={"agents": [{"agentName": "HotAgent"}]}).status_code == 200
+            traffic_recorder.TRAFFIC_RECORDER = None
+            recorder.close()
+            entries = list(read_trace(trace_path))
+            assert len(entries) == 4
+            assert len({entry[2] for entry in entries[:3]}) == 1
+            assert "HotAgent" not in open(trace_path).read()
+            assert entries[3][1:3] == ["POST", "/status/batch"] and entries[3][4] == 200
+            # Nothing is written when the sample rate is 0
+            quiet = TrafficRecorder(os.path.join(tmpdir, "quiet.trace"), sample=0.0, key="k")
+            assert not any(quiet.sampled() for _ in range(100))
+
+            routes = {"/status": base + "/status", "/status/batch": base + "/status/batch"}
+            results = replay(load_trace(trace_path), routes, speed=100, clients=2)
+            assert len(results) == 4
+            # The anonymized name is unknown to this registry, so statuses differ from the recording
+            summary = summarize(results, elapsed=1.0)
+            assert summary["all"]["requests"] == 4 and summary["/status"]["requests"] == 3
+            assert summary["/status"]["statuses"] == {"404": 3}
+            assert summary["/status"]["status_changed"] == 3
+            assert summary["all"]["response_ms"]["p50"] >= 0 and summary["all"]["rate"] == 4.0
+            # Registrations carry placeholder certificates: not sent, and kept out of the percentiles
+            registration = [entries[-1][0], "POST", "/register", {"requestingAgent": {"certificate": {"certificatePEM": "x" * 64}}}, 200]
+            routes["/register"] = base + "/register"
+            results = replay(load_trace(trace_path) + [registration], routes, speed=100, clients=2)
+            summary = summarize(results, elapsed=1.0)
+            assert summary["/register"]["requests"] == 0 and summary["/register"]["skipped"] == 1
+            assert summary["/register"]["response_ms"]["p50"] is None
+            assert summary["all"]["requests"] == 4 and summary["all"]["skipped"] == 1 and summary["all"]["rate"] == 4.0
+            # With a real certificate in their place they are replayed
+            results = replay([registration], routes, speed=100, clients=1, certificate_pem="-----BEGIN CERTIFICATE-----")
+            assert summarize(results)["/register"]["requests"] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+            db.DB_PATH, db.DB_SHARDS, traffic_recorder.TRAFFIC_RECORDER = saved
+
+if __name__ == "__main__":
+    test_anonymization_is_stable_and_keyed()
+    test_percentile()
+    test_record_and_replay()
+    print("Traffic replay tests passed.")
@@ -0,0 +1,122 @@
+"""
+traffic_recorder.py
+Sampled, anonymized request traces for capacity planning (replayed by traffic_replay.py).
+
+With AGENT_TRACE_LOG set, every server whose handler uses KeepAliveMixin appends
+a fraction AGENT_TRACE_SAMPLE (default 0.01) of its requests to that file, one
+compact JSON array per line:
+
+    [ts, method, path, body, status, elapsed_ms]
+
+Anonymization happens before anything is written:
+- Identifying strings (agent, provider and category names, DIDs, endpoints,
+  certificate subjects, ...) become a keyed HMAC token. One name always maps to
+  the same token under one AGENT_TRACE_KEY, so the skew toward hot agents
+  survives. Servers writing to one log need the same key for their tokens to agree.
+- Certificates, CSRs and free text are replaced by "x" runs of the same length,
+  so request sizes are kept but nothing of the content.
+- Capabilities, protocols, versions and query parameters are kept as they are;
+  they are the registry's vocabulary, not anyone's identity.
+
+Like the change log, the file is written with one O_APPEND write() per line, so
+several processes can share it.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+TRACE_LOG = os.environ.get("AGENT_TRACE_LOG")
+TRACE_SAMPLE = float(os.environ.get("AGENT_TRACE_SAMPLE", "0.01"))
+TRACE_KEY = os.environ.get("AGENT_TRACE_KEY")
+
+# Replaced by an HMAC token wherever they appear, in bodies and in query strings.
+ANONYMIZED_FIELDS = frozenset((
+    "agentName", "providerName", "agentCategory", "agentDID", "agentEndpoint", "agentDNSName", "agentPolicyId",
+    "url", "certificateSubject", "certificateIssuer", "certificateSerialNumber",
+))
+# Replaced by a run of "x" of the same length.
+REDACTED_FIELDS = frozenset((
+    "certificatePEM", "csrPEM", "agentUseJustification", "description", "clientSecret", "token",
+))
+
+
+class TrafficRecorder:
+    def __init__(self, path, sample=TRACE_SAMPLE, key=None):
+        if not 0 <= sample <= 1:
+            raise ValueError("sample must be between 0 and 1")
+        self.path = path
+        self.sample = sample
+        if key is None:
+            print("[traffic_recorder] AGENT_TRACE_KEY not set; tokens are only consistent within this process")
+            key = os.urandom(32)
+        self.key = key.encode("utf-8") if isinstance(key, str) else key
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def sampled(self):
+        return self.sample >= 1 or random.random() < self.sample
+
+    def token(self, value):
+        """The stable anonymous stand-in for one identifying string."""
+        digest = hmac.new(self.key, value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+        # Keep the shape of DIDs and URLs so the replayed requests still validate
+        if value.startswith("did:"):
+            return "did:anon:" + digest
+        if "://" in value:
+            return value.split("://", 1)[0] + "://" + digest + ".invalid"
+        return "t" + digest
+
+    def anonymize(self, value, field=None):
+        if isinstance(value, dict):
+            return {k: self.anonymize(v, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(v, field) for v in value]
+        if isinstance(value, str):
+            if field in ANONYMIZED_FIELDS:
+                return self.token(value)
+            if field in REDACTED_FIELDS:
+                return "x" * len(value)
+        return value
+
+    def anonymize_path(self, path):
+        parts = urlsplit(path)
+        if not parts.query:
+            return path
+        query = [(k, self.token(v) if k in ANONYMIZED_FIELDS else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+        return parts.path + "?" + urlencode(query)
+
+    def record(self, method, path, body, status, elapsed):
+        """Append one request (elapsed in seconds) to the trace log."""
+        entry = [round(time.time(), 6), method, self.anonymize_path(path), self.anonymize(body), status, round(elapsed * 1000, 3)]
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            # Tracing is best effort and never fails the request being traced
+            try:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                os.write(self._fd, line)
+            except OSError as e:
+                print(f"[traffic_recorder] Could not write trace: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def read_trace(path):
+    """Yield the trace entries in path as lists, skipping a partially written last line."""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                yield json.loads(line)
+
+
+# The process-wide recorder used by KeepAliveMixin; None when tracing is off.
+TRAFFIC_RECORDER = TrafficRecorder(TRACE_LOG, TRACE_SAMPLE, TRACE_KEY) if TRACE_LOG else None
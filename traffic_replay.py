@@ -0,0 +1,211 @@
+"""
+traffic_replay.py
+Load generator that replays a trace written by traffic_recorder.py against any
+registry build and reports latency distributions.
+
+Requests are sent on the trace's own schedule, compressed by --speed (10 = ten
+times faster), by --clients concurrent clients, each with its own keep-alive
+session. The load is open-loop: a request whose client is still busy goes out
+late, and that wait counts toward its response time. Two times are reported
+per endpoint:
+- response: from the moment the trace says the request was due until the answer
+  arrived, so a build that falls behind shows it
+- service: from sending the request until the answer arrived
+
+    python traffic_replay.py /tmp/registry.trace --speed 10 --clients 32
+    python traffic_replay.py /tmp/registry.trace --host staging.internal --certificate agent.pem --json
+
+Endpoints are routed to the default ports of agent_dns_client.DEFAULT_URLS;
+--url /discover=http://host:9000/discover overrides one route. Anonymized traces
+carry placeholder certificates, which the servers reject before doing any real
+work. Without --certificate to put in their place, requests to the routes that
+verify a body certificate (CERTIFICATE_ROUTES) are therefore not sent: they are
+reported as skipped instead of adding early rejections to the percentiles.
+"""
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+from agent_dns_client import DEFAULT_URLS
+from traffic_recorder import read_trace
+
+PERCENTILES = (50, 90, 99, 99.9)
+# Routes whose servers verify the certificatePEM in the request body.
+CERTIFICATE_ROUTES = frozenset(("/register", "/renew", "/advertise"))
+
+
+def default_routes(host=None):
+    """Request path -> URL, from the client's defaults, optionally on another host."""
+    routes = {}
+    for url in DEFAULT_URLS.values():
+        parts = urlsplit(url)
+        if host:
+            parts = parts._replace(netloc=f"{host}:{parts.port}" if parts.port else host)
+        routes[parts.path] = parts.geturl()
+    return routes
+
+
+def load_trace(path, limit=None):
+    """The trace entries in path, in time order."""
+    entries = sorted(read_trace(path), key=lambda entry: entry[0])
+    return entries[:limit] if limit else entries
+
+
+def with_certificate(value, certificate_pem):
+    if isinstance(value, dict):
+        return {k: certificate_pem if k == "certificatePEM" and isinstance(v, str) else with_certificate(v, certificate_pem)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [with_certificate(v, certificate_pem) for v in value]
+    return value
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[min(len(sorted_values), int(rank)) - 1]
+
+
+def replay(entries, routes, speed=1.0, clients=8, certificate_pem=None, timeout=10):
+    """
+    Send entries and return one result per request:
+    {"route", "status", "recorded_status", "response_ms", "service_ms"}.
+    status is None when the request failed without an HTTP answer. Without
+    certificate_pem, requests to CERTIFICATE_ROUTES are not sent and their result
+    is {"route", "status": None, "recorded_status", "skipped": True}.
+    """
+    if speed <= 0 or clients < 1:
+        raise ValueError("speed must be positive and clients at least 1")
+    if not entries:
+        return []
+    results = []
+    results_lock = threading.Lock()
+    position = iter(range(len(entries)))
+    position_lock = threading.Lock()
+    first_ts = entries[0][0]
+    started = time.perf_counter()
+
+    def client():
+        session = requests.Session()
+        while True:
+            with position_lock:
+                index = next(position, None)
+            if index is None:
+                break
+            ts, method, path, body, recorded_status = entries[index][:5]
+            route = urlsplit(path).path
+            if certificate_pem is None and route in CERTIFICATE_ROUTES:
+                with results_lock:
+                    results.append({"route": route, "status": None, "recorded_status": recorded_status, "skipped": True})
+                continue
+            due = started + (ts - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            url = routes.get(route)
+            status = None
+            sent = time.perf_counter()
+            if url is not None:
+                query = urlsplit(path).query
+                if certificate_pem is not None:
+                    body = with_certificate(body, certificate_pem)
+                try:
+                    response = session.request(method, url + ("?" + query if query else ""), json=body, timeout=timeout)
+                    status = response.status_code
+                except requests.RequestException as e:
+                    print(f"[traffic_replay] {method} {route} failed: {e}")
+            done = time.perf_counter()
+            with results_lock:
+                results.append({"route": route, "status": status, "recorded_status": recorded_status,
+                                "response_ms": (done - due) * 1000, "service_ms": (done - sent) * 1000})
+        session.close()
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    skipped = sorted({r["route"] for r in results if r.get("skipped")})
+    if skipped:
+        print(f"[traffic_replay] Skipped {', '.join(skipped)}: their placeholder certificates would be rejected; pass --certificate to replay them")
+    return results
+
+
+def summarize(results, elapsed=None):
+    """
+    Latency percentiles and status counts per route, plus an "all" row. Skipped
+    requests are counted under "skipped" and kept out of everything else.
+    """
+    by_route = {}
+    for result in results:
+        by_route.setdefault(result["route"], []).append(result)
+    by_route["all"] = results
+    summary = {}
+    for route, rows in by_route.items():
+        skipped = sum(1 for r in rows if r.get("skipped"))
+        rows = [r for r in rows if not r.get("skipped")]
+        response = sorted(r["response_ms"] for r in rows)
+        service = sorted(r["service_ms"] for r in rows)
+        statuses = {}
+        for r in rows:
+            statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+        summary[route] = {
+            "requests": len(rows),
+            "statuses": statuses,
+            "status_changed": sum(1 for r in rows if r["status"] != r["recorded_status"]),
+            "skipped": skipped,
+            "response_ms": {f"p{q:g}": percentile(response, q) for q in PERCENTILES} | {"max": response[-1] if response else None},
+            "service_ms": {f"p{q:g}": percentile(service, q) for q in PERCENTILES} | {"max": service[-1] if service else None},
+        }
+        if elapsed:
+            summary[route]["rate"] = len(rows) / elapsed
+    return summary
+
+
+def print_summary(summary):
+    columns = [f"p{q:g}" for q in PERCENTILES] + ["max"]
+    print(f"{'route':<18}{'requests':>9}{'rate/s':>9}  " + "".join(f"{c:>10}" for c in columns) + "  statuses")
+    for route, row in summary.items():
+        for kind in ("response_ms", "service_ms"):
+            label = route if kind == "response_ms" else ""
+            values = "".join(f"{row[kind][c]:>10.1f}" if row[kind][c] is not None else f"{'-':>10}" for c in columns)
+            counts = f"{row['requests']:>9}{row.get('rate', 0):>9.1f}" if kind == "response_ms" else " " * 18
+            statuses = " ".join(f"{k}:{v}" for k, v in sorted(row["statuses"].items())) if kind == "response_ms" else ""
+            if kind == "response_ms" and row["skipped"]:
+                statuses += f" skipped:{row['skipped']}"
+            print(f"{label:<18}{counts}  {values}  {kind[:-3]} {statuses}")
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay a recorded registry trace and report latency distributions.")
+    parser.add_argument("trace")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--host", help="send to this host instead of localhost (default ports)")
+    parser.add_argument("--url", action="append", default=[], metavar="PATH=URL", help="route one request path elsewhere")
+    parser.add_argument("--certificate", help="PEM file to use in place of the anonymized certificates")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+    routes = default_routes(args.host)
+    for override in args.url:
+        path, _, url = override.partition("=")
+        routes[path] = url
+    certificate_pem = None
+    if args.certificate:
+        with open(args.certificate) as f:
+            certificate_pem = f.read()
+    entries = load_trace(args.trace, args.limit)
+    started = time.perf_counter()
+    results = replay(entries, routes, args.speed, args.clients, certificate_pem)
+    summary = summarize(results, time.perf_counter() - started)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)